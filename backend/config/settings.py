@@ -14,11 +14,179 @@ class Settings:
     ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60))
     ALLOWED_ORIGINS = ["http://localhost:3000"]
     PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+    ZILLIZ_URI = os.getenv("ZILLIZ_URI")
+    ZILLIZ_TOKEN = os.getenv("ZILLIZ_TOKEN")
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
     # Model settings
+    # Route every chat completion to an OpenAI-compatible server (Ollama, vLLM, llama.cpp)
     LOCAL_LLM: bool = os.getenv("LOCAL_LLM", "false").lower() == "true"
+    LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", "http://localhost:11434/v1")
+    LOCAL_LLM_API_KEY = os.getenv("LOCAL_LLM_API_KEY", "local")
+    LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "llama3.2:3b")
+    # JSON map of hosted to local model names, e.g. {"meta-llama/llama-4-scout-17b-16e-instruct": "llava"}
+    LOCAL_LLM_MODELS = os.getenv("LOCAL_LLM_MODELS")
+    # "live" calls OpenAI/Groq/Gemini, "stub" answers offline from canned templates
+    LLM_BACKEND: str = os.getenv("LLM_BACKEND", "live").lower()
+    LLM_STUB_LATENCY_MS: float = float(os.getenv("LLM_STUB_LATENCY_MS", 50))
+    LLM_STUB_JITTER_MS: float = float(os.getenv("LLM_STUB_JITTER_MS", 0))
+    LLM_STUB_FAILURE_RATE: float = float(os.getenv("LLM_STUB_FAILURE_RATE", 0))
+    LLM_STUB_SEED: int = int(os.getenv("LLM_STUB_SEED", 42))
+    LLM_STUB_RESPONSES_PATH = os.getenv("LLM_STUB_RESPONSES_PATH")
+
+    # LLM gateway connection pools (shared keep-alive clients per provider)
+    LLM_HTTP_MAX_CONNECTIONS: int = int(os.getenv("LLM_HTTP_MAX_CONNECTIONS", 100))
+    LLM_HTTP_MAX_KEEPALIVE: int = int(os.getenv("LLM_HTTP_MAX_KEEPALIVE", 20))
+    LLM_HTTP_KEEPALIVE_EXPIRY: float = float(
+        os.getenv("LLM_HTTP_KEEPALIVE_EXPIRY", 60)
+    )
+    LLM_HTTP_TIMEOUT: float = float(os.getenv("LLM_HTTP_TIMEOUT", 60))
+    LLM_HTTP_CONNECT_TIMEOUT: float = float(os.getenv("LLM_HTTP_CONNECT_TIMEOUT", 5))
+    # SDK-level retries; the gateway limiter retries with backoff on its own
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", 0))
+
+    # Share one upstream call between concurrent identical LLM/embedding requests
+    LLM_COALESCE: bool = os.getenv("LLM_COALESCE", "true").lower() == "true"
+
+    # Model tiers per task: cheapest model first, low-confidence replies escalate
+    MODEL_TIERING: bool = os.getenv("MODEL_TIERING", "true").lower() == "true"
+    # JSON overrides, e.g. {"router_agent": ["openai/gpt-4.1-nano", "openai/gpt-4o-mini"]}
+    MODEL_TIERS = os.getenv("MODEL_TIERS")
+    MODEL_TIER_MIN_CONFIDENCE: float = float(
+        os.getenv("MODEL_TIER_MIN_CONFIDENCE", 0.8)
+    )
+
+    # Hedged requests and provider failover
+    LLM_HEDGING: bool = os.getenv("LLM_HEDGING", "true").lower() == "true"
+    LLM_FAILOVER: bool = os.getenv("LLM_FAILOVER", "true").lower() == "true"
+    # JSON overrides, e.g. {"openai/gpt-4o-mini": ["groq/llama-3.3-70b-versatile"]}
+    LLM_FALLBACKS = os.getenv("LLM_FALLBACKS")
+    LLM_HEDGE_MIN_SAMPLES: int = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+    LLM_HEDGE_MIN_DELAY: float = float(os.getenv("LLM_HEDGE_MIN_DELAY", 1.0))
+    LLM_HEDGE_MAX_DELAY: float = float(os.getenv("LLM_HEDGE_MAX_DELAY", 30.0))
+    # Delay before a route has LLM_HEDGE_MIN_SAMPLES latencies
+    LLM_HEDGE_DEFAULT_DELAY: float = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", 4.0))
+    # JSON overrides by stage or route, e.g. {"interpret_report": 5, "groq/...": 2}
+    LLM_HEDGE_DELAYS = os.getenv("LLM_HEDGE_DELAYS")
+    # Concurrent hedge attempts of sync calls; first attempts run in the caller
+    LLM_HEDGE_THREADS: int = int(os.getenv("LLM_HEDGE_THREADS", 16))
+    LLM_BREAKER_FAILURES: int = int(os.getenv("LLM_BREAKER_FAILURES", 5))
+    LLM_BREAKER_COOLDOWN: float = float(os.getenv("LLM_BREAKER_COOLDOWN", 30))
+
+    # LLM admission control (per provider/model token buckets)
+    # JSON overrides, e.g. {"groq/llama-3.3-70b-versatile": {"rpm": 30, "tpm": 6000}}
+    LLM_RATE_LIMITS = os.getenv("LLM_RATE_LIMITS")
+    LLM_DEFAULT_RPM: int = int(os.getenv("LLM_DEFAULT_RPM", 60))
+    LLM_DEFAULT_TPM: int = int(os.getenv("LLM_DEFAULT_TPM", 0))
+    LLM_MAX_QUEUE: int = int(os.getenv("LLM_MAX_QUEUE", 100))
+    LLM_MAX_ATTEMPTS: int = int(os.getenv("LLM_MAX_ATTEMPTS", 4))
+    LLM_BACKOFF_BASE_SECONDS: float = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", 0.5))
+    LLM_BACKOFF_MAX_SECONDS: float = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", 20))
+
+    # Agent settings
+    SPECULATIVE_RETRIEVAL: bool = (
+        os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+    )
+    # RAG components are built in the background after startup (or on first
+    # use); requests wait at most RAG_INIT_WAIT_SECONDS for them, then degrade
+    RAG_INIT_ON_STARTUP: bool = (
+        os.getenv("RAG_INIT_ON_STARTUP", "true").lower() == "true"
+    )
+    RAG_INIT_WAIT_SECONDS: float = float(os.getenv("RAG_INIT_WAIT_SECONDS", 5))
+    RAG_INIT_RETRY_SECONDS: float = float(os.getenv("RAG_INIT_RETRY_SECONDS", 30))
+    # Vector search for RAG: "remote" (Pinecone / Zilliz) or "local" (in-process
+    # memory-mapped index built with scripts/build_local_index.py)
+    VECTOR_BACKEND: str = os.getenv("VECTOR_BACKEND", "remote").lower()
+    LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", "data/vector_index")
+    # IVF lists scanned per query; LOCAL_INDEX_EXACT scans every vector instead
+    LOCAL_INDEX_NPROBE: int = int(os.getenv("LOCAL_INDEX_NPROBE", 8))
+    LOCAL_INDEX_EXACT: bool = os.getenv("LOCAL_INDEX_EXACT", "false").lower() == "true"
+    # Fuse vector search with BM25 keyword search (reciprocal rank fusion) when
+    # a BM25 index was built with scripts/build_bm25_index.py
+    HYBRID_RETRIEVAL: bool = os.getenv("HYBRID_RETRIEVAL", "true").lower() == "true"
+    BM25_INDEX_DIR = os.getenv("BM25_INDEX_DIR", "data/bm25_index")
+    # Candidates taken from each retriever, and fused chunks sent to the LLM
+    HYBRID_FETCH_K: int = int(os.getenv("HYBRID_FETCH_K", 20))
+    HYBRID_TOP_K: int = int(os.getenv("HYBRID_TOP_K", 5))
+    HYBRID_RRF_K: int = int(os.getenv("HYBRID_RRF_K", 60))
+    # Retrieved chunks are collapsed per answer, reordered by maximal marginal
+    # relevance and cut to a token budget before they are stuffed into prompts
+    CONTEXT_SELECTION: bool = (
+        os.getenv("CONTEXT_SELECTION", "true").lower() == "true"
+    )
+    CONTEXT_TOKEN_BUDGET: int = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+    # 1 keeps retrieval order, lower values favour diverse documents
+    CONTEXT_MMR_LAMBDA: float = float(os.getenv("CONTEXT_MMR_LAMBDA", 0.7))
+    # Time budget of one agent request across its LLM, database and vector
+    # search stages; clients may ask for less with an X-Request-Timeout header
+    AGENT_DEADLINE_SECONDS: float = float(os.getenv("AGENT_DEADLINE_SECONDS", 20))
+    # Stages are not started with less than this left
+    DEADLINE_MIN_STAGE_SECONDS: float = float(
+        os.getenv("DEADLINE_MIN_STAGE_SECONDS", 0.25)
+    )
+    # Fixed timeout of writes saving a finished answer (chat history, booking
+    # state), which do not draw on the request budget
+    DB_WRITE_TIMEOUT_SECONDS: float = float(os.getenv("DB_WRITE_TIMEOUT_SECONDS", 5))
+
+    # Vector store ingestion: source rows read per chunk, rows per embedding
+    # batch, batches embedded in parallel, and where resume checkpoints live
+    INGEST_READ_ROWS: int = int(os.getenv("INGEST_READ_ROWS", 1000))
+    INGEST_BATCH_ROWS: int = int(os.getenv("INGEST_BATCH_ROWS", 100))
+    INGEST_CONCURRENCY: int = int(os.getenv("INGEST_CONCURRENCY", 4))
+    INGEST_CHECKPOINT_DIR = os.getenv(
+        "INGEST_CHECKPOINT_DIR", "data/ingest_checkpoints"
+    )
+    # Pinecone: chunks per embedding request, vectors per upsert request and
+    # upsert requests in flight
+    PINECONE_EMBED_BATCH_SIZE: int = int(os.getenv("PINECONE_EMBED_BATCH_SIZE", 256))
+    PINECONE_UPSERT_BATCH_SIZE: int = int(
+        os.getenv("PINECONE_UPSERT_BATCH_SIZE", 100)
+    )
+    PINECONE_UPSERT_CONCURRENCY: int = int(
+        os.getenv("PINECONE_UPSERT_CONCURRENCY", 4)
+    )
+
+    # Input-token budget for blood-report Q&A prompts (/api/medical-query)
+    MEDICAL_QUERY_TOKEN_BUDGET: int = int(os.getenv("MEDICAL_QUERY_TOKEN_BUDGET", 1500))
+
+    # Batch agent queries
+    BATCH_QUERY_CONCURRENCY: int = int(os.getenv("BATCH_QUERY_CONCURRENCY", 8))
+    BATCH_QUERY_MAX_SIZE: int = int(os.getenv("BATCH_QUERY_MAX_SIZE", 500))
+
+    # Disease chat response cache
+    RESPONSE_CACHE_ENABLED: bool = (
+        os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+    )
+    RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 2000))
+    RESPONSE_CACHE_TTL_SECONDS: float = float(
+        os.getenv("RESPONSE_CACHE_TTL_SECONDS", 86400)
+    )
+    # Semantic matching costs one embedding call per cache miss
+    RESPONSE_CACHE_SEMANTIC: bool = (
+        os.getenv("RESPONSE_CACHE_SEMANTIC", "false").lower() == "true"
+    )
+    RESPONSE_CACHE_SIMILARITY: float = float(
+        os.getenv("RESPONSE_CACHE_SIMILARITY", 0.92)
+    )
+
+    # Query embedding cache: in-memory LRU plus a sqlite file kept across
+    # restarts (empty EMBEDDING_CACHE_PATH keeps it in memory only)
+    EMBEDDING_CACHE_ENABLED: bool = (
+        os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    )
+    EMBEDDING_CACHE_MAX_ENTRIES: int = int(
+        os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 10000)
+    )
+    EMBEDDING_CACHE_PATH = os.getenv(
+        "EMBEDDING_CACHE_PATH", "data/embedding_cache.sqlite3"
+    )
+    EMBEDDING_CACHE_DISK_MAX_ENTRIES: int = int(
+        os.getenv("EMBEDDING_CACHE_DISK_MAX_ENTRIES", 200000)
+    )
+
+    # LLM call ledger
+    LLM_LEDGER_MAX_RECORDS: int = int(os.getenv("LLM_LEDGER_MAX_RECORDS", 5000))
 
     # Email settings
     EMAIL_SENDER: str = os.getenv("EMAIL_SENDER")
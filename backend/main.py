@@ -4,8 +4,10 @@ from fastapi import (
     HTTPException,
     Depends,
     BackgroundTasks,
+    Request,
 )
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.security import OAuth2PasswordBearer
 import psycopg2
 from models.schemas import *
@@ -23,6 +25,10 @@ from routes.ai import router as ai_router
 from utils.pineconeutils import *
 from utils.email import *
 from utils.agents import *
+from utils.llm_ledger import current_request_id, new_request_id
+from utils.deadline import request_deadline
+from utils.pineconeutils import rag_readiness, start_rag_initialization
+from utils.llm_gateway import close_clients
 from contextlib import asynccontextmanager
 
 # Configure logging
@@ -35,7 +41,11 @@ init_db()
 @asynccontextmanager
 async def lifespan(app):
     await initialize_users()
+    # Pinecone setup runs in the background; RAG answers degrade until it is done
+    if settings.RAG_INIT_ON_STARTUP:
+        start_rag_initialization()
     yield
+    await close_clients()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -51,6 +61,40 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def assign_request_id(request: Request, call_next):
+    """Tag every request with an ID so LLM calls can be attributed to it, and
+    apply the deadline a client asks for with X-Request-Timeout (seconds)."""
+    request_id = request.headers.get("X-Request-ID") or new_request_id()
+    token = current_request_id.set(request_id)
+    try:
+        timeout = float(request.headers.get("X-Request-Timeout") or 0)
+    except ValueError:
+        timeout = 0
+    try:
+        # The client's own timeout bounds every stage of the request
+        with request_deadline(timeout if timeout > 0 else None):
+            response = await call_next(request)
+    finally:
+        current_request_id.reset(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+@app.get("/api/health/ready")
+async def readiness(strict: bool = False):
+    """Readiness probe. CRUD endpoints are served as soon as the app starts;
+    until the RAG system is ready the status is "degraded", which fails the
+    probe only when ``strict`` is set."""
+    rag = rag_readiness()
+    ready = rag["state"] == "ready"
+    body = {"status": "ready" if ready else "degraded", "rag": rag}
+    if strict and not ready:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+
 app.include_router(auth.router)
 app.include_router(hospital_router)
 app.include_router(doctor_router)
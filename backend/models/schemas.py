@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 
 
 class UserCreate(BaseModel):
@@ -216,6 +216,11 @@ class GeneralQueryRequest(BaseModel):
     query: str
 
 
+class BatchQueryRequest(BaseModel):
+    queries: List[str]
+    concurrency: Optional[int] = None  # Capped at settings.BATCH_QUERY_CONCURRENCY
+
+
 class AcneQueryRequest(BaseModel):
     query: Optional[str] = None
 
@@ -258,3 +263,13 @@ class EyeDiseaseChatRequest(BaseModel):
 
 class EyeDiseaseChatResponse(BaseModel):
     response: str
+
+
+class DiseaseChatRequest(BaseModel):
+    message: str
+    stream: bool = True
+
+
+class DiseaseChatResponse(BaseModel):
+    disease: str
+    response: str
@@ -7,11 +7,12 @@ from passlib.context import CryptContext
 from utils.agents import appointment_booking_agent
 import requests
 from starlette.exceptions import HTTPException as StarletteHTTPException
+from fastapi.responses import StreamingResponse
 import os
+import time
 import asyncio
 import re
 from utils.parser import *
-from openai import OpenAI
 from fastapi import (
     HTTPException,
     Depends,
@@ -29,12 +30,27 @@ import tensorflow as tf
 import gc
 from config.settings import settings
 from utils.ai_utils import *
-from utils.ai_utils import predict_breast_cancer_image, generate_groq_response
+from utils.ai_utils import (
+    predict_breast_cancer_image,
+    generate_groq_response,
+    disease_chat_reply,
+    stream_disease_chat,
+)
 from utils.prompts import *
+from utils.llm_ledger import ledger
+from utils.llm_limiter import limiter_metrics
+from utils.single_flight import single_flight_metrics
+from utils.llm_policy import route_policy
+from utils.response_cache import response_cache
+from utils.report_prompt import build_medical_query_messages, score_answer
+from utils.model_tiers import atiered_completion, tier_stats
+from utils.deadline import deadline_stats
+from utils.context_selection import context_stats
+from utils.embedding_cache import embedding_cache
 import re
 
-# Validate OpenAI API key
-if not settings.OPENAI_API_KEY:
+# Validate OpenAI API key (the offline stub backend needs none)
+if settings.LLM_BACKEND != "stub" and not settings.OPENAI_API_KEY:
     raise ValueError("OpenAI API key is not set in environment variables")
 
 router = APIRouter()
@@ -58,6 +74,41 @@ async def chatbot(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/api/admin/llm-ledger", response_model=dict)
+async def get_llm_ledger(
+    request_id: Optional[str] = None,
+    limit: int = 50,
+    current_user: dict = Depends(get_current_user),
+):
+    """Aggregated LLM call metrics, plus the calls of one request if given."""
+    if current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    result = {
+        "metrics": ledger.metrics(),
+        "admission": limiter_metrics(),
+        "coalescing": single_flight_metrics(),
+        "routing": route_policy.metrics(),
+        "tiers": tier_stats.metrics(),
+        "deadlines": deadline_stats.metrics(),
+        "context": context_stats.metrics(),
+    }
+    if request_id:
+        result["calls"] = [r.model_dump() for r in ledger.request_calls(request_id)]
+    else:
+        result["calls"] = [r.model_dump() for r in ledger.recent(limit)]
+    return result
+
+
+@router.get("/api/admin/response-cache", response_model=dict)
+async def get_response_cache_stats(current_user: dict = Depends(get_current_user)):
+    """Hit-rate metrics of the disease chat response cache and the query
+    embedding cache."""
+    if current_user["role"] != "superadmin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return {**response_cache.metrics(), "embeddings": embedding_cache.metrics()}
+
+
 @router.get("/api/emergency/hospitals", response_model=dict)
 async def get_nearby_hospitals(
     lat: float, lng: float, current_user: dict = Depends(get_current_user)
@@ -167,66 +218,26 @@ async def medical_query(
             effective_query = query.strip()
             logger.info(f"Effective query for follow-up: {effective_query}")
 
-        prompt = f"""
-            Analyze the blood test results and answer questions using these guidelines:
-            1. Keep answers concise (100-150 words) and easy to understand.
-            2. Use simple analogies to explain medical concepts.
-            3. Break down medical terms into plain language.
-            4. If values are abnormal:
-               - Explain what they mean
-               - Discuss possible causes
-               - Suggest reasonable next steps
-            5. For concerning values, indicate urgency level (routine/moderate/immediate attention).
-            6. Always remind that this is for informational purposes, not a diagnosis.
-            7. Format in clear sections:
-               - Summary of findings
-               - Explanation of key values
-               - Recommendations
-
-            For CBC analysis, focus on:
-            - Red blood cell count (RBC), hemoglobin, hematocrit (normal ranges: males 4.5-6.1 million/mcL, 13-17 g/dL, 40-55%; females 4.0-5.4 million/mcL, 11.5-15.5 g/dL, 36-48%).
-            - White blood cell count (WBC, normal 4,000-10,000/mcL) and differential (e.g., neutrophils, lymphocytes).
-            - Platelet count (normal 150,000-400,000/mcL).
-            - If available, mean corpuscular volume (MCV, normal 80-100 fL), mean corpuscular hemoglobin (MCH, normal 27-31 pg), and red cell distribution width (RDW, normal 12-15%).
-            - Compare results to normal ranges, explain abnormalities, and suggest possible causes (e.g., anemia, infection).
-
-            Current Query: {effective_query}
-        """
-
-        if json_output:
-            patient_age = json_output.get("patient_info", {}).get("age", "Unknown")
-            patient_gender = json_output.get("patient_info", {}).get(
-                "gender", "Unknown"
-            )
-            prompt += f"""
-                Patient Age: {patient_age}
-                Patient Gender: {patient_gender}
-                Blood Test Results (JSON):
-                {json.dumps(json_output, indent=2)}
-            """
-        else:
-            prompt += "\nNo blood test results available."
-
-        logger.info(f"Sending prompt to Groq API: {prompt[:100]}...")
-        # Call OpenAI API
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are an expert medical professional specialized in analyzing blood test results and explaining them in simple terms.",
-                },
-                {
-                    "role": "user",
-                    "content": prompt,
-                },
-            ],
-            model="gpt-4o-mini",  # Using GPT-4 for medical analysis
+        messages, prompt_stats = build_medical_query_messages(
+            effective_query, json_output
+        )
+        logger.info(
+            f"medical_query prompt: {prompt_stats.input_tokens} tokens "
+            f"({prompt_stats.saved_tokens} saved vs full report), "
+            f"{prompt_stats.tests_included}/{prompt_stats.tests_total} tests"
+        )
+        started = time.perf_counter()
+        completion, _, _ = await atiered_completion(
+            "medical_query",
+            ("openai", "gpt-4o-mini"),  # Using GPT-4 for medical analysis
+            messages,
+            score_answer,
             temperature=0.3,  # Lower temperature for more factual responses
         )
+        prompt_stats.llm_latency_ms = round((time.perf_counter() - started) * 1000, 1)
 
         # Extract the response
-        raw_response = chat_completion.choices[0].message.content
+        raw_response = completion.text
         if not raw_response:
             logger.error("No content in Groq API response")
             raise HTTPException(
@@ -261,7 +272,11 @@ async def medical_query(
 
         logger.info("Query processed successfully")
         await asyncio.sleep(5)  # Add 10-second delay before returning response
-        return {"structured_report": json_output, "response": response}
+        return {
+            "structured_report": json_output,
+            "response": response,
+            "prompt_stats": prompt_stats.model_dump(),
+        }
     except Exception as e:
         logger.error(f"Error processing query: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
@@ -323,6 +338,88 @@ async def general_query(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def normalize_batch_query(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+
+@router.post("/api/general-query/batch")
+async def general_query_batch(
+    request: BatchQueryRequest, current_user: dict = Depends(get_current_user)
+):
+    """Run many general queries through the agent and stream results as NDJSON.
+
+    Identical queries (ignoring case and whitespace) run once and their result
+    is emitted for every index that asked it. Lines arrive in completion order
+    and carry the index of the query they answer.
+    """
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="At least one query is required")
+    if len(request.queries) > settings.BATCH_QUERY_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A batch may contain at most {settings.BATCH_QUERY_MAX_SIZE} queries",
+        )
+
+    user_id = current_user["user_id"]
+    concurrency = min(
+        request.concurrency or settings.BATCH_QUERY_CONCURRENCY,
+        settings.BATCH_QUERY_CONCURRENCY,
+    )
+    concurrency = max(concurrency, 1)
+
+    # Deduplicate: normalized query -> indexes in the submitted batch
+    groups = {}
+    empty_indexes = []
+    for index, query in enumerate(request.queries):
+        if not query.strip():
+            empty_indexes.append(index)
+            continue
+        groups.setdefault(normalize_batch_query(query), []).append(index)
+    logger.info(
+        f"Batch of {len(request.queries)} queries for user {user_id}: "
+        f"{len(groups)} unique, concurrency {concurrency}"
+    )
+
+    async def run_batch():
+        for index in empty_indexes:
+            yield json.dumps(
+                {"index": index, "error": "A non-empty query is required"}
+            ) + "\n"
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def run_one(key: str):
+            query = request.queries[groups[key][0]]
+            async with semaphore:
+                try:
+                    # Batch items are independent, never continue a booking
+                    result = await appointment_booking_agent(
+                        query, user_id, stateful=False
+                    )
+                    return key, result, None
+                except Exception as e:
+                    logger.error(f"Batch query failed: {query!r}: {e}")
+                    return key, None, str(e)
+
+        tasks = [asyncio.create_task(run_one(key)) for key in groups]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                key, result, error = await next_done
+                for index in groups[key]:
+                    line = {"index": index, "query": request.queries[index]}
+                    if error:
+                        line["error"] = error
+                    else:
+                        line["response"] = result.get("response")
+                    yield json.dumps(line, default=str) + "\n"
+        finally:
+            # Client disconnected or the stream failed: stop outstanding work
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(run_batch(), media_type="application/x-ndjson")
+
+
 @router.post("/api/disease-followup")
 async def disease_followup(
     request: dict = Body(...), current_user: dict = Depends(get_current_user)
@@ -516,101 +613,101 @@ async def eye_disease_image_classification(
         )
 
 
-@router.post("/api/eye-disease-chat", response_model=EyeDiseaseChatResponse)
-async def eye_disease_chat(
-    request: EyeDiseaseChatRequest, current_user: dict = Depends(get_current_user)
+@router.post("/api/disease-chat/{disease}")
+async def disease_chat(
+    request: DiseaseChatRequest,
+    disease: str = Path(..., description="Key of DISEASE_CHAT_PROMPTS"),
+    current_user: dict = Depends(get_current_user),
 ):
     """
-    Chatbot endpoint for eye disease questions using Gemini.
+    Disease chatbot driven by the prompt registry, with per-disease context.
+    Streams NDJSON lines ({"delta": ...} then {"done": true}) unless stream is false.
+    """
+    if disease not in DISEASE_CHAT_PROMPTS:
+        raise HTTPException(status_code=404, detail=f"Unknown disease chat: {disease}")
+    logger.info(f"Received {disease} chat message: {request.message[:50]}...")
+
+    if not request.stream:
+        try:
+            assistant_response = await disease_chat_reply(
+                disease, request.message, current_user["user_id"]
+            )
+        except Exception as e:
+            logger.error(f"Error generating {disease} chat response: {str(e)}")
+            raise HTTPException(
+                status_code=500, detail=f"Error generating response: {str(e)}"
+            )
+        return DiseaseChatResponse(disease=disease, response=assistant_response)
+
+    async def stream_reply():
+        try:
+            async for delta in stream_disease_chat(
+                disease, request.message, current_user["user_id"]
+            ):
+                yield json.dumps({"delta": delta}) + "\n"
+            yield json.dumps({"done": True}) + "\n"
+        except Exception as e:
+            logger.error(f"Error streaming {disease} chat response: {str(e)}")
+            yield json.dumps({"error": f"Error generating response: {str(e)}"}) + "\n"
+
+    return StreamingResponse(stream_reply(), media_type="application/x-ndjson")
+
+
+async def _disease_chat_alias(
+    disease: str, request: EyeDiseaseChatRequest, current_user: dict
+) -> EyeDiseaseChatResponse:
+    """Non-streaming /api/disease-chat/{disease} for the legacy per-disease routes.
+
+    Stateless like the routes it replaces: no conversation context is kept.
     """
     try:
-        logger.info(f"Received eye disease chat message: {request.message[:50]}...")
-        assistant_response = await generate_groq_response(
-            request.message, system_prompt=EYE_DISEASE_PROMPT
+        logger.info(f"Received {disease} chat message: {request.message[:50]}...")
+        assistant_response = await disease_chat_reply(
+            disease, request.message, current_user["user_id"], stateful=False
         )
         return EyeDiseaseChatResponse(response=assistant_response)
     except Exception as e:
-        logger.error(f"Error generating eye disease chat response: {str(e)}")
+        logger.error(f"Error generating {disease} chat response: {str(e)}")
         raise HTTPException(
             status_code=500, detail=f"Error generating response: {str(e)}"
         )
 
 
+@router.post("/api/eye-disease-chat", response_model=EyeDiseaseChatResponse)
+async def eye_disease_chat(
+    request: EyeDiseaseChatRequest, current_user: dict = Depends(get_current_user)
+):
+    """Alias of /api/disease-chat/eye-disease without streaming."""
+    return await _disease_chat_alias("eye-disease", request, current_user)
+
+
 @router.post("/api/lymphoma-chat", response_model=EyeDiseaseChatResponse)
 async def lymphoma_chat(
     request: EyeDiseaseChatRequest, current_user: dict = Depends(get_current_user)
 ):
-    """
-    Chatbot endpoint for lymphoma questions using Gemini.
-    """
-    try:
-        logger.info(f"Received lymphoma chat message: {request.message[:50]}...")
-        assistant_response = await generate_groq_response(
-            request.message, system_prompt=LYMPHOMA_DISEASE_PROMPT
-        )
-        return EyeDiseaseChatResponse(response=assistant_response)
-    except Exception as e:
-        logger.error(f"Error generating lymphoma chat response: {str(e)}")
-        raise HTTPException(
-            status_code=500, detail=f"Error generating response: {str(e)}"
-        )
+    """Alias of /api/disease-chat/lymphoma without streaming."""
+    return await _disease_chat_alias("lymphoma", request, current_user)
 
 
 @router.post("/api/pneumonia-chat", response_model=EyeDiseaseChatResponse)
 async def pneumonia_chat(
     request: EyeDiseaseChatRequest, current_user: dict = Depends(get_current_user)
 ):
-    """
-    Chatbot endpoint for pneumonia questions using Gemini.
-    """
-    try:
-        logger.info(f"Received pneumonia chat message: {request.message[:50]}...")
-        assistant_response = await generate_groq_response(
-            request.message, system_prompt=PNEUMONIA_PROMPT
-        )
-        return EyeDiseaseChatResponse(response=assistant_response)
-    except Exception as e:
-        logger.error(f"Error generating pneumonia chat response: {str(e)}")
-        raise HTTPException(
-            status_code=500, detail=f"Error generating response: {str(e)}"
-        )
+    """Alias of /api/disease-chat/pneumonia without streaming."""
+    return await _disease_chat_alias("pneumonia", request, current_user)
 
 
 @router.post("/api/breast-cancer-chat", response_model=EyeDiseaseChatResponse)
 async def breast_cancer_chat(
     request: EyeDiseaseChatRequest, current_user: dict = Depends(get_current_user)
 ):
-    """
-    Chatbot endpoint for breast cancer questions using Gemini.
-    """
-    try:
-        logger.info(f"Received breast cancer chat message: {request.message[:50]}...")
-        assistant_response = await generate_groq_response(
-            request.message, system_prompt=BREAST_CANCER_PROMPT
-        )
-        return EyeDiseaseChatResponse(response=assistant_response)
-    except Exception as e:
-        logger.error(f"Error generating breast cancer chat response: {str(e)}")
-        raise HTTPException(
-            status_code=500, detail=f"Error generating response: {str(e)}"
-        )
+    """Alias of /api/disease-chat/breast-cancer without streaming."""
+    return await _disease_chat_alias("breast-cancer", request, current_user)
 
 
 @router.post("/api/kidney-disease-chat", response_model=EyeDiseaseChatResponse)
 async def kidney_disease_chat(
     request: EyeDiseaseChatRequest, current_user: dict = Depends(get_current_user)
 ):
-    """
-    Chatbot endpoint for kidney disease questions using Gemini.
-    """
-    try:
-        logger.info(f"Received kidney disease chat message: {request.message[:50]}...")
-        assistant_response = await generate_groq_response(
-            request.message, system_prompt=KIDNEY_DISEASE_PROMPT
-        )
-        return EyeDiseaseChatResponse(response=assistant_response)
-    except Exception as e:
-        logger.error(f"Error generating kidney disease chat response: {str(e)}")
-        raise HTTPException(
-            status_code=500, detail=f"Error generating response: {str(e)}"
-        )
+    """Alias of /api/disease-chat/kidney-disease without streaming."""
+    return await _disease_chat_alias("kidney-disease", request, current_user)
@@ -729,9 +729,12 @@ async def summarize_patient_history(
 
     # Use LLM to summarize
     from utils.agents import llm
+    from utils.llm_ledger import ledger_callbacks
 
     prompt = f"Summarize the following medical history for a doctor in a concise, clinically useful way.\n\n{history_text}"
-    summary = llm.invoke(prompt)
+    summary = llm.invoke(
+        prompt, config=ledger_callbacks("summarize_patient_history", "openai")
+    )
     # If summary is an object (e.g., AIMessage), extract the string content
     if hasattr(summary, "content"):
         summary = summary.content
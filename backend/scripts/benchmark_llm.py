@@ -0,0 +1,214 @@
+"""Compare hosted LLM providers with the local OpenAI-compatible backend.
+
+Runs the router, report-structuring and disease-chat workloads through the
+LLM gateway and reports latency percentiles and throughput per backend.
+
+Usage (from backend/):
+    python -m scripts.benchmark_llm --requests 20 --concurrency 4
+    python -m scripts.benchmark_llm --backends local --workloads router,disease-chat
+"""
+
+import json
+import asyncio
+import argparse
+import logging
+import time
+from typing import Callable, Dict, List, Tuple
+from langchain_core.prompts import ChatPromptTemplate
+from config.settings import settings
+from utils.llm_gateway import achat_completion, close_clients
+from utils.prompts import DISEASE_CHAT_PROMPTS, ROUTER_AGENT_PROMPT
+
+logger = logging.getLogger(__name__)
+
+DEPARTMENTS = [
+    "Department of Dermatology",
+    "Department of Cardiology",
+    "Department of Neurology",
+    "Department of Ophthalmology",
+    "Department of Nephrology",
+]
+
+ROUTER_QUERIES = [
+    "What is acne?",
+    "List hospitals",
+    "List available doctors for acne?",
+    "What are the early symptoms of diabetes?",
+    "Book appointment with doctorderma on Monday, 2025-05-05 from 09:00 to 09:30",
+    "Which doctors treat migraines?",
+    "How is high blood pressure treated?",
+    "Show me cardiologists available this week",
+]
+
+DISEASE_QUESTIONS = [
+    ("eye-disease", "What causes glaucoma?"),
+    ("lymphoma", "What is the difference between Hodgkin and non-Hodgkin lymphoma?"),
+    ("pneumonia", "How long does recovery from pneumonia take?"),
+    ("breast-cancer", "What are the warning signs of breast cancer?"),
+    ("kidney-disease", "Can kidney stones come back after treatment?"),
+]
+
+SAMPLE_REPORT = """Patient Name: Sample Patient
+Age: 34 Y 0 M 0 D   Gender: Male
+HAEMATOLOGY
+Test                 Result    Unit        Reference Range
+Haemoglobin          11.2      g/dL        13.0 - 17.0
+RBC Count            4.1       million/uL  4.5 - 5.5
+Hematocrit (PCV)     36.5      %           40 - 50
+MCV                  78        fL          83 - 101
+MCH                  26.1      pg          27 - 32
+MCHC                 31.0      g/dL        31.5 - 34.5
+RDW                  16.2      %           11.6 - 14.0
+WBC Count            12580     /uL         4000 - 10000
+Neutrophils          74        %           40 - 80
+Lymphocytes          19        %           20 - 40
+Platelet Count       265000    /uL         150000 - 410000
+"""
+
+
+def router_messages(i: int) -> List[Dict]:
+    prompt = ChatPromptTemplate.from_template(ROUTER_AGENT_PROMPT).format(
+        query=ROUTER_QUERIES[i % len(ROUTER_QUERIES)],
+        departments=", ".join(DEPARTMENTS),
+    )
+    return [{"role": "user", "content": prompt}]
+
+
+def structuring_messages(i: int) -> List[Dict]:
+    from utils.parser import build_structure_messages
+
+    return build_structure_messages(SAMPLE_REPORT.replace("34 Y", f"{30 + i % 40} Y"))
+
+
+def disease_chat_messages(i: int) -> List[Dict]:
+    disease, question = DISEASE_QUESTIONS[i % len(DISEASE_QUESTIONS)]
+    return [
+        {"role": "system", "content": DISEASE_CHAT_PROMPTS[disease]},
+        {"role": "user", "content": question},
+    ]
+
+
+# name -> (hosted provider, model, stage, message builder, call params)
+WORKLOADS: Dict[str, Tuple[str, str, str, Callable[[int], List[Dict]], Dict]] = {
+    "router": (
+        "openai",
+        "gpt-4o-mini",
+        "router_agent",
+        router_messages,
+        {"temperature": 0.3},
+    ),
+    "structuring": (
+        "openai",
+        "gpt-4o-mini",
+        "structure_report",
+        structuring_messages,
+        {"temperature": 0.1, "response_format": {"type": "json_object"}},
+    ),
+    "disease-chat": (
+        "groq",
+        "llama-3.3-70b-versatile",
+        "generate_groq_response",
+        disease_chat_messages,
+        {},
+    ),
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def run_workload(name: str, backend: str, requests: int, concurrency: int) -> Dict:
+    provider, model, stage, build_messages, params = WORKLOADS[name]
+    target = "local" if backend == "local" else provider
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    completion_tokens = 0
+    errors = 0
+
+    async def one(i: int):
+        nonlocal completion_tokens, errors
+        messages = build_messages(i)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await achat_completion(
+                    target, model, messages, stage=stage, **params
+                )
+            except Exception as e:
+                errors += 1
+                logger.warning(f"{name}/{backend} request {i} failed: {e}")
+                return
+            latencies.append((time.perf_counter() - started) * 1000)
+            completion_tokens += result.completion_tokens
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - started
+    return {
+        "workload": name,
+        "backend": backend,
+        "model": settings.LOCAL_LLM_MODEL if backend == "local" else model,
+        "requests": requests,
+        "errors": errors,
+        "mean_ms": round(sum(latencies) / len(latencies), 1) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.5), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "completion_tokens_per_s": round(completion_tokens / wall, 1),
+    }
+
+
+def print_table(results: List[Dict]):
+    columns = [
+        "workload",
+        "backend",
+        "model",
+        "errors",
+        "p50_ms",
+        "p95_ms",
+        "throughput_rps",
+        "completion_tokens_per_s",
+    ]
+    widths = {c: max(len(c), *(len(str(r[c])) for r in results)) for c in columns}
+    print("  ".join(c.ljust(widths[c]) for c in columns))
+    for r in results:
+        print("  ".join(str(r[c]).ljust(widths[c]) for c in columns))
+
+
+async def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--backends", default="hosted,local")
+    arg_parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    arg_parser.add_argument("--requests", type=int, default=20)
+    arg_parser.add_argument("--concurrency", type=int, default=4)
+    arg_parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = arg_parser.parse_args()
+
+    # Measure raw backends: no redirection, sharing, hedging or failover
+    settings.LOCAL_LLM = False
+    settings.LLM_COALESCE = False
+    settings.LLM_HEDGING = False
+    settings.LLM_FAILOVER = False
+
+    results = []
+    for name in args.workloads.split(","):
+        for backend in args.backends.split(","):
+            logger.info(f"Running {name} on {backend}")
+            results.append(
+                await run_workload(name, backend, args.requests, args.concurrency)
+            )
+    await close_clients()
+
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""Build the BM25 keyword index used for hybrid retrieval.
+
+Indexes the same RAG Q&A chunks as the Pinecone or Zilliz ingestion, so BM25
+hits fuse with vector hits on identical documents. No embedding calls.
+
+Usage (from backend/):
+    python -m scripts.build_bm25_index data/rag/data.csv --target pinecone
+    python -m scripts.build_bm25_index data/rag/data.csv --target zilliz \\
+        --query "What are the side effects of metformin?"
+"""
+
+import time
+import argparse
+import logging
+import pandas as pd
+from scripts.build_local_index import TARGETS, pinecone_documents, zilliz_documents
+from utils.bm25_index import BM25Index, bm25_index_path
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("csv", help="Dataset with qtype, Question, Answer columns")
+    arg_parser.add_argument("--target", choices=TARGETS, default="pinecone")
+    arg_parser.add_argument("--k1", type=float, default=1.2)
+    arg_parser.add_argument("--b", type=float, default=0.75)
+    arg_parser.add_argument(
+        "--query", action="append", default=[], help="Sample query to search"
+    )
+    args = arg_parser.parse_args()
+
+    name = TARGETS[args.target][0]
+    df = pd.read_csv(args.csv)
+    if args.target == "pinecone":
+        # Chunks already hold "Q: ...\nA: ..."
+        _, documents = pinecone_documents(df)
+        texts = None
+    else:
+        # Zilliz documents are answer chunks; the question is searchable too
+        _, documents = zilliz_documents(df)
+        texts = [
+            f"{doc.metadata['Question']}\n{doc.page_content}" for doc in documents
+        ]
+
+    started = time.perf_counter()
+    index = BM25Index.build(
+        bm25_index_path(name),
+        documents,
+        texts=texts,
+        k1=args.k1,
+        b=args.b,
+        extra_meta={"source": args.csv},
+    )
+    print(
+        f"Built {index.path}: {index.count} documents, {len(index.terms)} terms "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+    for query in args.query:
+        started = time.perf_counter()
+        hits = index.search(query, k=5)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        print(f"\n{query!r} ({elapsed_ms:.2f} ms)")
+        for row, score in hits:
+            preview = index.document(row).page_content[:100].replace("\n", " ")
+            print(f"  {score:6.2f}  {preview}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,155 @@
+"""Build the in-process vector index used with VECTOR_BACKEND=local.
+
+Reads the RAG Q&A dataset (qtype, Question, Answer columns), chunks and embeds
+it the same way as the Pinecone or Zilliz ingestion, with the same ids and
+metadata, and writes a memory-mapped index under LOCAL_INDEX_DIR. Optionally
+benchmarks exact and IVF search.
+
+Usage (from backend/):
+    python -m scripts.build_local_index data/rag/data.csv --target pinecone
+    python -m scripts.build_local_index data/rag/data.csv --target zilliz \\
+        --dtype int8 --nlist 256 --benchmark 200
+"""
+
+import time
+import argparse
+import logging
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+from langchain_core.documents import Document
+from utils.llm_gateway import get_embeddings
+from utils.local_index import LocalVectorIndex, local_index_path
+
+logger = logging.getLogger(__name__)
+
+# target -> (index name, embedding provider, embedding model); must match the
+# constants in utils.pineconeutils and utils.zillisutils
+TARGETS = {
+    "pinecone": ("curewise-medical-rag", "openai", "text-embedding-3-small"),
+    "zilliz": ("medical_conversations_rag", "gemini", "models/embedding-001"),
+}
+
+
+def pinecone_documents(df: pd.DataFrame) -> Tuple[List[str], List[Document]]:
+    """Chunks with the ids and metadata pineconeutils ingests them under."""
+    # Imported here: each store module pulls in its own client library
+    from utils.pineconeutils import _row_records
+
+    records, _ = _row_records(df)
+    texts, documents = [], []
+    for record in records:
+        metadata = dict(record["metadata"])
+        # PineconeVectorStore returns "text" as the page content
+        text = metadata.pop("text")
+        texts.append(text)
+        documents.append(
+            Document(id=record["id"], page_content=text, metadata=metadata)
+        )
+    return texts, documents
+
+
+def zilliz_documents(df: pd.DataFrame) -> Tuple[List[str], List[Document]]:
+    """Answer chunks keyed by their question, as zillisutils.insert_dataframe."""
+    from utils.zillisutils import _row_records
+
+    # insert_dataframe's default chunk size (the Answer field's max length)
+    records, _ = _row_records(df, 65000)
+    texts, documents = [], []
+    for record in records:
+        texts.append(record["Question"])
+        documents.append(
+            Document(
+                id=record["id"],
+                page_content=record["Answer"],
+                metadata={
+                    "qtype": record["qtype"],
+                    "Question": record["Question"],
+                    "chunk_index": record["chunk_index"],
+                    "answer_group_id": record["answer_group_id"],
+                },
+            )
+        )
+    return texts, documents
+
+
+def embed(texts: List[str], provider: str, model: str, batch_size: int) -> np.ndarray:
+    embeddings = get_embeddings(provider, model)
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[start : start + batch_size]))
+        logger.info(f"Embedded {min(start + batch_size, len(texts))}/{len(texts)}")
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def benchmark(index: LocalVectorIndex, queries: np.ndarray, k: int, nprobe: int):
+    """Per-query latency of exact and IVF search, and IVF recall@k."""
+    exact_hits, exact_us = [], []
+    for query in queries:
+        started = time.perf_counter()
+        exact_hits.append({row for row, _ in index.search(query, k, exact=True)})
+        exact_us.append((time.perf_counter() - started) * 1e6)
+    print(f"exact: p50 {np.percentile(exact_us, 50):.0f} us/query")
+    if index.centroids is None:
+        return
+    ivf_us, recall = [], []
+    for query, truth in zip(queries, exact_hits):
+        started = time.perf_counter()
+        hits = {row for row, _ in index.search(query, k, nprobe=nprobe)}
+        ivf_us.append((time.perf_counter() - started) * 1e6)
+        recall.append(len(hits & truth) / max(len(truth), 1))
+    print(
+        f"ivf (nprobe={nprobe}): p50 {np.percentile(ivf_us, 50):.0f} us/query, "
+        f"recall@{k} {np.mean(recall):.3f}"
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("csv", help="Dataset with qtype, Question, Answer columns")
+    arg_parser.add_argument("--target", choices=TARGETS, default="pinecone")
+    arg_parser.add_argument("--dtype", choices=["float32", "int8"], default="float32")
+    arg_parser.add_argument(
+        "--nlist", type=int, help="IVF lists (default ~4*sqrt(n), 0 for exact only)"
+    )
+    arg_parser.add_argument("--batch-size", type=int, default=100)
+    arg_parser.add_argument(
+        "--benchmark", type=int, default=0, help="Queries to benchmark with"
+    )
+    arg_parser.add_argument("--nprobe", type=int, default=8)
+    args = arg_parser.parse_args()
+
+    name, provider, model = TARGETS[args.target]
+    df = pd.read_csv(args.csv)
+    build_documents = (
+        pinecone_documents if args.target == "pinecone" else zilliz_documents
+    )
+    texts, documents = build_documents(df)
+    vectors = embed(texts, provider, model, args.batch_size)
+    nlist = args.nlist if args.nlist is not None else int(4 * np.sqrt(len(vectors)))
+
+    started = time.perf_counter()
+    index = LocalVectorIndex.build(
+        local_index_path(name),
+        vectors,
+        documents,
+        ids=[doc.id for doc in documents],
+        dtype=args.dtype,
+        nlist=nlist,
+        extra_meta={"embedding_model": model, "source": args.csv},
+    )
+    print(
+        f"Built {index.path}: {index.count} vectors, {args.dtype}, {nlist} lists "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+
+    if args.benchmark:
+        rng = np.random.default_rng(0)
+        size = min(args.benchmark, len(vectors))
+        picks = rng.choice(len(vectors), size, replace=False)
+        benchmark(index, vectors[picks], k=10, nprobe=args.nprobe)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
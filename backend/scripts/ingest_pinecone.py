@@ -0,0 +1,67 @@
+"""Load the RAG Q&A dataset into the Pinecone index.
+
+Splits each Q&A pair into chunks, embeds them in parallel batches sized to
+the OpenAI per-request limits (and admitted by the gateway rate limiter),
+upserts with configurable batch size and concurrency, and reports
+vectors/sec. Interrupted runs resume from their checkpoint; rows already in
+the content-hash manifest are not embedded again.
+
+Usage (from backend/):
+    python -m scripts.ingest_pinecone data/rag/data.csv
+    python -m scripts.ingest_pinecone data/rag/data.csv --concurrency 8 \\
+        --upsert-batch-size 200 --upsert-concurrency 8
+    python -m scripts.ingest_pinecone data/rag/data.csv --sync
+"""
+
+import json
+import argparse
+import logging
+from config.settings import settings
+from utils.pineconeutils import ingest_csv
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("csv", help="Dataset with qtype, Question, Answer columns")
+    arg_parser.add_argument("--read-rows", type=int, default=settings.INGEST_READ_ROWS)
+    arg_parser.add_argument(
+        "--batch-rows", type=int, default=settings.INGEST_BATCH_ROWS
+    )
+    arg_parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=settings.INGEST_CONCURRENCY,
+        help="Embedding requests in flight",
+    )
+    arg_parser.add_argument(
+        "--upsert-batch-size", type=int, default=settings.PINECONE_UPSERT_BATCH_SIZE
+    )
+    arg_parser.add_argument(
+        "--upsert-concurrency", type=int, default=settings.PINECONE_UPSERT_CONCURRENCY
+    )
+    arg_parser.add_argument(
+        "--restart", action="store_true", help="Ignore checkpoint and manifest"
+    )
+    arg_parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Also delete vectors of rows no longer in the source",
+    )
+    args = arg_parser.parse_args()
+
+    stats = ingest_csv(
+        args.csv,
+        read_rows=args.read_rows,
+        batch_rows=args.batch_rows,
+        concurrency=args.concurrency,
+        upsert_batch_size=args.upsert_batch_size,
+        upsert_concurrency=args.upsert_concurrency,
+        restart=args.restart,
+        sync=args.sync,
+    )
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,98 @@
+"""Stream the RAG Q&A dataset into the Zilliz collection.
+
+Reads the CSV in chunks, embeds batches in parallel under the gateway rate
+limits and upserts as it goes. Progress is checkpointed under
+INGEST_CHECKPOINT_DIR; rerunning after a failure resumes from there. With
+--reindex only rows that are new or changed since the last run (per the
+content-hash manifest) are embedded, and removed rows are deleted.
+
+Usage (from backend/):
+    python -m scripts.ingest_zilliz data/rag/data.csv
+    python -m scripts.ingest_zilliz data/rag/data.csv --concurrency 8 --restart
+    python -m scripts.ingest_zilliz data/rag/data.csv --reindex
+    python -m scripts.ingest_zilliz data/rag/data.csv --dry-run
+"""
+
+import json
+import math
+import argparse
+import logging
+from config.settings import settings
+from utils.ingestion import dedupe_texts, read_csv_chunks
+
+# Same split of long answers as zillisutils.ingest_csv
+ANSWER_CHUNK_SIZE = 65000
+
+
+def embedding_savings(csv_path: str, read_rows: int, batch_rows: int) -> dict:
+    """Embedding calls and tokens saved by embedding each question once per
+    batch instead of once per answer chunk, without calling any API."""
+    chunks = embedded = chunk_chars = embedded_chars = 0
+    for frame in read_csv_chunks(csv_path, read_rows):
+        for start in range(0, len(frame), batch_rows):
+            batch = frame.iloc[start : start + batch_rows]
+            questions = []
+            for question, answer in zip(batch["Question"], batch["Answer"]):
+                count = math.ceil(len(str(answer)) / ANSWER_CHUNK_SIZE)
+                questions.extend([str(question)] * count)
+            unique, _ = dedupe_texts(questions)
+            chunks += len(questions)
+            embedded += len(unique)
+            chunk_chars += sum(map(len, questions))
+            embedded_chars += sum(map(len, unique))
+    return {
+        "vectors": chunks,
+        "embeddings": embedded,
+        "embeddings_saved": chunks - embedded,
+        "embedding_tokens_saved": (chunk_chars - embedded_chars) // 4,
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("csv", help="Dataset with qtype, Question, Answer columns")
+    arg_parser.add_argument("--read-rows", type=int, default=settings.INGEST_READ_ROWS)
+    arg_parser.add_argument(
+        "--batch-rows", type=int, default=settings.INGEST_BATCH_ROWS
+    )
+    arg_parser.add_argument(
+        "--concurrency", type=int, default=settings.INGEST_CONCURRENCY
+    )
+    arg_parser.add_argument(
+        "--restart", action="store_true", help="Ignore an existing checkpoint"
+    )
+    arg_parser.add_argument(
+        "--reindex",
+        action="store_true",
+        help="Sync with the source: upsert new/changed rows, delete removed ones",
+    )
+    arg_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only report the embeddings saved by per-question deduplication",
+    )
+    args = arg_parser.parse_args()
+
+    if args.dry_run:
+        stats = embedding_savings(args.csv, args.read_rows, args.batch_rows)
+        print(json.dumps(stats, indent=2))
+        return
+
+    # Imported here: --dry-run needs only pandas, not the Zilliz and LLM clients
+    from utils.zillisutils import ingest_csv, reindex_csv
+
+    options = {
+        "read_rows": args.read_rows,
+        "batch_rows": args.batch_rows,
+        "concurrency": args.concurrency,
+    }
+    if args.reindex:
+        stats = reindex_csv(args.csv, **options)
+    else:
+        stats = ingest_csv(args.csv, restart=args.restart, **options)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
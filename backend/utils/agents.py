@@ -1,11 +1,13 @@
 import psycopg2
-from typing import List, Dict, Optional, Callable
+from typing import List, Dict, Optional, Callable, Set
 from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel
 import re
 from config.settings import settings
 from utils.pineconeutils import (
-    retrieval_chain,
+    RAGUnavailableError,
+    aget_rag_components,
+    get_rag_components,
     get_general_chat_history,
     store_general_chat_history,
 )
@@ -14,14 +16,35 @@ import uuid
 import logging
 import json
 import asyncio
-import openai
-from openai import OpenAI
 from utils.email import send_confirmation_email
+from utils.llm_ledger import ledger_callbacks
+from utils.llm_gateway import get_chat_model
+from utils.model_tiers import parse_json_reply, tiered_completion
+from utils.single_flight import rag_flights, request_key
+from utils.deadline import (
+    DeadlineExceeded,
+    await_in_budget,
+    check_deadline,
+    db_deadline_options,
+    deadline_stats,
+    request_deadline,
+    run_in_budget,
+    time_left,
+)
+from utils.prompts import ROUTER_AGENT_PROMPT
+from utils.booking_state import (
+    BookingState,
+    FollowUp,
+    get_booking_state,
+    save_booking_state,
+    clear_booking_state,
+    resolve_followup,
+)
 
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
+# LangChain chat model for free-form generation (e.g. history summaries)
+llm = get_chat_model("openai", "gpt-4o-mini", temperature=0.3)
 
 
 # Define tools
@@ -47,12 +70,14 @@ class DatabaseKnowledgeResponse(BaseModel):
 
 
 def get_db_connection():
+    # Inside a request, connect and statement time are bounded by its deadline
     return psycopg2.connect(
         dbname=settings.DB_NAME,
         user=settings.DB_USER,
         password=settings.DB_PASSWORD,
         host=settings.DB_HOST,
         port=settings.DB_PORT,
+        **db_deadline_options(),
     )
 
 
@@ -379,20 +404,190 @@ def book_appointment(
     return booking
 
 
-def rag_query(query: str, user_id: str) -> str:
-    history = get_general_chat_history(user_id)
-    history_text = "".join(
+def format_chat_history(history: List[Dict]) -> str:
+    return "".join(
         [
             f"User: {entry['query']}\nAssistant: {entry['response']}\n\n"
             for entry in history
         ]
     )
-    response = retrieval_chain.invoke({"input": query, "history": history_text})
-    answer = response.get("answer", "No answer found.")
-    store_general_chat_history(user_id, query, answer)
+
+
+# Chat history writes still running; referenced so they are not collected
+_history_writes: Set[asyncio.Task] = set()
+
+
+def record_chat_history(user_id: str, query: str, answer: str):
+    """Save a RAG exchange; a failure only costs later turns this context, so
+    it is logged instead of failing the reply."""
+    try:
+        store_general_chat_history(user_id, query, answer)
+    except Exception as e:
+        logger.warning(f"Failed to save chat history for user {user_id}: {e}")
+
+
+def rag_query(
+    query: str,
+    user_id: str,
+    prefetched_docs: Optional[List] = None,
+    prefetched_history: Optional[List[Dict]] = None,
+) -> str:
+    history = (
+        prefetched_history
+        if prefetched_history is not None
+        else get_general_chat_history(user_id)
+    )
+    history_text = format_chat_history(history)
+
+    def generate() -> str:
+        check_deadline("rag_query")
+        rag = get_rag_components()
+        if prefetched_docs is not None:
+            # Retrieval already ran speculatively, only the generation step is left
+            return rag.document_chain.invoke(
+                {"input": query, "history": history_text, "context": prefetched_docs},
+                config=ledger_callbacks("rag_query", "openai"),
+            )
+        response = rag.retrieval_chain.invoke(
+            {"input": query, "history": history_text},
+            config=ledger_callbacks("rag_query", "openai"),
+        )
+        return response.get("answer", "No answer found.")
+
+    if settings.LLM_COALESCE:
+        # Users asking the same question with the same history share one chain run
+        answer = rag_flights.do(request_key("rag", query, history_text), generate)
+    else:
+        answer = generate()
+    record_chat_history(user_id, query, answer)
+    return answer
+
+
+async def arag_query(
+    query: str,
+    user_id: str,
+    prefetched_docs: Optional[List] = None,
+    prefetched_history: Optional[List[Dict]] = None,
+) -> str:
+    """rag_query on the event loop: retrieval and generation use the async
+    chain APIs and the history fetch runs alongside retrieval, so a worker
+    is not blocked while many RAG questions are in flight."""
+    check_deadline("rag_query")
+    rag = await aget_rag_components()
+
+    if prefetched_history is not None:
+        history_task = None
+    else:
+        # psycopg2 is blocking; the query runs in a thread while retrieval starts
+        history_task = asyncio.create_task(
+            asyncio.to_thread(get_general_chat_history, user_id)
+        )
+    try:
+        if prefetched_docs is not None:
+            docs = prefetched_docs
+        else:
+            docs = await rag.retriever.ainvoke(
+                query, config=ledger_callbacks("rag_query", "openai")
+            )
+        history = (
+            prefetched_history if history_task is None else await history_task
+        )
+    except BaseException:
+        _discard_task(history_task)
+        raise
+    history_text = format_chat_history(history)
+
+    async def generate() -> str:
+        check_deadline("rag_query")
+        return await rag.document_chain.ainvoke(
+            {"input": query, "history": history_text, "context": docs},
+            config=ledger_callbacks("rag_query", "openai"),
+        )
+
+    if settings.LLM_COALESCE:
+        # Users asking the same question with the same history share one chain run
+        answer = await rag_flights.ado(
+            request_key("rag", query, history_text), generate
+        )
+    else:
+        answer = await generate()
+    # Saved in the background: the answer does not wait for the write, and
+    # the request's deadline cannot cancel it
+    task = asyncio.create_task(
+        asyncio.to_thread(record_chat_history, user_id, query, answer)
+    )
+    _history_writes.add(task)
+    task.add_done_callback(_history_writes.discard)
     return answer
 
 
+def _discard_task(task: Optional[asyncio.Task]):
+    """Cancel a speculative task and swallow its outcome."""
+    if task is None:
+        return
+
+    def _consume(t: asyncio.Task):
+        if not t.cancelled() and t.exception() is not None:
+            logger.debug(f"Discarded speculative task failed: {t.exception()}")
+
+    task.cancel()
+    task.add_done_callback(_consume)
+
+
+async def speculative_route(query: str, user_id: str):
+    """Run router_agent while vector retrieval and the history fetch start in parallel.
+
+    Returns the routing decision plus the prefetched documents and history when
+    the router picks rag_query for the original query, otherwise discards them.
+    """
+    try:
+        # Only prefetch when the RAG system is already up
+        rag = get_rag_components(wait=0)
+        docs_task = asyncio.create_task(
+            rag.retriever.ainvoke(
+                query, config=ledger_callbacks("rag_query", "openai")
+            )
+        )
+    except RAGUnavailableError:
+        docs_task = None
+    history_task = asyncio.create_task(
+        asyncio.to_thread(get_general_chat_history, user_id)
+    )
+    try:
+        routing = await run_in_budget("router_agent", router_agent, query, user_id)
+    except BaseException:
+        _discard_task(docs_task)
+        _discard_task(history_task)
+        raise
+
+    if routing.action != "rag_query" or not isinstance(routing.parameters, dict):
+        _discard_task(docs_task)
+        _discard_task(history_task)
+        return routing, None, None
+
+    prefetched_docs = None
+    prefetched_history = None
+    try:
+        prefetched_history = await asyncio.wait_for(history_task, timeout=time_left())
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded("chat history") from None
+    except Exception as e:
+        logger.warning(f"Speculative history fetch failed, refetching: {e}")
+
+    # The router may rewrite the query; speculative docs only apply to the original
+    if docs_task is not None and routing.parameters.get("query", query) == query:
+        try:
+            prefetched_docs = await asyncio.wait_for(docs_task, timeout=time_left())
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded("vector search") from None
+        except Exception as e:
+            logger.warning(f"Speculative retrieval failed, retrying inline: {e}")
+    else:
+        _discard_task(docs_task)
+
+    return routing, prefetched_docs, prefetched_history
+
+
 def get_department_id_by_name(department_name: str) -> Optional[str]:
     conn = get_db_connection()
     c = conn.cursor()
@@ -458,8 +653,20 @@ def get_doctor_id_by_username(username: str) -> Optional[str]:
     return doctor_id
 
 
+def score_department_reply(text: str, departments: List[str]):
+    """Confidence of a department inference; "no department" is re-checked."""
+    result = parse_json_reply(text)
+    if result is None:
+        return None, 0.0
+    department_name = result.get("department_name")
+    if department_name is None:
+        return result, 0.6
+    return result, 1.0 if department_name in departments else 0.2
+
+
 def database_knowledge_agent(condition: str) -> DatabaseKnowledgeResponse:
     departments = get_all_department_names()
+    cleaned_response = None
 
     prompt = ChatPromptTemplate.from_template(
         """
@@ -489,21 +696,25 @@ def database_knowledge_agent(condition: str) -> DatabaseKnowledgeResponse:
         formatted_prompt = prompt.format(
             condition=condition, departments=", ".join(departments)
         )
-        chat_completion = openai_client.chat.completions.create(
-            messages=[
+        completion, result, confidence = tiered_completion(
+            "database_knowledge_agent",
+            ("openai", "gpt-4o-mini"),
+            [
                 {
                     "role": "user",
                     "content": formatted_prompt,
                 }
             ],
-            model="gpt-4o-mini",
+            lambda text: score_department_reply(text, departments),
             temperature=0.3,
         )
-        response = chat_completion.choices[0].message.content
-        logger.debug(f"DatabaseKnowledgeAgent OpenAI raw response: {response}")
-        cleaned_response = re.sub(r"```json\s*|\s*```", "", response).strip()
-        result = json.loads(cleaned_response)
+        cleaned_response = completion.text
+        logger.debug(f"DatabaseKnowledgeAgent raw response: {cleaned_response}")
+        if result is None:
+            raise json.JSONDecodeError("Reply is not a JSON object", "", 0)
         department_name = result.get("department_name")
+    except DeadlineExceeded:
+        raise
     except json.JSONDecodeError as e:
         logger.error(
             f"DatabaseKnowledgeAgent failed to parse LLM response: {cleaned_response}, error: {e}"
@@ -595,66 +806,31 @@ def router_agent(query: str, user_id: str) -> RouterResponse:
     departments = [row[0] for row in c.fetchall()]
     conn.close()
 
-    prompt = ChatPromptTemplate.from_template(
-        """
-        You are an intelligent router agent. Your task is to analyze the user's query and return a JSON object specifying whether it should be handled by the RAG system (general medical questions) or the database (hospitals, doctors, appointments).
-
-        **Available Departments:** {departments}
-
-        **Query:** {query}
-
-        **Instructions:**
-        - Return a JSON object with exactly two fields: "action" and "parameters".
-        - Set "action" to "rag_query" for general medical questions (e.g., about diseases, symptoms, treatments).
-        - Set "action" to "db_query" for queries about hospitals, doctors, availability, or appointments.
-        - For "parameters":
-          - If "action" is "rag_query", include "query" with the original query.
-          - If "action" is "db_query", include "tool" (e.g., "get_hospitals", "get_doctors", "book_appointment").
-          - For "get_doctors", include "condition" and "department_name" if a condition is mentioned (e.g., "acne" → "Department of Dermatology").
-          - For "book_appointment", extract:
-            - "doctor_username" (e.g., "doctorderma"),
-            - "appointment_date" (e.g., "2025-05-05"),
-            - "start_time" (e.g., "09:00"),
-            - "end_time" (e.g., "09:30").
-            - If any booking details are missing, set them to null.
-          - If a condition is mentioned without booking details, infer "department_name" from available departments.
-          - If no department can be inferred, set "department_name" to null.
-        - Output ONLY valid JSON, enclosed in curly braces {{}}, with double-quoted keys and values.
-        - Do NOT wrap the JSON in markdown code blocks or include any other text.
-
-        **Examples:**
-        - Query: "What is acne?" → {{"action": "rag_query", "parameters": {{"query": "What is acne?"}}}}
-        - Query: "List hospitals" → {{"action": "db_query", "parameters": {{"tool": "get_hospitals"}}}}
-        - Query: "List available doctors for acne?" → {{"action": "db_query", "parameters": {{"tool": "get_doctors", "condition": "acne", "department_name": "Department of Dermatology"}}}}
-        - Query: "Book appointment with doctorderma on Monday, 2025-05-05 from 09:00 to 09:30" → {{"action": "db_query", "parameters": {{"tool": "book_appointment", "doctor_username": "doctorderma", "appointment_date": "2025-05-05", "start_time": "09:00", "end_time": "09:30"}}}}
-        - Query: "Book my slot for Monday: 09:00 - 09:30" → {{"action": "db_query", "parameters": {{"tool": "book_appointment", "doctor_username": null, "appointment_date": null, "start_time": "09:00", "end_time": "09:30"}}}}
-        - Query: "List doctors for fatigue" → {{"action": "db_query", "parameters": {{"tool": "get_doctors", "condition": "fatigue", "department_name": null}}}}
-
-        **Output (valid JSON only, no markdown):**
-        """
-    )
+    prompt = ChatPromptTemplate.from_template(ROUTER_AGENT_PROMPT)
     cleaned_response = None
     try:
-        # Call OpenAI API
         formatted_prompt = prompt.format(
             query=query, departments=", ".join(departments)
         )
-        chat_completion = openai_client.chat.completions.create(
-            messages=[
+        completion, result, confidence = tiered_completion(
+            "router_agent",
+            ("openai", "gpt-4o-mini"),
+            [
                 {
                     "role": "user",
                     "content": formatted_prompt,
                 }
             ],
-            model="gpt-4o-mini",
+            lambda text: score_router_reply(text, departments),
             temperature=0.3,
         )
-
-        response = chat_completion.choices[0].message.content
-        logger.debug(f"RouterAgent OpenAI raw response: {response}")
-        cleaned_response = re.sub(r"```json\s*|\s*```", "", response).strip()
-        result = json.loads(cleaned_response)
+        cleaned_response = completion.text
+        logger.debug(f"RouterAgent raw response: {cleaned_response}")
+        if result is None:
+            raise json.JSONDecodeError("Router reply is not a JSON object", "", 0)
         return RouterResponse(**result)
+    except DeadlineExceeded:
+        raise
     except json.JSONDecodeError as e:
         logger.error(
             f"RouterAgent failed to parse LLM response: {cleaned_response or 'No response'}, error: {e}"
@@ -667,7 +843,258 @@ def router_agent(query: str, user_id: str) -> RouterResponse:
         return RouterResponse(action="rag_query", parameters={"query": query})
 
 
-async def appointment_booking_agent(query: str, user_id: str) -> Dict:
+def score_router_reply(text: str, departments: List[str]):
+    """Confidence of a router reply: valid action, known tool and department."""
+    result = parse_json_reply(text)
+    if result is None:
+        return None, 0.0
+    action = result.get("action")
+    parameters = result.get("parameters") or {}
+    if action == "rag_query":
+        return result, 1.0 if parameters.get("query") else 0.5
+    if action != "db_query":
+        return result, 0.0
+    if parameters.get("tool") not in {tool.name for tool in TOOLS}:
+        return result, 0.3
+    department = parameters.get("department_name")
+    if department and department not in departments:
+        return result, 0.5
+    return result, 1.0
+
+
+def resolve_doctor(doctor_username: str):
+    """Look up (doctor_id, department_id, hospital_id) for a doctor username.
+
+    Returns an error response dict instead when any lookup fails.
+    """
+    doctor_id = get_doctor_id_by_username(doctor_username)
+    logger.debug(f"Doctor ID: {doctor_id}, type={type(doctor_id)}")
+    if not doctor_id:
+        return {"response": f"No doctor found with username '{doctor_username}'."}
+    if not isinstance(doctor_id, str):
+        logger.error(f"Expected string doctor_id, got {type(doctor_id)}: {doctor_id}")
+        return {
+            "response": f"Internal error: Invalid doctor_id type: {type(doctor_id)}"
+        }
+
+    # Get department and hospital IDs
+    conn = get_db_connection()
+    c = conn.cursor()
+
+    # Fetch department_id from doctors table
+    c.execute(
+        """
+        SELECT department_id
+        FROM doctors
+        WHERE user_id = %s
+        """,
+        (doctor_id,),
+    )
+    department_result = c.fetchone()
+    logger.debug(
+        f"Department query: doctor_id={doctor_id}, result={department_result}, type={type(department_result)}"
+    )
+    if not department_result:
+        conn.close()
+        return {"response": f"No department found for doctor '{doctor_username}'."}
+    if not isinstance(department_result, tuple):
+        conn.close()
+        logger.error(
+            f"Expected tuple for department_result, got {type(department_result)}: {department_result}"
+        )
+        return {
+            "response": f"Internal error: Invalid department query result type: {type(department_result)}"
+        }
+    department_id = department_result[0]
+    logger.debug(f"Department ID: {department_id}, type={type(department_id)}")
+
+    # Fetch hospital_id from departments table
+    c.execute(
+        """
+        SELECT hospital_id
+        FROM departments
+        WHERE id = %s
+        """,
+        (department_id,),
+    )
+    hospital_result = c.fetchone()
+    logger.debug(
+        f"Hospital query: department_id={department_id}, result={hospital_result}, type={type(hospital_result)}"
+    )
+    conn.close()
+    if not hospital_result:
+        return {"response": f"No hospital found for department ID '{department_id}'."}
+    if not isinstance(hospital_result, tuple):
+        logger.error(
+            f"Expected tuple for hospital_result, got {type(hospital_result)}: {hospital_result}"
+        )
+        return {
+            "response": f"Internal error: Invalid hospital query result type: {type(hospital_result)}"
+        }
+    hospital_id = hospital_result[0]
+    logger.debug(f"Hospital ID: {hospital_id}, type={type(hospital_id)}")
+
+    # Validate IDs
+    if not all(isinstance(x, str) for x in [department_id, hospital_id]):
+        logger.error(
+            f"Invalid ID types: department_id={type(department_id)}, hospital_id={type(hospital_id)}"
+        )
+        return {"response": f"Internal error: Invalid department or hospital ID type."}
+
+    return doctor_id, department_id, hospital_id
+
+
+def remember_doctor_candidates(
+    user_id: str, state: Optional[BookingState], doctors: List[Dict]
+):
+    """Keep the doctors offered to the user so the next turn can pick one by name."""
+    state = state or BookingState(user_id=user_id)
+    state.candidates = [
+        {
+            "user_id": doctor["user_id"],
+            "username": doctor["username"],
+            "department_id": doctor["department_id"],
+        }
+        for doctor in doctors
+    ]
+    state.awaiting_slot = False
+    store_booking_state(state)
+
+
+def store_booking_state(state: BookingState):
+    """Save the booking state; a failure only costs the next turn its context,
+    so it is logged instead of failing the reply."""
+    try:
+        save_booking_state(state)
+    except Exception as e:
+        logger.warning(f"Failed to save booking state for user {state.user_id}: {e}")
+
+
+def handle_booking_request(
+    user_id: str, state: Optional[BookingState], details: FollowUp
+) -> Dict:
+    """Advance the user's booking with the details from this turn.
+
+    Details missing from the turn are filled from the stored booking state, and
+    a doctor already resolved in an earlier turn skips the username,
+    department and hospital lookups.
+    """
+    state = state or BookingState(user_id=user_id)
+    doctor_username = details.doctor_username or state.doctor_username
+    appointment_date = details.appointment_date or state.appointment_date
+    start_time = details.start_time
+    end_time = details.end_time
+    logger.debug(
+        f"Booking params: username={doctor_username}, date={appointment_date}, "
+        f"start={start_time}, end={end_time}, "
+        f"types: username={type(doctor_username)}, date={type(appointment_date)}, "
+        f"start={type(start_time)}, end={type(end_time)}"
+    )
+
+    if not all(
+        x is None or isinstance(x, str)
+        for x in [doctor_username, appointment_date, start_time, end_time]
+    ):
+        logger.error(
+            f"Invalid booking param types: username={type(doctor_username)}, "
+            f"date={type(appointment_date)}, start={type(start_time)}, end={type(end_time)}"
+        )
+        return {"response": "Internal error: Invalid booking parameter types."}
+
+    if doctor_username and not (
+        doctor_username == state.doctor_username and state.has_doctor
+    ):
+        candidate = next(
+            (c for c in state.candidates if c.get("username") == doctor_username),
+            None,
+        )
+        if candidate:
+            # Offered in a previous turn, only the hospital is left to resolve
+            hospital_id = get_hospital_id_by_department(candidate["department_id"])
+            if not hospital_id:
+                return {
+                    "response": f"No hospital found for department ID '{candidate['department_id']}'."
+                }
+            resolved = (candidate["user_id"], candidate["department_id"], hospital_id)
+        else:
+            resolved = resolve_doctor(doctor_username)
+            if isinstance(resolved, dict):
+                return resolved
+        state.doctor_id, state.department_id, state.hospital_id = resolved
+        state.doctor_username = doctor_username
+    state.appointment_date = appointment_date
+
+    if not all([doctor_username, appointment_date, start_time, end_time]):
+        # With a doctor known, the reply below lists open slots to pick from
+        state.awaiting_slot = state.has_doctor
+        if state.has_doctor or state.candidates:
+            store_booking_state(state)
+        if state.has_doctor and appointment_date:
+            # Offer the open slots for the chosen day instead of a bare error
+            slots = get_doctor_availability(state.doctor_id, appointment_date)
+            return {"response": [slot for slot in slots if not slot["is_booked"]]}
+        if state.has_doctor:
+            return {"response": get_doctor_availability(state.doctor_id)}
+        return {
+            "response": "Booking requires doctor username, date, start time, and end time. Please provide all details."
+        }
+
+    # Book appointment
+    try:
+        logger.debug(
+            f"Calling book_appointment with: user_id={user_id}, doctor_id={state.doctor_id}, "
+            f"department_id={state.department_id}, hospital_id={state.hospital_id}, "
+            f"appointment_date={appointment_date}, start_time={start_time}, "
+            f"end_time={end_time}"
+        )
+        booking = book_appointment(
+            user_id=user_id,
+            doctor_id=state.doctor_id,
+            department_id=state.department_id,
+            hospital_id=state.hospital_id,
+            appointment_date=appointment_date,
+            start_time=start_time,
+            end_time=end_time,
+        )
+        logger.debug(f"Booking successful: {booking}")
+        clear_booking_state(user_id)
+        return {"response": booking}
+    except ValueError as e:
+        logger.debug(f"Booking failed: {str(e)}")
+        state.awaiting_slot = True
+        store_booking_state(state)
+        return {"response": str(e)}
+
+
+RAG_UNAVAILABLE_RESPONSE = (
+    "The medical knowledge base is still loading. Please try again shortly; "
+    "doctor lookups and bookings are available in the meantime."
+)
+DEGRADED_RESPONSE = (
+    "Sorry, I couldn't finish answering in time. Please try again in a moment."
+)
+
+
+async def appointment_booking_agent(
+    query: str, user_id: str, stateful: bool = True
+) -> Dict:
+    """Answer an agent query within AGENT_DEADLINE_SECONDS, or the tighter
+    deadline already set for the request.
+
+    Every stage (router and knowledge LLM calls, database lookups, vector
+    search) runs against the same deadline; once it is spent the remaining
+    stages are skipped and a degraded answer is returned.
+    """
+    with request_deadline(settings.AGENT_DEADLINE_SECONDS):
+        try:
+            return await _answer_query(query, user_id, stateful)
+        except DeadlineExceeded as e:
+            deadline_stats.count("degraded")
+            logger.warning(f"Serving degraded answer for user {user_id}: {e}")
+            return {"response": DEGRADED_RESPONSE, "degraded": True}
+
+
+async def _answer_query(query: str, user_id: str, stateful: bool) -> Dict:
     try:
         logger.debug(
             f"appointment_booking_agent called with query={query}, user_id={user_id}, "
@@ -684,7 +1111,36 @@ async def appointment_booking_agent(query: str, user_id: str) -> Dict:
                 "response": f"Internal error: Invalid user_id type: {type(user_id)}"
             }
 
-        routing = router_agent(query, user_id)
+        # A follow-up turn of an in-progress booking skips the router entirely
+        state = None
+        if stateful:
+            try:
+                state = await run_in_budget(
+                    "booking_state", get_booking_state, user_id
+                )
+            except Exception as e:
+                logger.warning(f"Failed to load booking state for user {user_id}: {e}")
+        followup = resolve_followup(query, state) if state else None
+        if followup:
+            logger.info(f"Resolved booking follow-up from stored state: {followup}")
+            return await run_in_budget(
+                "book_appointment", handle_booking_request, user_id, state, followup
+            )
+        if state and state.awaiting_slot:
+            # This turn is not the slot we asked for; later dates are not either
+            state.awaiting_slot = False
+            await asyncio.to_thread(store_booking_state, state)
+
+        prefetched_docs = None
+        prefetched_history = None
+        if settings.SPECULATIVE_RETRIEVAL:
+            routing, prefetched_docs, prefetched_history = await speculative_route(
+                query, user_id
+            )
+        else:
+            routing = await run_in_budget(
+                "router_agent", router_agent, query, user_id
+            )
         logger.info(f"Routing decision: {routing}, type={type(routing)}")
         logger.debug(
             f"Routing parameters: {routing.parameters}, type={type(routing.parameters)}"
@@ -705,7 +1161,20 @@ async def appointment_booking_agent(query: str, user_id: str) -> Dict:
             }
 
         if routing.action == "rag_query":
-            result = rag_query(routing.parameters.get("query", query), user_id)
+            try:
+                result = await await_in_budget(
+                    "rag_query",
+                    arag_query(
+                        routing.parameters.get("query", query),
+                        user_id,
+                        prefetched_docs=prefetched_docs,
+                        prefetched_history=prefetched_history,
+                    ),
+                )
+            except RAGUnavailableError as e:
+                # Degraded mode: bookings and doctor lookups keep working
+                logger.warning(f"RAG query skipped: {e}")
+                return {"response": RAG_UNAVAILABLE_RESPONSE, "degraded": True}
             logger.info(f"RAG query result: {result[:100]}...")
             return {"response": result}
 
@@ -727,149 +1196,30 @@ async def appointment_booking_agent(query: str, user_id: str) -> Dict:
                 }
 
             if tool_name == "get_doctors" and condition:
-                db_response = database_knowledge_agent(condition)
+                db_response = await run_in_budget(
+                    "database_knowledge_agent", database_knowledge_agent, condition
+                )
                 if db_response.error:
                     return {"response": db_response.error}
+                if stateful:
+                    await asyncio.to_thread(
+                        remember_doctor_candidates, user_id, state, db_response.doctors
+                    )
                 return {"response": db_response.doctors}
 
             if tool_name == "book_appointment":
-                doctor_username = routing.parameters.get("doctor_username")
-                appointment_date = routing.parameters.get("appointment_date")
-                start_time = routing.parameters.get("start_time")
-                end_time = routing.parameters.get("end_time")
-                logger.debug(
-                    f"Booking params: username={doctor_username}, date={appointment_date}, "
-                    f"start={start_time}, end={end_time}, "
-                    f"types: username={type(doctor_username)}, date={type(appointment_date)}, "
-                    f"start={type(start_time)}, end={type(end_time)}"
-                )
-
-                # Validate booking parameters
-                if not all([doctor_username, appointment_date, start_time, end_time]):
-                    return {
-                        "response": "Booking requires doctor username, date, start time, and end time. Please provide all details."
-                    }
-                if not all(
-                    isinstance(x, str)
-                    for x in [doctor_username, appointment_date, start_time, end_time]
-                ):
-                    logger.error(
-                        f"Invalid booking param types: username={type(doctor_username)}, "
-                        f"date={type(appointment_date)}, start={type(start_time)}, end={type(end_time)}"
-                    )
-                    return {
-                        "response": "Internal error: Invalid booking parameter types."
-                    }
-
-                # Get doctor ID
-                doctor_id = get_doctor_id_by_username(doctor_username)
-                logger.debug(f"Doctor ID: {doctor_id}, type={type(doctor_id)}")
-                if not doctor_id:
-                    return {
-                        "response": f"No doctor found with username '{doctor_username}'."
-                    }
-                if not isinstance(doctor_id, str):
-                    logger.error(
-                        f"Expected string doctor_id, got {type(doctor_id)}: {doctor_id}"
-                    )
-                    return {
-                        "response": f"Internal error: Invalid doctor_id type: {type(doctor_id)}"
-                    }
-
-                # Get department and hospital IDs
-                conn = get_db_connection()
-                c = conn.cursor()
-
-                # Fetch department_id from doctors table
-                c.execute(
-                    """
-                    SELECT department_id
-                    FROM doctors
-                    WHERE user_id = %s
-                    """,
-                    (doctor_id,),
-                )
-                department_result = c.fetchone()
-                logger.debug(
-                    f"Department query: doctor_id={doctor_id}, result={department_result}, type={type(department_result)}"
-                )
-                if not department_result:
-                    conn.close()
-                    return {
-                        "response": f"No department found for doctor '{doctor_username}'."
-                    }
-                if not isinstance(department_result, tuple):
-                    conn.close()
-                    logger.error(
-                        f"Expected tuple for department_result, got {type(department_result)}: {department_result}"
-                    )
-                    return {
-                        "response": f"Internal error: Invalid department query result type: {type(department_result)}"
-                    }
-                department_id = department_result[0]
-                logger.debug(
-                    f"Department ID: {department_id}, type={type(department_id)}"
-                )
-
-                # Fetch hospital_id from departments table
-                c.execute(
-                    """
-                    SELECT hospital_id
-                    FROM departments
-                    WHERE id = %s
-                    """,
-                    (department_id,),
-                )
-                hospital_result = c.fetchone()
-                logger.debug(
-                    f"Hospital query: department_id={department_id}, result={hospital_result}, type={type(hospital_result)}"
+                return await run_in_budget(
+                    "book_appointment",
+                    handle_booking_request,
+                    user_id,
+                    state,
+                    FollowUp(
+                        doctor_username=routing.parameters.get("doctor_username"),
+                        appointment_date=routing.parameters.get("appointment_date"),
+                        start_time=routing.parameters.get("start_time"),
+                        end_time=routing.parameters.get("end_time"),
+                    ),
                 )
-                conn.close()
-                if not hospital_result:
-                    return {
-                        "response": f"No hospital found for department ID '{department_id}'."
-                    }
-                if not isinstance(hospital_result, tuple):
-                    logger.error(
-                        f"Expected tuple for hospital_result, got {type(hospital_result)}: {hospital_result}"
-                    )
-                    return {
-                        "response": f"Internal error: Invalid hospital query result type: {type(hospital_result)}"
-                    }
-                hospital_id = hospital_result[0]
-                logger.debug(f"Hospital ID: {hospital_id}, type={type(hospital_id)}")
-
-                # Validate IDs
-                if not all(isinstance(x, str) for x in [department_id, hospital_id]):
-                    logger.error(
-                        f"Invalid ID types: department_id={type(department_id)}, hospital_id={type(hospital_id)}"
-                    )
-                    return {
-                        "response": f"Internal error: Invalid department or hospital ID type."
-                    }
-
-                # Book appointment
-                try:
-                    logger.debug(
-                        f"Calling book_appointment with: user_id={user_id}, doctor_id={doctor_id}, "
-                        f"department_id={department_id}, hospital_id={hospital_id}, "
-                        f"appointment_date={appointment_date}, start_time={start_time}, "
-                        f"end_time={end_time}"
-                    )
-                    booking = book_appointment(
-                        user_id=user_id,
-                        doctor_id=doctor_id,
-                        department_id=department_id,
-                        hospital_id=hospital_id,
-                        appointment_date=appointment_date,
-                        start_time=start_time,
-                        end_time=end_time,
-                    )
-                    logger.debug(f"Booking successful: {booking}")
-                    return {"response": booking}
-                except ValueError as e:
-                    logger.debug(f"Booking failed: {str(e)}")
-                    return {"response": str(e)}
 
             department_id = None
             if department_name and not condition:
@@ -894,6 +1244,10 @@ async def appointment_booking_agent(query: str, user_id: str) -> Dict:
                         for doctor in doctors:
                             availability = get_doctor_availability(doctor["user_id"])
                             doctor["availability"] = availability
+                        if stateful:
+                            await asyncio.to_thread(
+                                remember_doctor_candidates, user_id, state, doctors
+                            )
                         return {"response": doctors}
                     elif tool_name == "get_doctor_availability":
                         result = tool.function(**routing.parameters.get("params", {}))
@@ -907,6 +1261,12 @@ async def appointment_booking_agent(query: str, user_id: str) -> Dict:
         else:
             return {"response": "Invalid routing action."}
 
+    except DeadlineExceeded:
+        raise
     except Exception as e:
+        left = time_left()
+        if left is not None and left < settings.DEADLINE_MIN_STAGE_SECONDS:
+            # An HTTP or statement timeout cut short by the deadline
+            raise DeadlineExceeded("agent") from e
         logger.error(f"Error in appointment_booking_agent: {str(e)}", exc_info=True)
         return {"response": f"Error processing query: {str(e)}"}
@@ -14,6 +14,12 @@ from keras.metrics import MeanIoU
 import base64
 import io
 from tensorflow.keras.preprocessing import image as keras_image
+from datetime import datetime, timedelta
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, Optional
+from utils.llm_gateway import achat_completion, astream_chat_completion
+from utils.prompts import DISEASE_CHAT_PROMPTS
+from utils.response_cache import response_cache
 
 kidney_model = None  # Add this line at the top-level
 breast_cancer_model = None
@@ -237,47 +243,191 @@ def predict_eye_disease(image_file):
         return {"error": str(e)}
 
 
-async def generate_groq_response(prompt: str, system_prompt: str = None):
-    try:
-        from config.settings import settings
-        from groq import Groq
-
-        full_prompt = f"{system_prompt}\n\nUser query: {prompt}\n\nResponse:"
-
-        # Initialize Groq client
-        client = Groq(api_key=settings.GROQ_API_KEY)
+# In-memory disease chat context: {(user_id, disease): [{"message": str, "response": str, "timestamp": datetime}, ...]}
+disease_chat_history = defaultdict(list)
+DISEASE_CHAT_TURNS = 3  # Prior exchanges sent with each message
+DISEASE_CHAT_TIMEOUT = timedelta(minutes=30)
+
+
+def get_disease_chat_history(user_id: str, disease: str) -> List[Dict]:
+    """Recent exchanges of a user with one disease chatbot."""
+    key = (user_id, disease)
+    now = datetime.utcnow()
+    disease_chat_history[key] = [
+        turn
+        for turn in disease_chat_history[key]
+        if now - turn["timestamp"] < DISEASE_CHAT_TIMEOUT
+    ][-DISEASE_CHAT_TURNS:]
+    return disease_chat_history[key]
+
+
+def store_disease_chat_turn(user_id: str, disease: str, message: str, response: str):
+    key = (user_id, disease)
+    disease_chat_history[key].append(
+        {"message": message, "response": response, "timestamp": datetime.utcnow()}
+    )
+    disease_chat_history[key] = disease_chat_history[key][-DISEASE_CHAT_TURNS:]
+
+
+# Words that point back at earlier turns ("is it contagious?", "what about
+# children?"); questions without them are answered, and cached, on their own
+FOLLOWUP_PATTERN = re.compile(
+    r"^\s*(and|but|so|also|what about|how about)\b|\b(it|its|this|that|these|"
+    r"those|they|them|their|he|she|his|her|above|earlier|before|again|else)\b",
+    re.IGNORECASE,
+)
+
+
+def history_for(message: str, history: List[Dict]) -> List[Dict]:
+    """The history a message needs: none when it stands on its own, so
+    self-contained questions keep hitting the response cache."""
+    if history and (len(message.split()) <= 2 or FOLLOWUP_PATTERN.search(message)):
+        return history
+    return []
+
+
+def build_chat_messages(
+    prompt: str, system_prompt: str = None, history: Optional[List[Dict]] = None
+) -> List[Dict]:
+    messages = [{"role": "system", "content": system_prompt}] if system_prompt else []
+    for turn in history or []:
+        messages.append({"role": "user", "content": turn["message"]})
+        messages.append({"role": "assistant", "content": turn["response"]})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def clean_response(response: str) -> str:
+    """Strip role prefixes, code fences and end-of-text markers from a reply."""
+    cleaned_response = response.strip()
+    cleaned_response = re.sub(
+        r"^(assistant:|[\[\{]?(ANSWER|RESPONSE)[\]\}]?:?\s*)",
+        "",
+        cleaned_response,
+        flags=re.IGNORECASE,
+    )
+    cleaned_response = re.sub(
+        r"```(?:json)?\s*(.*?)\s*```", r"\1", cleaned_response, flags=re.DOTALL
+    )
+    cleaned_response = re.sub(r"\s*(</s>|[EOT]|\[.*?\])$", "", cleaned_response)
+    return cleaned_response.strip()
+
+
+async def generate_groq_response(
+    prompt: str,
+    system_prompt: str = None,
+    prompt_id: str = None,
+    history: Optional[List[Dict]] = None,
+):
+    """Answer a user query under a system prompt.
+
+    When ``prompt_id`` is given and there is no prior conversation, answers
+    are served from and stored in the response cache under (prompt_id,
+    normalized query).
+    """
+    use_cache = (
+        prompt_id is not None and not history and settings.RESPONSE_CACHE_ENABLED
+    )
+    embedding = None
+    if use_cache:
+        cached, embedding = await response_cache.get(prompt_id, prompt)
+        if cached is not None:
+            logger.info(f"Response cache hit for {prompt_id}")
+            return cached
 
+    try:
         # Call Groq API
-        chat_completion = client.chat.completions.create(
-            messages=[
-                {
-                    "role": "user",
-                    "content": full_prompt,
-                }
-            ],
-            model="llama-3.3-70b-versatile",
-            stream=False,
+        completion = await achat_completion(
+            "groq",
+            "llama-3.3-70b-versatile",
+            build_chat_messages(prompt, system_prompt, history),
+            stage="generate_groq_response",
         )
 
         # Extract the response
-        response = chat_completion.choices[0].message.content
+        response = completion.text
         if not response:
             raise Exception("No content in Groq API response")
 
-        # Clean the response
-        cleaned_response = response.strip()
-        cleaned_response = re.sub(
-            r"^(assistant:|[\[\{]?(ANSWER|RESPONSE)[\]\}]?:?\s*)",
-            "",
-            cleaned_response,
-            flags=re.IGNORECASE,
-        )
-        cleaned_response = re.sub(
-            r"```(?:json)?\s*(.*?)\s*```", r"\1", cleaned_response, flags=re.DOTALL
-        )
-        cleaned_response = re.sub(r"\s*(</s>|[EOT]|\[.*?\])$", "", cleaned_response)
-
-        return cleaned_response.strip()
+        cleaned_response = clean_response(response)
+        if use_cache and cleaned_response:
+            response_cache.put(prompt_id, prompt, cleaned_response, embedding)
+        return cleaned_response
     except Exception as e:
         logger.error(f"Error generating response: {e}")
         raise Exception(f"Failed to generate response: {e}")
+
+
+async def stream_groq_response(
+    prompt: str,
+    system_prompt: str = None,
+    prompt_id: str = None,
+    history: Optional[List[Dict]] = None,
+    result: Optional[Dict] = None,
+) -> AsyncIterator[str]:
+    """Streaming variant of generate_groq_response yielding text deltas.
+
+    The cleaned full answer is written to ``result["response"]`` at the end.
+    """
+    use_cache = (
+        prompt_id is not None and not history and settings.RESPONSE_CACHE_ENABLED
+    )
+    embedding = None
+    if use_cache:
+        cached, embedding = await response_cache.get(prompt_id, prompt)
+        if cached is not None:
+            logger.info(f"Response cache hit for {prompt_id}")
+            if result is not None:
+                result["response"] = cached
+            yield cached
+            return
+
+    parts = []
+    async for delta in astream_chat_completion(
+        "groq",
+        "llama-3.3-70b-versatile",
+        build_chat_messages(prompt, system_prompt, history),
+        stage="generate_groq_response",
+    ):
+        parts.append(delta)
+        yield delta
+
+    cleaned_response = clean_response("".join(parts))
+    if use_cache and cleaned_response:
+        response_cache.put(prompt_id, prompt, cleaned_response, embedding)
+    if result is not None:
+        result["response"] = cleaned_response
+
+
+async def disease_chat_reply(
+    disease: str, message: str, user_id: str, stateful: bool = True
+) -> str:
+    """Answer a disease chatbot message, with the user's recent context when
+    the message refers to it. Stateless calls neither read nor store turns."""
+    history = get_disease_chat_history(user_id, disease) if stateful else []
+    response = await generate_groq_response(
+        message,
+        system_prompt=DISEASE_CHAT_PROMPTS[disease],
+        prompt_id=disease,
+        history=history_for(message, history),
+    )
+    if stateful:
+        store_disease_chat_turn(user_id, disease, message, response)
+    return response
+
+
+async def stream_disease_chat(
+    disease: str, message: str, user_id: str
+) -> AsyncIterator[str]:
+    """Stream a disease chatbot answer; the turn is stored once complete."""
+    history = history_for(message, get_disease_chat_history(user_id, disease))
+    result = {}
+    async for delta in stream_groq_response(
+        message,
+        system_prompt=DISEASE_CHAT_PROMPTS[disease],
+        prompt_id=disease,
+        history=history,
+        result=result,
+    ):
+        yield delta
+    store_disease_chat_turn(user_id, disease, message, result["response"])
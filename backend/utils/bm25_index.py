@@ -0,0 +1,255 @@
+import os
+import re
+import json
+import hashlib
+import logging
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+BM25_META_FILE = "bm25.json"
+POSTINGS_FILE = "postings.npz"
+DOCS_FILE = "docs.jsonl"
+
+# Runs of letters/digits, kept whole across "-", "." and "/" so terms such as
+# covid-19, il-6 or t4/t3 stay searchable as one token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    """
+    a an and are as at be been but by can could do does for from had has have
+    how i if in into is it its me my no not of on or our should so such than
+    that the their them then there these they this to was we were what when
+    where which who whom why will with would you your
+    """.split()
+)
+
+
+def _stem(token: str) -> str:
+    """Strip a plural "s" so symptom/symptoms match; short tokens are kept."""
+    if len(token) > 4 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms without stopwords. Compound terms (covid-19) are
+    emitted whole and as their parts, so "covid 19" still matches."""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        parts = re.split(r"[-./]", token)
+        if len(parts) > 1:
+            terms.append(token)
+        terms.extend(_stem(part) for part in parts if part not in STOPWORDS)
+    return terms
+
+
+def document_key(doc: Document) -> str:
+    """Identity of a retrieved chunk across retrievers (ids differ per store)."""
+    question = str(doc.metadata.get("Question", ""))
+    return hashlib.sha256(f"{question}\0{doc.page_content}".encode()).hexdigest()
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index kept in numpy arrays.
+
+    Postings are stored CSR-style: for term ``t`` the documents containing it
+    are ``doc_ids[offsets[t]:offsets[t + 1]]`` with matching term frequencies,
+    so a query touches only the postings of its own terms.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, BM25_META_FILE)) as f:
+            self.meta: Dict[str, Any] = json.load(f)
+        self.k1: float = self.meta["k1"]
+        self.b: float = self.meta["b"]
+        self.count: int = self.meta["count"]
+        self.terms: Dict[str, int] = {
+            term: i for i, term in enumerate(self.meta["terms"])
+        }
+        postings = np.load(os.path.join(path, POSTINGS_FILE))
+        self.offsets = postings["offsets"]
+        self.doc_ids = postings["doc_ids"]
+        self.tfs = postings["tfs"]
+        doc_lens = postings["doc_lens"]
+        avg_len = float(doc_lens.mean()) if len(doc_lens) else 1.0
+        # Per-document part of the BM25 denominator, computed once
+        self.length_norm = (
+            self.k1 * (1 - self.b + self.b * doc_lens / max(avg_len, 1e-9))
+        ).astype(np.float32)
+        df = np.diff(self.offsets).astype(np.float32)
+        self.idf = np.log1p((self.count - df + 0.5) / (df + 0.5)).astype(np.float32)
+        with open(os.path.join(path, DOCS_FILE)) as f:
+            self.documents = [json.loads(line) for line in f]
+        logger.info(
+            f"Loaded BM25 index {path}: {self.count} documents, "
+            f"{len(self.terms)} terms"
+        )
+
+    @classmethod
+    def build(
+        cls,
+        path: str,
+        documents: List[Document],
+        texts: Optional[Sequence[str]] = None,
+        k1: float = 1.2,
+        b: float = 0.75,
+        extra_meta: Optional[Dict] = None,
+    ) -> "BM25Index":
+        """Write an index of ``documents`` to ``path``.
+
+        ``texts`` are what gets tokenized (defaults to the page content), e.g.
+        question plus answer when only the answer is the document.
+        """
+        texts = [doc.page_content for doc in documents] if texts is None else texts
+        if len(texts) != len(documents):
+            raise ValueError("Expected one text per document")
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        doc_lens = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lens[row] = sum(counts.values())
+            for term, tf in counts.items():
+                postings[term].append((row, tf))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_ids, tfs = [], []
+        for i, term in enumerate(terms):
+            rows, counts = zip(*postings[term])
+            doc_ids.extend(rows)
+            tfs.extend(counts)
+            offsets[i + 1] = len(doc_ids)
+
+        os.makedirs(path, exist_ok=True)
+        np.savez(
+            os.path.join(path, POSTINGS_FILE),
+            offsets=offsets,
+            doc_ids=np.asarray(doc_ids, dtype=np.int32),
+            tfs=np.asarray(tfs, dtype=np.float32),
+            doc_lens=doc_lens,
+        )
+        with open(os.path.join(path, DOCS_FILE), "w") as f:
+            for doc in documents:
+                record = {"page_content": doc.page_content, "metadata": doc.metadata}
+                if doc.id is not None:
+                    record["id"] = doc.id
+                f.write(json.dumps(record) + "\n")
+        with open(os.path.join(path, BM25_META_FILE), "w") as f:
+            json.dump(
+                {
+                    "count": len(documents),
+                    "k1": k1,
+                    "b": b,
+                    **(extra_meta or {}),
+                    "terms": terms,
+                },
+                f,
+            )
+        logger.info(
+            f"Built BM25 index {path}: {len(documents)} documents, {len(terms)} terms"
+        )
+        return cls(path)
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[int, float]]:
+        """(row, BM25 score) of the ``k`` best matching rows, best first."""
+        scores = np.zeros(self.count, dtype=np.float32)
+        for term in set(tokenize(query)):
+            t = self.terms.get(term)
+            if t is None:
+                continue
+            start, end = self.offsets[t], self.offsets[t + 1]
+            rows = self.doc_ids[start:end]
+            tf = self.tfs[start:end]
+            scores[rows] += self.idf[t] * tf * (self.k1 + 1) / (
+                tf + self.length_norm[rows]
+            )
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        order = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(row), float(scores[row])) for row in order]
+
+    def document(self, row: int) -> Document:
+        record = self.documents[row]
+        return Document(
+            id=record.get("id"),
+            page_content=record["page_content"],
+            metadata=record["metadata"],
+        )
+
+    def search_documents(self, query: str, k: int = 10) -> List[Document]:
+        return [self.document(row) for row, _ in self.search(query, k)]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[Document]], k: int = 60
+) -> List[Document]:
+    """Merge ranked lists by summed 1 / (k + rank); duplicates collapse into one
+    entry, so a chunk found by both retrievers ranks above single hits."""
+    scores: Dict[str, float] = defaultdict(float)
+    first_seen: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking, start=1):
+            key = document_key(doc)
+            scores[key] += 1.0 / (k + rank)
+            first_seen.setdefault(key, doc)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [first_seen[key] for key in ordered]
+
+
+class HybridRetriever(BaseRetriever):
+    """Vector search fused with BM25 keyword search (reciprocal rank fusion).
+
+    Each side contributes ``fetch_k`` candidates; only the best ``k`` fused
+    chunks reach the prompt, so exact terms (drug names, lab abbreviations)
+    are found without raising the dense ``k``.
+    """
+
+    vector_store: Any
+    bm25: Any
+    k: int = 5
+    fetch_k: int = 20
+    rrf_k: int = 60
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        dense = self.vector_store.similarity_search(query, k=self.fetch_k)
+        lexical = self.bm25.search_documents(query, self.fetch_k)
+        return reciprocal_rank_fusion([dense, lexical], k=self.rrf_k)[: self.k]
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        dense = await self.vector_store.asimilarity_search(query, k=self.fetch_k)
+        lexical = self.bm25.search_documents(query, self.fetch_k)
+        return reciprocal_rank_fusion([dense, lexical], k=self.rrf_k)[: self.k]
+
+
+def bm25_index_path(name: str) -> str:
+    """Directory of the BM25 index built for a vector index/collection."""
+    return os.path.join(settings.BM25_INDEX_DIR, name)
+
+
+def load_bm25_index(name: str) -> Optional[BM25Index]:
+    """The BM25 index for ``name`` when hybrid retrieval is on and it was built."""
+    if not settings.HYBRID_RETRIEVAL:
+        return None
+    path = bm25_index_path(name)
+    if not os.path.exists(os.path.join(path, BM25_META_FILE)):
+        logger.warning(
+            f"No BM25 index at {path}, using vector search only "
+            f"(build it with scripts/build_bm25_index.py)"
+        )
+        return None
+    return BM25Index(path)
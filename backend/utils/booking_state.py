@@ -0,0 +1,204 @@
+import psycopg2
+import json
+import re
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from config.settings import settings
+from utils.deadline import db_deadline_options, db_write_options
+
+logger = logging.getLogger(__name__)
+
+BOOKING_STATE_TIMEOUT = timedelta(minutes=30)  # Abandon half-finished bookings
+
+DATE_PATTERN = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+TIME_RANGE_PATTERN = re.compile(
+    r"\b([01]?\d|2[0-3]):([0-5]\d)\s*(?:-|–|to|until)\s*([01]?\d|2[0-3]):([0-5]\d)\b",
+    re.IGNORECASE,
+)
+WEEKDAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+WEEKDAY_PATTERN = re.compile(r"\b(" + "|".join(WEEKDAYS) + r")\b", re.IGNORECASE)
+BOOKING_INTENT_PATTERN = re.compile(
+    r"\b(book|booking|appointment|schedule|reschedule|slot|slots|available|"
+    r"availability)\b",
+    re.IGNORECASE,
+)
+
+
+class BookingState(BaseModel):
+    user_id: str
+    doctor_id: Optional[str] = None
+    doctor_username: Optional[str] = None
+    department_id: Optional[str] = None
+    hospital_id: Optional[str] = None
+    appointment_date: Optional[str] = None
+    # Doctors offered in the previous turn: [{"user_id", "username", "department_id"}]
+    candidates: List[Dict] = []
+    # The last reply offered the doctor's open slots and waits for one
+    awaiting_slot: bool = False
+    updated_at: Optional[datetime] = None
+
+    @property
+    def has_doctor(self) -> bool:
+        return bool(self.doctor_id and self.department_id and self.hospital_id)
+
+
+class FollowUp(BaseModel):
+    """Booking details a follow-up turn resolved without the router LLM."""
+
+    doctor_username: Optional[str] = None
+    appointment_date: Optional[str] = None
+    start_time: Optional[str] = None
+    end_time: Optional[str] = None
+
+
+def get_db_connection(write: bool = False):
+    # Inside a request, reads are bounded by its deadline; writes saving its
+    # result get a fixed timeout instead
+    return psycopg2.connect(
+        dbname=settings.DB_NAME,
+        user=settings.DB_USER,
+        password=settings.DB_PASSWORD,
+        host=settings.DB_HOST,
+        port=settings.DB_PORT,
+        **(db_write_options() if write else db_deadline_options()),
+    )
+
+
+def get_booking_state(user_id: str) -> Optional[BookingState]:
+    """Load the user's in-progress booking, ignoring stale sessions."""
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute(
+        """
+        SELECT doctor_id, doctor_username, department_id, hospital_id,
+               appointment_date, candidates, awaiting_slot, updated_at
+        FROM booking_sessions
+        WHERE user_id = %s
+        """,
+        (user_id,),
+    )
+    row = c.fetchone()
+    conn.close()
+    if not row:
+        return None
+    if row[7] and datetime.utcnow() - row[7] > BOOKING_STATE_TIMEOUT:
+        logger.info(f"Booking state for user {user_id} expired")
+        clear_booking_state(user_id)
+        return None
+    return BookingState(
+        user_id=user_id,
+        doctor_id=row[0],
+        doctor_username=row[1],
+        department_id=row[2],
+        hospital_id=row[3],
+        appointment_date=row[4],
+        candidates=json.loads(row[5]) if row[5] else [],
+        awaiting_slot=bool(row[6]),
+        updated_at=row[7],
+    )
+
+
+def save_booking_state(state: BookingState):
+    """Upsert the user's in-progress booking."""
+    state.updated_at = datetime.utcnow()
+    conn = get_db_connection(write=True)
+    c = conn.cursor()
+    c.execute(
+        """
+        INSERT INTO booking_sessions (
+            user_id, doctor_id, doctor_username, department_id, hospital_id,
+            appointment_date, candidates, awaiting_slot, updated_at
+        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON CONFLICT (user_id) DO UPDATE SET
+            doctor_id = EXCLUDED.doctor_id,
+            doctor_username = EXCLUDED.doctor_username,
+            department_id = EXCLUDED.department_id,
+            hospital_id = EXCLUDED.hospital_id,
+            appointment_date = EXCLUDED.appointment_date,
+            candidates = EXCLUDED.candidates,
+            awaiting_slot = EXCLUDED.awaiting_slot,
+            updated_at = EXCLUDED.updated_at
+        """,
+        (
+            state.user_id,
+            state.doctor_id,
+            state.doctor_username,
+            state.department_id,
+            state.hospital_id,
+            state.appointment_date,
+            json.dumps(state.candidates),
+            state.awaiting_slot,
+            state.updated_at,
+        ),
+    )
+    conn.commit()
+    conn.close()
+    logger.info(f"Saved booking state for user {state.user_id}")
+
+
+def clear_booking_state(user_id: str):
+    conn = get_db_connection(write=True)
+    c = conn.cursor()
+    c.execute("DELETE FROM booking_sessions WHERE user_id = %s", (user_id,))
+    conn.commit()
+    conn.close()
+
+
+def next_date_for_weekday(day_name: str, today: Optional[datetime] = None) -> str:
+    """Date (YYYY-MM-DD) of the next occurrence of a weekday, never today."""
+    today = today or datetime.now()
+    target_day_index = WEEKDAYS.index(day_name.lower())
+    days_until_target = (target_day_index - today.weekday() + 7) % 7
+    if days_until_target == 0:
+        days_until_target = 7
+    return (today + timedelta(days=days_until_target)).strftime("%Y-%m-%d")
+
+
+def resolve_followup(query: str, state: BookingState) -> Optional[FollowUp]:
+    """Extract booking details from a follow-up turn using the stored state.
+
+    Returns None when the message does not look like a continuation of the
+    booking, so the caller falls back to the router LLM. A date or time alone
+    ("a headache since Monday") only counts when the previous reply asked for
+    a slot or the message itself is about booking.
+    """
+    followup = FollowUp()
+
+    lowered = query.lower()
+    for candidate in state.candidates:
+        username = candidate.get("username")
+        if username and re.search(rf"\b{re.escape(username.lower())}\b", lowered):
+            followup.doctor_username = username
+            break
+
+    date_match = DATE_PATTERN.search(query)
+    if date_match:
+        followup.appointment_date = date_match.group(1)
+    else:
+        weekday_match = WEEKDAY_PATTERN.search(query)
+        if weekday_match:
+            followup.appointment_date = next_date_for_weekday(weekday_match.group(1))
+
+    time_match = TIME_RANGE_PATTERN.search(query)
+    if time_match:
+        followup.start_time = f"{int(time_match.group(1)):02d}:{time_match.group(2)}"
+        followup.end_time = f"{int(time_match.group(3)):02d}:{time_match.group(4)}"
+
+    if followup.doctor_username:
+        return followup
+    # Dates and slots only make sense once a doctor has been picked
+    if not (state.has_doctor and (followup.appointment_date or followup.start_time)):
+        return None
+    if state.awaiting_slot or BOOKING_INTENT_PATTERN.search(query):
+        return followup
+    return None
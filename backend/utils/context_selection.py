@@ -0,0 +1,176 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from config.settings import settings
+from utils.bm25_index import document_key, tokenize
+from utils.report_prompt import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class ContextStats:
+    """Documents and tokens before and after context selection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {
+            "selections": 0,
+            "docs_in": 0,
+            "docs_out": 0,
+            "tokens_in": 0,
+            "tokens_out": 0,
+        }
+
+    def record(self, docs_in: int, docs_out: int, tokens_in: int, tokens_out: int):
+        with self._lock:
+            self._totals["selections"] += 1
+            self._totals["docs_in"] += docs_in
+            self._totals["docs_out"] += docs_out
+            self._totals["tokens_in"] += tokens_in
+            self._totals["tokens_out"] += tokens_out
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            totals = dict(self._totals)
+        tokens_in = totals["tokens_in"]
+        totals["tokens_saved_pct"] = (
+            round(100 * (1 - totals["tokens_out"] / tokens_in), 1) if tokens_in else 0.0
+        )
+        return totals
+
+
+context_stats = ContextStats()
+
+
+def collapse_answer_groups(docs: List[Document]) -> List[Document]:
+    """One document per answer: chunks sharing an answer_group_id are merged in
+    chunk order at the rank of their best chunk, exact repeats are dropped."""
+    groups: "OrderedDict[str, List[Document]]" = OrderedDict()
+    for doc in docs:
+        group_id = doc.metadata.get("answer_group_id")
+        key = f"group:{group_id}" if group_id else f"doc:{document_key(doc)}"
+        chunks = groups.setdefault(key, [])
+        if all(chunk.page_content != doc.page_content for chunk in chunks):
+            chunks.append(doc)
+
+    collapsed = []
+    for chunks in groups.values():
+        if len(chunks) == 1:
+            collapsed.append(chunks[0])
+            continue
+        chunks.sort(key=lambda chunk: chunk.metadata.get("chunk_index", 0))
+        metadata = {**chunks[0].metadata, "chunk_count": len(chunks)}
+        metadata.pop("chunk_index", None)
+        collapsed.append(
+            Document(
+                page_content="\n".join(chunk.page_content for chunk in chunks),
+                metadata=metadata,
+            )
+        )
+    return collapsed
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def mmr_order(docs: List[Document], lambda_mult: float = 0.7) -> List[Document]:
+    """Reorder ``docs`` (best retrieval rank first) by maximal marginal relevance.
+
+    Relevance is the retrieval rank and redundancy is term overlap with the
+    documents already picked, so no extra embedding calls are needed.
+    """
+    if len(docs) < 3:
+        return list(docs)
+    terms = [frozenset(tokenize(doc.page_content)) for doc in docs]
+    relevance = [1 - rank / len(docs) for rank in range(len(docs))]
+    remaining = list(range(len(docs)))
+    picked: List[int] = []
+    while remaining:
+        best = max(
+            remaining,
+            key=lambda i: lambda_mult * relevance[i]
+            - (1 - lambda_mult)
+            * max((_jaccard(terms[i], terms[j]) for j in picked), default=0.0),
+        )
+        picked.append(best)
+        remaining.remove(best)
+    return [docs[i] for i in picked]
+
+
+def _truncate(doc: Document, budget: int, tokens: int) -> Document:
+    keep = int(len(doc.page_content) * budget / tokens)
+    return Document(
+        id=doc.id,
+        page_content=doc.page_content[:keep],
+        metadata={**doc.metadata, "truncated": True},
+    )
+
+
+def select_context(
+    docs: List[Document],
+    token_budget: Optional[int] = None,
+    lambda_mult: Optional[float] = None,
+) -> List[Document]:
+    """Non-redundant documents that fit the prompt's context token budget.
+
+    Collapses answer groups, orders by MMR and keeps the documents that fit;
+    when none does, the first is truncated so the context is never empty.
+    """
+    if not docs:
+        return []
+    budget = token_budget or settings.CONTEXT_TOKEN_BUDGET
+    lambda_mult = (
+        settings.CONTEXT_MMR_LAMBDA if lambda_mult is None else lambda_mult
+    )
+    candidates = mmr_order(collapse_answer_groups(docs), lambda_mult)
+
+    selected, used, tokens_in = [], 0, 0
+    sizes = [count_tokens(doc.page_content) for doc in candidates]
+    for doc, tokens in zip(candidates, sizes):
+        tokens_in += tokens
+        if used + tokens <= budget:
+            selected.append(doc)
+            used += tokens
+    if not selected:
+        selected, used = [_truncate(candidates[0], budget, sizes[0])], budget
+    context_stats.record(len(docs), len(selected), tokens_in, used)
+    logger.info(
+        f"Context selection: {len(docs)} chunks -> {len(selected)} documents, "
+        f"{used}/{budget} tokens"
+    )
+    return selected
+
+
+class ContextSelectingRetriever(BaseRetriever):
+    """Runs select_context on another retriever's results before they are
+    stuffed into the prompt."""
+
+    retriever: Any
+    token_budget: Optional[int] = None
+    lambda_mult: Optional[float] = None
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs = self.retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        return select_context(docs, self.token_budget, self.lambda_mult)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs = await self.retriever.ainvoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        return select_context(docs, self.token_budget, self.lambda_mult)
@@ -195,6 +195,24 @@ def init_db():
         """
     )
 
+    # Chatbot booking sessions table (one partially filled booking per user)
+    c.execute(
+        """
+        CREATE TABLE IF NOT EXISTS booking_sessions (
+            user_id UUID PRIMARY KEY,
+            doctor_id UUID,
+            doctor_username TEXT,
+            department_id UUID,
+            hospital_id UUID,
+            appointment_date TEXT,
+            candidates TEXT,
+            awaiting_slot BOOLEAN DEFAULT FALSE,
+            updated_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+        """
+    )
+
     conn.close()
     logger.info("Database initialized successfully")
 
@@ -0,0 +1,146 @@
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, Optional
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Monotonic time by which the request being served must be answered. Set per
+# request and inherited by threads started with asyncio.to_thread or a copied
+# context, so every stage sees the same budget.
+current_deadline: ContextVar[Optional[float]] = ContextVar(
+    "current_deadline", default=None
+)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a stage cannot run within the request's remaining budget."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Request deadline exceeded at {stage}")
+        self.stage = stage
+
+
+class DeadlineStats:
+    """Stages cut short by the deadline and degraded answers served."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(int)
+
+    def count(self, event: str):
+        with self._lock:
+            self._counts[event] += 1
+
+    def metrics(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+deadline_stats = DeadlineStats()
+
+
+@contextmanager
+def request_deadline(seconds: Optional[float]):
+    """Bound the enclosed work to ``seconds``; a tighter outer deadline wins."""
+    deadline = current_deadline.get()
+    if seconds:
+        candidate = time.monotonic() + seconds
+        deadline = candidate if deadline is None else min(deadline, candidate)
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
+
+
+def time_left() -> Optional[float]:
+    """Seconds until the current deadline, or None when there is none."""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline(stage: str, needed: float = 0.0):
+    """Refuse to start a stage that cannot finish in the remaining budget.
+
+    A stage needs at least DEADLINE_MIN_STAGE_SECONDS, or ``needed`` when that
+    is larger (e.g. a backoff sleep before a retry).
+    """
+    left = time_left()
+    if left is not None and left < max(needed, settings.DEADLINE_MIN_STAGE_SECONDS):
+        deadline_stats.count(f"exceeded:{stage}")
+        logger.warning(f"Deadline exceeded at {stage} ({left:.3f}s left)")
+        raise DeadlineExceeded(stage)
+
+
+def bounded_timeout(default: float) -> float:
+    """A stage timeout shortened to the remaining budget."""
+    left = time_left()
+    return default if left is None else max(0.0, min(default, left))
+
+
+def db_deadline_options() -> Dict:
+    """psycopg2.connect options bounding connect and statement time to the budget."""
+    left = time_left()
+    if left is None:
+        return {}
+    check_deadline("database")
+    return {
+        # libpq only accepts whole seconds here
+        "connect_timeout": max(1, math.ceil(left)),
+        "options": f"-c statement_timeout={max(1, int(left * 1000))}",
+    }
+
+
+def db_write_options() -> Dict:
+    """psycopg2.connect options for writes that record an answer already given.
+
+    These get a fixed DB_WRITE_TIMEOUT_SECONDS rather than the request's
+    remaining budget, so a request that used most of its budget still saves
+    its chat history and booking state.
+    """
+    seconds = settings.DB_WRITE_TIMEOUT_SECONDS
+    return {
+        "connect_timeout": max(1, math.ceil(seconds)),
+        "options": f"-c statement_timeout={max(1, int(seconds * 1000))}",
+    }
+
+
+async def run_in_budget(stage: str, func: Callable, /, *args, **kwargs):
+    """Run a blocking stage in a worker thread and stop waiting at the deadline.
+
+    An abandoned thread is not interrupted, but its LLM and database calls
+    carry the same deadline and give up on their own shortly after.
+    """
+    check_deadline(stage)
+    try:
+        return await asyncio.wait_for(
+            asyncio.to_thread(func, *args, **kwargs), timeout=time_left()
+        )
+    except asyncio.TimeoutError:
+        deadline_stats.count(f"exceeded:{stage}")
+        raise DeadlineExceeded(stage) from None
+
+
+async def await_in_budget(stage: str, awaitable: Awaitable):
+    """Await a coroutine and stop waiting (cancelling it) at the deadline."""
+    try:
+        check_deadline(stage)
+    except DeadlineExceeded:
+        # Never started: close it so it is not reported as never awaited
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise
+    try:
+        return await asyncio.wait_for(awaitable, timeout=time_left())
+    except asyncio.TimeoutError:
+        deadline_stats.count(f"exceeded:{stage}")
+        raise DeadlineExceeded(stage) from None
@@ -0,0 +1,252 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Share of the disk limit freed by each prune once the disk tier is full
+PRUNE_FRACTION = 0.1
+# Disk hits whose last_used update is held back and written in one batch
+TOUCH_BATCH_SIZE = 256
+
+
+def normalize_query(text: str) -> str:
+    """Casefold and collapse whitespace; queries differing only in that share
+    a cache entry and are embedded in this normalized form."""
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\0{text}".encode()).hexdigest()
+
+
+class EmbeddingCache:
+    """Query embeddings keyed by (model, normalized text).
+
+    An in-memory LRU sits in front of an optional sqlite file that survives
+    restarts and is shared by every worker on the host. Vectors are stored
+    as float32 blobs; the disk tier is pruned by least recent use.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        path: Optional[str] = None,
+        disk_max_entries: int = 200000,
+    ):
+        self.max_entries = max_entries
+        self.path = path
+        self.disk_max_entries = disk_max_entries
+        self._entries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._disk_writes = 0
+        # Disk hits not yet written back to last_used: key -> time of use
+        self._touched: Dict[str, float] = {}
+        self._stats = defaultdict(
+            lambda: {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        )
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if not self.path:
+            return None
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                )
+                """
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_last_used "
+                "ON embeddings (last_used)"
+            )
+            db.commit()
+            self._db = db
+            logger.info(f"Embedding cache on disk at {self.path}")
+        return self._db
+
+    def _remember(self, key: str, vector: List[float]):
+        with self._lock:
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, model: str, outcome: str):
+        with self._lock:
+            self._stats[model][outcome] += 1
+
+    def get_memory(self, model: str, text: str) -> Optional[List[float]]:
+        """In-memory tier only; never touches the disk."""
+        key = cache_key(model, text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self._stats[model]["memory_hits"] += 1
+            return vector
+
+    def get_disk(self, model: str, text: str) -> Optional[List[float]]:
+        """Disk tier lookup, promoting a hit to memory. Blocking.
+
+        The hit's last_used is only written back in batches (with the next
+        write or after TOUCH_BATCH_SIZE hits), so reads do not commit.
+        """
+        key = cache_key(model, text)
+        row = None
+        try:
+            with self._db_lock:
+                db = self._connection()
+                if db is not None:
+                    row = db.execute(
+                        "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                    ).fetchone()
+                    if row is not None:
+                        self._touched[key] = time.time()
+                        if len(self._touched) >= TOUCH_BATCH_SIZE:
+                            self._flush_touched(db)
+                            db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache read failed: {e}")
+        if row is None:
+            self._count(model, "misses")
+            return None
+        vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+        self._remember(key, vector)
+        self._count(model, "disk_hits")
+        return vector
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        vector = self.get_memory(model, text)
+        if vector is None:
+            vector = self.get_disk(model, text)
+        return vector
+
+    def _flush_touched(self, db: sqlite3.Connection):
+        """Write pending last_used updates; the caller holds the db lock and
+        commits."""
+        if self._touched:
+            db.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                [(used, key) for key, used in self._touched.items()],
+            )
+            self._touched = {}
+
+    def put(self, model: str, text: str, vector: List[float]):
+        key = cache_key(model, text)
+        self._remember(key, vector)
+        blob = np.asarray(vector, dtype=np.float32).tobytes()
+        try:
+            with self._db_lock:
+                db = self._connection()
+                if db is None:
+                    return
+                self._flush_touched(db)
+                db.execute(
+                    "INSERT OR REPLACE INTO embeddings "
+                    "(key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                    (key, model, blob, time.time()),
+                )
+                db.commit()
+                self._disk_writes += 1
+                if self._disk_writes % 1000 == 0:
+                    self._prune(db)
+        except sqlite3.Error as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def _prune(self, db: sqlite3.Connection):
+        (count,) = db.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if count <= self.disk_max_entries:
+            return
+        # Drop a little extra so pruning does not run on every write
+        excess = count - int(self.disk_max_entries * (1 - PRUNE_FRACTION))
+        db.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        db.commit()
+        logger.info(f"Pruned {excess} embeddings from the disk cache")
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            per_model = {k: dict(v) for k, v in self._stats.items()}
+            size = len(self._entries)
+        totals = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        for counts in per_model.values():
+            for k in totals:
+                totals[k] += counts[k]
+        lookups = sum(totals.values())
+        hits = totals["memory_hits"] + totals["disk_hits"]
+        return {
+            "entries": size,
+            "max_entries": self.max_entries,
+            "disk_path": self.path,
+            **totals,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "by_model": per_model,
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper answering repeated ``embed_query`` calls from the
+    embedding cache. Document batches (ingestion) pass through."""
+
+    def __init__(self, inner: Embeddings, model: str, cache: EmbeddingCache):
+        self.inner = inner
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.inner.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        text = normalize_query(text)
+        vector = self.cache.get(self.model, text)
+        if vector is None:
+            vector = self.inner.embed_query(text)
+            self.cache.put(self.model, text, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        text = normalize_query(text)
+        vector = self.cache.get_memory(self.model, text)
+        if vector is not None:
+            return vector
+        # The sqlite tier blocks (up to its lock timeout), keep it off the loop
+        vector = await asyncio.to_thread(self.cache.get_disk, self.model, text)
+        if vector is None:
+            vector = await self.inner.aembed_query(text)
+            await asyncio.to_thread(self.cache.put, self.model, text, vector)
+        return vector
+
+
+embedding_cache = EmbeddingCache(
+    max_entries=settings.EMBEDDING_CACHE_MAX_ENTRIES,
+    path=settings.EMBEDDING_CACHE_PATH or None,
+    disk_max_entries=settings.EMBEDDING_CACHE_DISK_MAX_ENTRIES,
+)
@@ -0,0 +1,182 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import pandas as pd
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _write_json(path: str, data: Dict):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Write then rename, so a crash never leaves a half-written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class IngestCheckpoint:
+    """Progress of one ingestion run (source rows done, vectors written),
+    saved to a JSON file after every committed batch so a crashed run
+    resumes where it stopped instead of re-embedding the whole source."""
+
+    def __init__(self, name: str, source: str, path: Optional[str] = None):
+        self.path = path or os.path.join(settings.INGEST_CHECKPOINT_DIR, f"{name}.json")
+        self.source = os.path.abspath(source)
+        self.state: Dict = {
+            "source": self.source,
+            "rows_done": 0,
+            "vectors_written": 0,
+        }
+
+    def load(self) -> "IngestCheckpoint":
+        if not os.path.exists(self.path):
+            return self
+        with open(self.path) as f:
+            saved = json.load(f)
+        if saved.get("source") != self.source:
+            logger.warning(
+                f"Checkpoint {self.path} belongs to {saved.get('source')}, "
+                f"starting {self.source} from the beginning"
+            )
+            return self
+        self.state.update(saved)
+        logger.info(
+            f"Resuming {self.source} after {self.rows_done} rows "
+            f"({self.state['vectors_written']} vectors written)"
+        )
+        return self
+
+    @property
+    def rows_done(self) -> int:
+        return self.state["rows_done"]
+
+    def advance(self, rows: int, vectors: int, **extra):
+        self.state["rows_done"] += rows
+        self.state["vectors_written"] += vectors
+        self.state.update(extra)
+        self.save()
+
+    def save(self):
+        self.state["updated_at"] = datetime.utcnow().isoformat()
+        _write_json(self.path, self.state)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def content_hash(*parts: str) -> str:
+    """Deterministic id for a piece of content (64 hex characters)."""
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+class IngestManifest:
+    """Content hashes already written to a vector store, with the number of
+    vectors each produced. Re-indexing compares a source against it to
+    embed only new or changed rows and delete the ones that disappeared.
+
+    Changes are appended to a log next to the snapshot, so recording a batch
+    costs the size of the batch; ``save`` folds the log into the snapshot and
+    is called once a run ends.
+    """
+
+    def __init__(self, name: str, path: Optional[str] = None):
+        self.path = path or os.path.join(
+            settings.INGEST_CHECKPOINT_DIR, f"{name}.manifest.json"
+        )
+        self.log_path = f"{self.path}.log"
+        self.entries: Dict[str, int] = {}
+
+    def load(self) -> "IngestManifest":
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.entries = json.load(f)["entries"]
+        if os.path.exists(self.log_path):
+            with open(self.log_path) as f:
+                for line in f:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        # A crash mid-append leaves a partial last line
+                        logger.warning(f"Ignoring partial entry in {self.log_path}")
+                        break
+                    self.entries.update(change.get("add", {}))
+                    for key in change.get("remove", []):
+                        self.entries.pop(key, None)
+            # Start the next run on an empty log
+            self.save()
+        if self.entries:
+            logger.info(f"Manifest {self.path}: {len(self.entries)} rows indexed")
+        return self
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _append(self, change: Dict):
+        directory = os.path.dirname(self.log_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.log_path, "a") as f:
+            f.write(json.dumps(change) + "\n")
+
+    def add(self, entries: Dict[str, int]):
+        self.entries.update(entries)
+        self._append({"add": entries})
+
+    def remove(self, keys: Iterable[str]):
+        keys = list(keys)
+        for key in keys:
+            self.entries.pop(key, None)
+        self._append({"remove": keys})
+
+    def save(self):
+        """Write the snapshot and drop the log it now contains. Replaying a
+        log left by a crash in between is harmless."""
+        _write_json(
+            self.path,
+            {"updated_at": datetime.utcnow().isoformat(), "entries": self.entries},
+        )
+        if os.path.exists(self.log_path):
+            os.remove(self.log_path)
+
+    def clear(self):
+        self.entries = {}
+        for path in (self.path, self.log_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def read_csv_chunks(
+    path: str, rows: Optional[int] = None, skip_rows: int = 0
+) -> Iterator[pd.DataFrame]:
+    """The CSV in DataFrames of ``rows`` rows, after the first ``skip_rows``.
+
+    Only one chunk is in memory at a time; index labels keep counting from
+    the start of the file so row positions stay stable across resumes.
+    """
+    rows = rows or settings.INGEST_READ_ROWS
+    position = skip_rows
+    for frame in pd.read_csv(
+        path, chunksize=rows, skiprows=range(1, skip_rows + 1)
+    ):
+        frame.index = range(position, position + len(frame))
+        position += len(frame)
+        yield frame
+
+
+def dedupe_texts(texts: List[str]) -> Tuple[List[str], List[int]]:
+    """Unique texts in first-seen order, and for each input text the position
+    of its unique copy, so one embedding can be shared by all repeats."""
+    positions: Dict[str, int] = {}
+    mapping = [positions.setdefault(text, len(positions)) for text in texts]
+    return list(positions), mapping
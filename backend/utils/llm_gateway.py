@@ -0,0 +1,599 @@
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, List, Optional
+import httpx
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from config.settings import settings
+from utils.embedding_cache import CachedEmbeddings, embedding_cache
+from utils.deadline import DeadlineExceeded, check_deadline, time_left
+from utils.llm_ledger import GATEWAY_LEDGER_KEY, track_llm_call
+from utils.llm_limiter import estimate_tokens, get_limiter, plan_retry
+from utils.llm_policy import Route, route_policy
+from utils.llm_providers import (
+    ChatCompletion,
+    get_provider,
+    to_chat_result,
+    to_message_dicts,
+)
+from utils.single_flight import embedding_flights, llm_flights, request_key
+
+logger = logging.getLogger(__name__)
+
+# Long-lived clients, one sync and one async per provider, shared by every call
+_clients: Dict[str, object] = {}
+_clients_lock = threading.Lock()
+
+# Runs the hedge attempts of sync calls; the first attempt stays in the
+# caller's thread, and a hedge is skipped rather than queued when all are busy
+_hedge_executor = ThreadPoolExecutor(
+    max_workers=settings.LLM_HEDGE_THREADS, thread_name_prefix="llm-hedge"
+)
+_hedge_slots = threading.BoundedSemaphore(settings.LLM_HEDGE_THREADS)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=settings.LLM_HTTP_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        settings.LLM_HTTP_TIMEOUT, connect=settings.LLM_HTTP_CONNECT_TIMEOUT
+    )
+
+
+def get_http_client() -> httpx.Client:
+    """Keep-alive connection pool shared by the sync provider SDK clients."""
+    return _get_or_create("http", lambda: httpx.Client(limits=_limits(), timeout=_timeout()))
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Keep-alive connection pool shared by the async provider SDK clients."""
+    return _get_or_create(
+        "http_async", lambda: httpx.AsyncClient(limits=_limits(), timeout=_timeout())
+    )
+
+
+def _get_or_create(key: str, factory):
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = factory()
+                _clients[key] = client
+                logger.info(f"Created long-lived LLM client '{key}'")
+    return client
+
+
+def _make_sdk_client(provider: str, use_async: bool):
+    common = {
+        "timeout": _timeout(),
+        "max_retries": settings.LLM_MAX_RETRIES,
+        "http_client": get_async_http_client() if use_async else get_http_client(),
+    }
+    if provider == "openai":
+        from openai import AsyncOpenAI, OpenAI
+
+        cls = AsyncOpenAI if use_async else OpenAI
+        return cls(api_key=settings.OPENAI_API_KEY, **common)
+    if provider == "groq":
+        from groq import AsyncGroq, Groq
+
+        cls = AsyncGroq if use_async else Groq
+        return cls(api_key=settings.GROQ_API_KEY, **common)
+    if provider == "local":
+        from openai import AsyncOpenAI, OpenAI
+
+        cls = AsyncOpenAI if use_async else OpenAI
+        return cls(
+            api_key=settings.LOCAL_LLM_API_KEY,
+            base_url=settings.LOCAL_LLM_BASE_URL,
+            **common,
+        )
+    raise ValueError(f"No SDK client for provider: {provider}")
+
+
+def get_client(provider: str):
+    """Shared sync SDK client (OpenAI or Groq) for a provider."""
+    return _get_or_create(provider, lambda: _make_sdk_client(provider, False))
+
+
+def get_async_client(provider: str):
+    """Shared async SDK client (AsyncOpenAI or AsyncGroq) for a provider."""
+    return _get_or_create(
+        f"{provider}_async", lambda: _make_sdk_client(provider, True)
+    )
+
+
+async def close_clients():
+    """Close every pooled client; called on application shutdown."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            if isinstance(client, httpx.AsyncClient):
+                await client.aclose()
+            elif isinstance(client, httpx.Client):
+                client.close()
+        except Exception as e:
+            logger.warning(f"Failed to close LLM client: {e}")
+
+
+def chat_completion(
+    provider: str, model: str, messages: List[Dict], stage: str, **params
+) -> ChatCompletion:
+    """Run one chat completion through the gateway and record it in the ledger.
+
+    Identical concurrent calls (same provider, model, messages and params)
+    share a single upstream call. A call still running after the route's p95
+    latency is hedged on an alternate provider/model and a failed call fails
+    over to the next alternate; the first good answer wins. Each attempt is
+    admitted by the provider/model limiter and transient failures (429, 5xx,
+    timeouts) are retried with jittered exponential backoff. Attempts and
+    retries are not started once the request deadline is too close.
+    """
+    if not settings.LLM_COALESCE:
+        return _routed_completion(provider, model, messages, stage, params)
+    key = request_key(provider, model, messages, params)
+    return llm_flights.do(
+        key, lambda: _routed_completion(provider, model, messages, stage, params)
+    )
+
+
+async def achat_completion(
+    provider: str, model: str, messages: List[Dict], stage: str, **params
+) -> ChatCompletion:
+    if not settings.LLM_COALESCE:
+        return await _arouted_completion(provider, model, messages, stage, params)
+    key = request_key(provider, model, messages, params)
+    return await llm_flights.ado(
+        key, lambda: _arouted_completion(provider, model, messages, stage, params)
+    )
+
+
+def _call_route(route: Route, messages: List[Dict], stage: str, params: Dict):
+    started = time.perf_counter()
+    try:
+        result = _chat_completion(route[0], route[1], messages, stage, **params)
+    except Exception as e:
+        route_policy.record_failure(route, e)
+        raise
+    route_policy.record_success(route, time.perf_counter() - started)
+    return result
+
+
+async def _acall_route(route: Route, messages: List[Dict], stage: str, params: Dict):
+    started = time.perf_counter()
+    try:
+        result = await _achat_completion(route[0], route[1], messages, stage, **params)
+    except Exception as e:
+        route_policy.record_failure(route, e)
+        raise
+    route_policy.record_success(route, time.perf_counter() - started)
+    return result
+
+
+def _log_route_win(routes: List[Route], route: Route, hedged: bool):
+    if route != routes[0]:
+        route_policy.count("hedge_wins" if hedged else "failover_successes")
+        logger.info(f"{routes[0][0]}/{routes[0][1]} answered by {route[0]}/{route[1]}")
+
+
+def _next_route(routes: List[Route], start: int) -> Optional[int]:
+    """Index of the first route from ``start`` whose breaker lets an attempt in.
+
+    The first attempt of a call always goes somewhere: the primary when every
+    breaker refuses.
+    """
+    for index in range(start, len(routes)):
+        if route_policy.breaker(routes[index][0]).allow():
+            return index
+    return 0 if start == 0 else None
+
+
+class _Hedge:
+    """A hedge attempt started on the pool once the inline attempt is slow."""
+
+    def __init__(
+        self,
+        routes: List[Route],
+        start: int,
+        messages: List[Dict],
+        stage: str,
+        params: Dict,
+    ):
+        self.routes = routes
+        self.start = start
+        self.messages = messages
+        self.stage = stage
+        self.params = params
+        self.index: Optional[int] = None
+        self.future: Optional[Future] = None
+        # Keep the request ID and deadline visible inside the pool thread
+        self._context = contextvars.copy_context()
+        self._lock = threading.Lock()
+        self._done = False
+        self._timer: Optional[threading.Timer] = None
+
+    def schedule(self, delay: float):
+        self._timer = threading.Timer(delay, self._launch)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _launch(self):
+        with self._lock:
+            if self._done:
+                return
+            if not _hedge_slots.acquire(blocking=False):
+                route_policy.count("hedges_skipped")
+                return
+            index = _next_route(self.routes, self.start)
+            if index is None:
+                _hedge_slots.release()
+                return
+            route_policy.count("hedges")
+            self.index = index
+            self.future = _hedge_executor.submit(
+                self._context.run,
+                _call_route,
+                self.routes[index],
+                self.messages,
+                self.stage,
+                self.params,
+            )
+            self.future.add_done_callback(lambda _: _hedge_slots.release())
+
+    def cancel(self):
+        """Stop a hedge that has not started; a started one keeps running."""
+        with self._lock:
+            self._done = True
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+def _routed_completion(
+    provider: str, model: str, messages: List[Dict], stage: str, params: Dict
+) -> ChatCompletion:
+    routes = route_policy.routes(provider, model)
+    delay = route_policy.hedge_delay(provider, model, stage)
+    index = _next_route(routes, 0)
+    # The first attempt runs inline in the caller's thread; only a hedge, if
+    # the attempt outlasts the delay, takes a pool thread. A sync call cannot
+    # walk away from its inline attempt, so the hedge gives a failover a head
+    # start rather than racing it.
+    hedge = None
+    if delay is not None and index + 1 < len(routes):
+        hedge = _Hedge(routes, index + 1, messages, stage, params)
+        hedge.schedule(delay)
+    try:
+        result = _call_route(routes[index], messages, stage, params)
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        last_error = e
+    else:
+        _log_route_win(routes, routes[index], hedged=False)
+        return result
+    finally:
+        if hedge is not None:
+            hedge.cancel()
+
+    start = index + 1
+    if hedge is not None and hedge.future is not None:
+        try:
+            result = hedge.future.result()
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            last_error = e
+        else:
+            _log_route_win(routes, routes[hedge.index], hedged=True)
+            return result
+        start = hedge.index + 1
+
+    # Then the remaining routes in order
+    while True:
+        index = _next_route(routes, start)
+        if index is None:
+            raise last_error
+        route_policy.count("failovers")
+        try:
+            result = _call_route(routes[index], messages, stage, params)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            last_error = e
+            start = index + 1
+            continue
+        _log_route_win(routes, routes[index], hedged=False)
+        return result
+
+
+async def _arouted_completion(
+    provider: str, model: str, messages: List[Dict], stage: str, params: Dict
+) -> ChatCompletion:
+    routes = route_policy.routes(provider, model)
+    delay = route_policy.hedge_delay(provider, model, stage)
+    pending = {}
+    next_index = 0
+    hedged = False
+    last_error = None
+
+    def launch() -> bool:
+        nonlocal next_index
+        index = _next_route(routes, next_index)
+        if index is None:
+            next_index = len(routes)
+            return False
+        next_index = index + 1
+        route = routes[index]
+        task = asyncio.ensure_future(_acall_route(route, messages, stage, params))
+        pending[task] = route
+        return True
+
+    launch()
+    try:
+        while pending:
+            can_hedge = delay is not None and not hedged and next_index < len(routes)
+            done, _ = await asyncio.wait(
+                list(pending),
+                timeout=delay if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if not done:
+                if launch():
+                    hedged = True
+                    route_policy.count("hedges")
+                continue
+            for task in done:
+                route = pending.pop(task)
+                try:
+                    result = task.result()
+                except DeadlineExceeded:
+                    raise
+                except Exception as e:
+                    last_error = e
+                    if not pending and launch():
+                        route_policy.count("failovers")
+                    continue
+                _log_route_win(routes, route, hedged)
+                return result
+        raise last_error
+    finally:
+        # Cancel the losing attempts
+        for task in pending:
+            task.cancel()
+
+
+def _chat_completion(
+    provider: str, model: str, messages: List[Dict], stage: str, **params
+) -> ChatCompletion:
+    backend = get_provider(provider)
+    limiter = get_limiter(backend.name, model)
+    estimated = estimate_tokens(messages, params)
+    attempt = 0
+    while True:
+        check_deadline(stage)
+        limiter.acquire(estimated)
+        try:
+            with track_llm_call(stage, backend.name, model) as call:
+                result = backend.complete(model, messages, stage=stage, **params)
+                call.model = result.model
+                call.set_usage(result.prompt_tokens, result.completion_tokens)
+        except Exception as e:
+            retry, delay = plan_retry(limiter, e, attempt)
+            if not retry:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        limiter.settle(estimated, result.prompt_tokens + result.completion_tokens)
+        return result
+
+
+async def _achat_completion(
+    provider: str, model: str, messages: List[Dict], stage: str, **params
+) -> ChatCompletion:
+    backend = get_provider(provider)
+    limiter = get_limiter(backend.name, model)
+    estimated = estimate_tokens(messages, params)
+    attempt = 0
+    while True:
+        check_deadline(stage)
+        await limiter.aacquire(estimated)
+        try:
+            with track_llm_call(stage, backend.name, model) as call:
+                try:
+                    result = await asyncio.wait_for(
+                        backend.acomplete(model, messages, stage=stage, **params),
+                        timeout=time_left(),
+                    )
+                except asyncio.TimeoutError:
+                    raise DeadlineExceeded(stage) from None
+                call.model = result.model
+                call.set_usage(result.prompt_tokens, result.completion_tokens)
+        except Exception as e:
+            retry, delay = plan_retry(limiter, e, attempt)
+            if not retry:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        limiter.settle(estimated, result.prompt_tokens + result.completion_tokens)
+        return result
+
+
+class GatewayChatModel(BaseChatModel):
+    """LangChain chat model whose calls go through chat_completion, so chains
+    get the same admission, retries, coalescing, hedging and failover as
+    direct calls. The gateway writes the ledger record itself."""
+
+    provider: str
+    model_name: str
+    stage: str = "default"
+    params: Dict[str, Any] = {}
+    # Tells LedgerCallbackHandler not to record these calls a second time
+    metadata: Optional[Dict[str, Any]] = {GATEWAY_LEDGER_KEY: True}
+
+    @property
+    def _llm_type(self) -> str:
+        return "curewise-gateway"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"provider": self.provider, "model": self.model_name, **self.params}
+
+    def _call_params(self, stop: Optional[List[str]]) -> Dict[str, Any]:
+        return {**self.params, "stop": stop} if stop else dict(self.params)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        completion = chat_completion(
+            self.provider,
+            self.model_name,
+            to_message_dicts(messages),
+            self.stage,
+            **self._call_params(stop),
+        )
+        return to_chat_result(completion)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        completion = await achat_completion(
+            self.provider,
+            self.model_name,
+            to_message_dicts(messages),
+            self.stage,
+            **self._call_params(stop),
+        )
+        return to_chat_result(completion)
+
+
+def get_chat_model(provider: str, model: str, stage: str = "default", **params):
+    """LangChain chat model for a provider/model, routed through the gateway."""
+    return GatewayChatModel(
+        provider=provider, model_name=model, stage=stage, params=params
+    )
+
+
+async def astream_chat_completion(
+    provider: str, model: str, messages: List[Dict], stage: str, **params
+) -> AsyncIterator[str]:
+    """Stream a chat completion as text deltas and record it in the ledger.
+
+    Streams are admitted by the limiter but never coalesced or hedged. A
+    failure before the first token is retried like a regular call; once
+    text has been sent the error propagates.
+    """
+    backend = get_provider(provider)
+    limiter = get_limiter(backend.name, model)
+    estimated = estimate_tokens(messages, params)
+    attempt = 0
+    while True:
+        check_deadline(stage)
+        await limiter.aacquire(estimated)
+        usage = {}
+        started = time.perf_counter()
+        streaming = False
+        try:
+            with track_llm_call(stage, backend.name, model) as call:
+                async for delta in backend.astream(
+                    model, messages, stage=stage, usage=usage, **params
+                ):
+                    if not streaming:
+                        streaming = True
+                        call.first_token_ms = (time.perf_counter() - started) * 1000
+                    yield delta
+                call.set_usage(usage.get("prompt_tokens"), usage.get("completion_tokens"))
+        except Exception as e:
+            if streaming:
+                raise
+            retry, delay = plan_retry(limiter, e, attempt)
+            if not retry:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        limiter.settle(
+            estimated, usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+        )
+        return
+
+
+class CoalescingEmbeddings(Embeddings):
+    """Embeddings wrapper that shares one upstream call between concurrent
+    identical ``embed_query`` requests. Document batches pass through."""
+
+    def __init__(self, inner: Embeddings, key: str):
+        self.inner = inner
+        self.key = key
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await self.inner.aembed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return embedding_flights.do(
+            request_key(self.key, text), lambda: self.inner.embed_query(text)
+        )
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await embedding_flights.ado(
+            request_key(self.key, text), lambda: self.inner.aembed_query(text)
+        )
+
+
+def embed_documents(
+    provider: str, model: str, texts: List[str], embeddings: Embeddings = None
+) -> List[List[float]]:
+    """Embed a document batch admitted by the provider/model limiter.
+
+    Bulk callers (ingestion) go through the same RPM/TPM buckets and retry
+    policy as chat calls, so concurrent batches back off instead of failing.
+    """
+    backend = get_provider(provider, chat=False)
+    embeddings = embeddings or get_embeddings(provider, model)
+    limiter = get_limiter(backend.name, model)
+    # ~4 characters per token, as for chat prompts
+    estimated = sum(len(text) for text in texts) // 4 + 1
+    attempt = 0
+    while True:
+        limiter.acquire(estimated)
+        try:
+            with track_llm_call("embed_documents", backend.name, model) as call:
+                vectors = embeddings.embed_documents(texts)
+                call.set_usage(estimated, 0)
+        except Exception as e:
+            retry, delay = plan_retry(limiter, e, attempt)
+            if not retry:
+                raise
+            time.sleep(delay)
+            attempt += 1
+            continue
+        limiter.settle(estimated, estimated)
+        return vectors
+
+
+def get_embeddings(provider: str, model: str) -> Embeddings:
+    """Embeddings for a provider/model. Query embeddings are served from the
+    embedding cache when possible; concurrent misses share one upstream call."""
+    backend = get_provider(provider, chat=False)
+    embeddings = backend.embeddings(model)
+    if settings.LLM_COALESCE:
+        embeddings = CoalescingEmbeddings(embeddings, f"{provider}/{model}")
+    if settings.EMBEDDING_CACHE_ENABLED:
+        # Keyed by the serving backend so stub vectors never answer live calls
+        embeddings = CachedEmbeddings(
+            embeddings, f"{backend.name}/{model}", embedding_cache
+        )
+    return embeddings
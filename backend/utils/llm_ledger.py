@@ -0,0 +1,262 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from langchain_core.callbacks import BaseCallbackHandler
+from pydantic import BaseModel
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Request ID of the API call currently being served (set by the HTTP middleware)
+current_request_id: ContextVar[Optional[str]] = ContextVar(
+    "current_request_id", default=None
+)
+
+# USD per 1M tokens: (prompt, completion)
+MODEL_PRICING = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "text-embedding-3-small": (0.02, 0.0),
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+    "meta-llama/llama-4-scout-17b-16e-instruct": (0.11, 0.34),
+    "gemini-1.5-flash-latest": (0.075, 0.30),
+    "models/embedding-001": (0.0, 0.0),
+}
+
+
+class LLMCallRecord(BaseModel):
+    request_id: Optional[str] = None
+    stage: str
+    provider: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_ms: float = 0.0
+    # Time to the first streamed token, for streaming calls
+    first_token_ms: Optional[float] = None
+    cost_usd: float = 0.0
+    outcome: str = "ok"
+    error: Optional[str] = None
+    created_at: datetime
+
+    def set_usage(self, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+        self.prompt_tokens = int(prompt_tokens or 0)
+        self.completion_tokens = int(completion_tokens or 0)
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = MODEL_PRICING.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6
+
+
+class LLMLedger:
+    """Bounded in-memory ledger of LLM calls, grouped by request ID."""
+
+    def __init__(self, max_records: int = 5000, max_requests: int = 1000):
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=max_records)
+        self._by_request = OrderedDict()
+        self._max_requests = max_requests
+
+    def add(self, record: LLMCallRecord):
+        record.cost_usd = estimate_cost(
+            record.model, record.prompt_tokens, record.completion_tokens
+        )
+        with self._lock:
+            self._records.append(record)
+            if record.request_id:
+                self._by_request.setdefault(record.request_id, []).append(record)
+                self._by_request.move_to_end(record.request_id)
+                while len(self._by_request) > self._max_requests:
+                    self._by_request.popitem(last=False)
+        logger.info(
+            f"LLM call [{record.request_id}] {record.stage} {record.provider}/{record.model}: "
+            f"{record.outcome}, {record.prompt_tokens}+{record.completion_tokens} tokens, "
+            f"{record.latency_ms:.0f} ms"
+        )
+
+    def request_calls(self, request_id: str) -> List[LLMCallRecord]:
+        with self._lock:
+            return list(self._by_request.get(request_id, []))
+
+    def recent(self, limit: int = 50) -> List[LLMCallRecord]:
+        with self._lock:
+            return list(self._records)[-limit:]
+
+    def metrics(self) -> Dict[str, Any]:
+        """Aggregate the retained records per stage and per model."""
+        with self._lock:
+            records = list(self._records)
+            request_count = len(self._by_request)
+
+        def summarize(group: List[LLMCallRecord]) -> Dict[str, Any]:
+            latencies = sorted(r.latency_ms for r in group)
+            first_tokens = sorted(
+                r.first_token_ms for r in group if r.first_token_ms is not None
+            )
+            summary = {
+                "calls": len(group),
+                "errors": sum(1 for r in group if r.outcome != "ok"),
+                "prompt_tokens": sum(r.prompt_tokens for r in group),
+                "completion_tokens": sum(r.completion_tokens for r in group),
+                "cost_usd": round(sum(r.cost_usd for r in group), 6),
+                "avg_latency_ms": round(sum(latencies) / len(latencies), 1),
+                "p50_latency_ms": round(latencies[len(latencies) // 2], 1),
+                "p95_latency_ms": round(
+                    latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1
+                ),
+            }
+            if first_tokens:
+                summary["p50_first_token_ms"] = round(
+                    first_tokens[len(first_tokens) // 2], 1
+                )
+            return summary
+
+        by_stage = defaultdict(list)
+        by_model = defaultdict(list)
+        for record in records:
+            by_stage[record.stage].append(record)
+            by_model[f"{record.provider}/{record.model}"].append(record)
+
+        return {
+            "total": summarize(records) if records else {"calls": 0},
+            "requests_tracked": request_count,
+            "calls_per_request": (
+                round(
+                    sum(1 for r in records if r.request_id) / request_count, 2
+                )
+                if request_count
+                else 0
+            ),
+            "by_stage": {k: summarize(v) for k, v in by_stage.items()},
+            "by_model": {k: summarize(v) for k, v in by_model.items()},
+        }
+
+
+ledger = LLMLedger(max_records=settings.LLM_LEDGER_MAX_RECORDS)
+
+
+@contextmanager
+def track_llm_call(stage: str, provider: str, model: str):
+    """Time an LLM call and add it to the ledger.
+
+    The caller reports token usage with ``record.set_usage`` or
+    ``record_usage``; failures are recorded and re-raised.
+    """
+    record = LLMCallRecord(
+        request_id=current_request_id.get(),
+        stage=stage,
+        provider=provider,
+        model=model,
+        created_at=datetime.utcnow(),
+    )
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record.outcome = "cancelled" if not isinstance(e, Exception) else "error"
+        record.error = str(e)[:500]
+        raise
+    finally:
+        record.latency_ms = (time.perf_counter() - start) * 1000
+        ledger.add(record)
+
+
+def record_usage(record: LLMCallRecord, response: Any):
+    """Copy token usage from an OpenAI/Groq chat completion onto a record."""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        record.set_usage(
+            getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0)
+        )
+
+
+# Metadata flag of chat models that record their own calls (the gateway's)
+GATEWAY_LEDGER_KEY = "gateway_ledger"
+
+
+class LedgerCallbackHandler(BaseCallbackHandler):
+    """LangChain callback that records every chat model call in a chain.
+
+    Calls of models flagged with GATEWAY_LEDGER_KEY are already recorded by
+    the gateway and are skipped.
+    """
+
+    def __init__(self, stage: str, provider: str):
+        self.stage = stage
+        self.provider = provider
+        self._runs = {}
+
+    def _start(self, run_id, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        metadata = kwargs.get("metadata") or {}
+        if metadata.get(GATEWAY_LEDGER_KEY):
+            return
+        model = (
+            params.get("model")
+            or params.get("model_name")
+            or metadata.get("ls_model_name")
+            or "unknown"
+        )
+        self._runs[run_id] = (time.perf_counter(), model, current_request_id.get())
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, kwargs)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, kwargs)
+
+    def _finish(self, run_id, outcome: str, error: Optional[str] = None):
+        start, model, request_id = self._runs.pop(
+            run_id, (time.perf_counter(), "unknown", current_request_id.get())
+        )
+        return LLMCallRecord(
+            request_id=request_id,
+            stage=self.stage,
+            provider=self.provider,
+            model=model,
+            latency_ms=(time.perf_counter() - start) * 1000,
+            outcome=outcome,
+            error=error,
+            created_at=datetime.utcnow(),
+        )
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        if run_id not in self._runs:
+            return
+        record = self._finish(run_id, "ok")
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+        if not prompt_tokens and response.llm_output:
+            token_usage = response.llm_output.get("token_usage") or {}
+            prompt_tokens = token_usage.get("prompt_tokens", 0)
+            completion_tokens = token_usage.get("completion_tokens", 0)
+        record.set_usage(prompt_tokens, completion_tokens)
+        ledger.add(record)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        if run_id not in self._runs:
+            return
+        ledger.add(self._finish(run_id, "error", str(error)[:500]))
+
+
+def ledger_callbacks(stage: str, provider: str) -> Dict[str, List]:
+    """RunnableConfig that attaches the ledger to a LangChain invoke."""
+    return {"callbacks": [LedgerCallbackHandler(stage, provider)]}
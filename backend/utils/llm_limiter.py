@@ -0,0 +1,295 @@
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+import httpx
+from config.settings import settings
+from utils.deadline import check_deadline, time_left
+from utils.llm_providers import StubProviderError, message_text
+
+logger = logging.getLogger(__name__)
+
+# Per provider/model limits: requests per minute and tokens per minute.
+# 0 disables a limit. Override or extend with the LLM_RATE_LIMITS JSON setting.
+DEFAULT_RATE_LIMITS = {
+    "openai/gpt-4o-mini": {"rpm": 500, "tpm": 200000},
+    "openai/gpt-4o": {"rpm": 500, "tpm": 30000},
+    "openai/gpt-4.1-nano": {"rpm": 500, "tpm": 200000},
+    "groq/llama-3.3-70b-versatile": {"rpm": 30, "tpm": 12000},
+    "groq/llama-3.1-8b-instant": {"rpm": 30, "tpm": 6000},
+    "groq/meta-llama/llama-4-scout-17b-16e-instruct": {"rpm": 30, "tpm": 30000},
+    "gemini/gemini-1.5-flash-latest": {"rpm": 15, "tpm": 1000000},
+    "openai/text-embedding-3-small": {"rpm": 3000, "tpm": 1000000},
+    "gemini/models/embedding-001": {"rpm": 1500, "tpm": 0},
+    # Self-hosted and offline backends are only bounded by the wait queue
+    "local/*": {"rpm": 0, "tpm": 0},
+    "stub/*": {"rpm": 0, "tpm": 0},
+}
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMQueueFullError(Exception):
+    """Raised when too many calls are already waiting for a provider/model."""
+
+
+class TokenBucket:
+    """Refills ``per_minute`` units per minute up to one minute of burst."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+
+    @property
+    def unlimited(self) -> bool:
+        return self.capacity <= 0
+
+    def refill(self, now: float):
+        if not self.unlimited:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if self.unlimited:
+            return 0.0
+        # A request bigger than the whole bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        if not self.unlimited:
+            self.tokens -= min(amount, self.capacity)
+
+
+class ModelLimiter:
+    """Admission control for one provider/model: RPM and TPM token buckets,
+    a bounded wait queue and a pause window after upstream 429s."""
+
+    def __init__(self, key: str, rpm: int, tpm: int, max_queue: int):
+        self.key = key
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_queue = max_queue
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.stats = {
+            "admitted": 0,
+            "rejected": 0,
+            "rate_limited": 0,
+            "retries": 0,
+            "max_waiting": 0,
+            "total_wait_ms": 0.0,
+        }
+
+    def _try_admit(self, estimated_tokens: int) -> float:
+        """Admit now (returns 0) or return how long to wait before retrying."""
+        now = time.monotonic()
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        wait = max(
+            self.paused_until - now,
+            self.requests.wait_time(1),
+            self.tokens.wait_time(estimated_tokens),
+        )
+        if wait <= 0:
+            self.requests.take(1)
+            self.tokens.take(estimated_tokens)
+        return wait
+
+    def _enter_queue(self):
+        if self.waiting >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise LLMQueueFullError(
+                f"{self.key}: {self.waiting} calls already waiting for capacity"
+            )
+        self.waiting += 1
+        self.stats["max_waiting"] = max(self.stats["max_waiting"], self.waiting)
+
+    def _admitted(self, started: float):
+        self.stats["admitted"] += 1
+        self.stats["total_wait_ms"] += (time.monotonic() - started) * 1000
+
+    def acquire(self, estimated_tokens: int):
+        started = time.monotonic()
+        with self._lock:
+            wait = self._try_admit(estimated_tokens)
+            if wait <= 0:
+                self._admitted(started)
+                return
+            self._enter_queue()
+        try:
+            while wait > 0:
+                check_deadline(f"admission {self.key}", wait)
+                time.sleep(wait)
+                with self._lock:
+                    wait = self._try_admit(estimated_tokens)
+            with self._lock:
+                self._admitted(started)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    async def aacquire(self, estimated_tokens: int):
+        started = time.monotonic()
+        with self._lock:
+            wait = self._try_admit(estimated_tokens)
+            if wait <= 0:
+                self._admitted(started)
+                return
+            self._enter_queue()
+        try:
+            while wait > 0:
+                check_deadline(f"admission {self.key}", wait)
+                await asyncio.sleep(wait)
+                with self._lock:
+                    wait = self._try_admit(estimated_tokens)
+            with self._lock:
+                self._admitted(started)
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Correct the token bucket once the real usage is known."""
+        if actual_tokens:
+            with self._lock:
+                self.tokens.take(actual_tokens - estimated_tokens)
+
+    def penalize(self, retry_after: Optional[float]):
+        """Stop admitting calls for a while after the provider returned 429."""
+        with self._lock:
+            self.stats["rate_limited"] += 1
+            pause = retry_after if retry_after is not None else 1.0
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+
+    def record_retry(self):
+        with self._lock:
+            self.stats["retries"] += 1
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            admitted = self.stats["admitted"]
+            return {
+                "queue_depth": self.waiting,
+                "max_queue": self.max_queue,
+                "rpm_limit": int(self.requests.capacity),
+                "tpm_limit": int(self.tokens.capacity),
+                **{k: v for k, v in self.stats.items() if k != "total_wait_ms"},
+                "avg_wait_ms": (
+                    round(self.stats["total_wait_ms"] / admitted, 1) if admitted else 0
+                ),
+            }
+
+
+_limiters: Dict[str, ModelLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _configured_limits() -> Dict[str, Dict]:
+    limits = dict(DEFAULT_RATE_LIMITS)
+    if settings.LLM_RATE_LIMITS:
+        limits.update(json.loads(settings.LLM_RATE_LIMITS))
+    return limits
+
+
+def get_limiter(provider: str, model: str) -> ModelLimiter:
+    key = f"{provider}/{model}"
+    limiter = _limiters.get(key)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(key)
+            if limiter is None:
+                configured = _configured_limits()
+                limits = configured.get(key) or configured.get(f"{provider}/*", {})
+                limiter = ModelLimiter(
+                    key,
+                    rpm=limits.get("rpm", settings.LLM_DEFAULT_RPM),
+                    tpm=limits.get("tpm", settings.LLM_DEFAULT_TPM),
+                    max_queue=settings.LLM_MAX_QUEUE,
+                )
+                _limiters[key] = limiter
+    return limiter
+
+
+def limiter_metrics() -> Dict[str, Dict]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.key: limiter.metrics() for limiter in limiters}
+
+
+def estimate_tokens(messages: List[Dict], params: Dict) -> int:
+    """Rough prompt + completion token estimate (~4 characters per token)."""
+    prompt_chars = sum(len(message_text(m.get("content"))) for m in messages)
+    return prompt_chars // 4 + int(params.get("max_tokens") or 256)
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (StubProviderError, httpx.TimeoutException, httpx.TransportError)):
+        return True
+    if type(error).__name__ in ("APIConnectionError", "APITimeoutError"):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS_CODES
+
+
+def is_rate_limited(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Read Retry-After (seconds) or retry-after-ms from an SDK error response."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """Full-jitter exponential backoff that never undercuts Retry-After."""
+    ceiling = min(
+        settings.LLM_BACKOFF_MAX_SECONDS,
+        settings.LLM_BACKOFF_BASE_SECONDS * (2**attempt),
+    )
+    delay = random.uniform(0, ceiling)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def plan_retry(
+    limiter: ModelLimiter, error: Exception, attempt: int
+) -> Tuple[bool, float]:
+    """Decide whether a failed attempt is retried and after how long."""
+    if not is_retryable(error) or attempt + 1 >= settings.LLM_MAX_ATTEMPTS:
+        return False, 0.0
+    retry_after = retry_after_seconds(error)
+    if is_rate_limited(error):
+        limiter.penalize(retry_after)
+    delay = backoff_delay(attempt, retry_after)
+    left = time_left()
+    if left is not None and left < delay + settings.DEADLINE_MIN_STAGE_SECONDS:
+        logger.warning(
+            f"{limiter.key} attempt {attempt + 1} failed ({error}); "
+            f"no time left to retry"
+        )
+        return False, 0.0
+    limiter.record_retry()
+    logger.warning(
+        f"{limiter.key} attempt {attempt + 1} failed ({error}); retrying in {delay:.2f}s"
+    )
+    return True, delay
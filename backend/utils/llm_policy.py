@@ -0,0 +1,217 @@
+import json
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from typing import Dict, List, Optional, Tuple
+from config.settings import settings
+from utils.llm_limiter import is_retryable
+
+logger = logging.getLogger(__name__)
+
+Route = Tuple[str, str]
+
+# Alternates tried, in order, for hedges and failover. Override or extend with
+# the LLM_FALLBACKS JSON setting, e.g. {"openai/gpt-4o-mini": ["groq/llama-3.3-70b-versatile"]}
+DEFAULT_FALLBACKS = {
+    "openai/gpt-4o-mini": ["groq/llama-3.3-70b-versatile"],
+    "openai/gpt-4.1-nano": ["groq/llama-3.1-8b-instant"],
+    "openai/gpt-4o": ["groq/llama-3.3-70b-versatile"],
+    "groq/llama-3.3-70b-versatile": ["openai/gpt-4o-mini"],
+    # Vision prompts need a multimodal alternate
+    "groq/meta-llama/llama-4-scout-17b-16e-instruct": ["openai/gpt-4o-mini"],
+    "gemini/gemini-1.5-flash-latest": ["openai/gpt-4o-mini"],
+}
+
+# Hedge delay (seconds) used until a route has LLM_HEDGE_MIN_SAMPLES latencies,
+# keyed by stage or by route; the stage wins. Override or extend with the
+# LLM_HEDGE_DELAYS JSON setting, anything else uses LLM_HEDGE_DEFAULT_DELAY
+DEFAULT_HEDGE_DELAYS = {
+    "openai/gpt-4o-mini": 4.0,
+    "openai/gpt-4.1-nano": 2.0,
+    "openai/gpt-4o": 6.0,
+    "groq/llama-3.3-70b-versatile": 3.0,
+    "groq/llama-3.1-8b-instant": 1.5,
+    "groq/meta-llama/llama-4-scout-17b-16e-instruct": 4.0,
+    "gemini/gemini-1.5-flash-latest": 3.0,
+    # Image prompts upload and process the image before the first token
+    "analyze_acne_image": 8.0,
+}
+
+
+def _split(route: str) -> Route:
+    provider, model = route.split("/", 1)
+    return provider, model
+
+
+def _configured_fallbacks() -> Dict[str, List[str]]:
+    fallbacks = dict(DEFAULT_FALLBACKS)
+    if settings.LLM_FALLBACKS:
+        fallbacks.update(json.loads(settings.LLM_FALLBACKS))
+    return fallbacks
+
+
+def _configured_hedge_delays() -> Dict[str, float]:
+    delays = dict(DEFAULT_HEDGE_DELAYS)
+    if settings.LLM_HEDGE_DELAYS:
+        delays.update(json.loads(settings.LLM_HEDGE_DELAYS))
+    return delays
+
+
+def default_hedge_delay(
+    provider: str, model: str, stage: Optional[str] = None
+) -> float:
+    """Hedge delay for a route without enough latency history yet."""
+    delays = _configured_hedge_delays()
+    delay = delays.get(stage) if stage else None
+    if delay is None:
+        delay = delays.get(f"{provider}/{model}", settings.LLM_HEDGE_DEFAULT_DELAY)
+    return float(delay)
+
+
+class CircuitBreaker:
+    """Per-provider breaker: opens after consecutive failures, lets a single
+    probe through after the cooldown, and closes again on success."""
+
+    def __init__(self, provider: str, failure_threshold: int, cooldown_seconds: float):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_started: Optional[float] = None
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown_seconds:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            # One probe per cooldown window; a probe that never reports back
+            # (e.g. its route was not needed) frees the slot after the window
+            now = time.monotonic()
+            if state == "half_open" and (
+                self.probe_started is None
+                or now - self.probe_started >= self.cooldown_seconds
+            ):
+                self.probe_started = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.probe_started = None
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    self.times_opened += 1
+                    logger.warning(
+                        f"Circuit opened for {self.provider} after {self.failures} failures"
+                    )
+                self.opened_at = time.monotonic()
+
+
+class RoutePolicy:
+    """Latency history, circuit breakers and hedge/failover counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies: Dict[Route, deque] = defaultdict(lambda: deque(maxlen=200))
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.stats = defaultdict(int)
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(provider)
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    provider,
+                    failure_threshold=settings.LLM_BREAKER_FAILURES,
+                    cooldown_seconds=settings.LLM_BREAKER_COOLDOWN,
+                )
+                self._breakers[provider] = breaker
+            return breaker
+
+    def routes(self, provider: str, model: str) -> List[Route]:
+        """Primary route followed by alternates whose breaker is not open.
+
+        The primary is always kept when nothing else is available. Nothing is
+        claimed here: the breaker's allow() runs when a route is attempted.
+        """
+        candidates = [(provider, model)]
+        # With LOCAL_LLM every route resolves to the same local server
+        if settings.LLM_FAILOVER and not settings.LOCAL_LLM:
+            fallbacks = _configured_fallbacks().get(f"{provider}/{model}", [])
+            candidates += [_split(route) for route in fallbacks]
+        available = [
+            route for route in candidates if self.breaker(route[0]).state != "open"
+        ]
+        return available or candidates[:1]
+
+    def hedge_delay(
+        self, provider: str, model: str, stage: Optional[str] = None
+    ) -> Optional[float]:
+        """Seconds to wait before hedging: the route's p95 latency, clamped.
+
+        Until the route has enough samples (after a restart, on quiet routes)
+        the stage or route default applies. None disables hedging for the call.
+        """
+        if not settings.LLM_HEDGING:
+            return None
+        with self._lock:
+            samples = sorted(self._latencies[(provider, model)])
+        if len(samples) < settings.LLM_HEDGE_MIN_SAMPLES:
+            delay = default_hedge_delay(provider, model, stage)
+        else:
+            delay = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return min(
+            max(delay, settings.LLM_HEDGE_MIN_DELAY), settings.LLM_HEDGE_MAX_DELAY
+        )
+
+    def record_success(self, route: Route, latency_seconds: float):
+        with self._lock:
+            self._latencies[route].append(latency_seconds)
+        self.breaker(route[0]).record_success()
+
+    def record_failure(self, route: Route, error: Exception):
+        # Client errors (bad request, auth) say nothing about provider health
+        if is_retryable(error):
+            self.breaker(route[0]).record_failure()
+
+    def count(self, event: str):
+        with self._lock:
+            self.stats[event] += 1
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            breakers = list(self._breakers.values())
+            stats = dict(self.stats)
+        return {
+            **stats,
+            "breakers": {
+                b.provider: {
+                    "state": b.state,
+                    "consecutive_failures": b.failures,
+                    "times_opened": b.times_opened,
+                }
+                for b in breakers
+            },
+        }
+
+
+route_policy = RoutePolicy()
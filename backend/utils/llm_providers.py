@@ -0,0 +1,416 @@
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Any, AsyncIterator, Dict, List, Optional
+from pydantic import BaseModel
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from config.settings import settings
+from utils.deadline import bounded_timeout, time_left
+
+logger = logging.getLogger(__name__)
+
+# Output dimension of each embedding model, used by the stub embeddings
+EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "models/embedding-001": 768,
+}
+
+class ChatCompletion(BaseModel):
+    text: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+class StubProviderError(Exception):
+    """Failure injected by the stub provider."""
+
+
+def message_text(content: Any) -> str:
+    """Flatten OpenAI-style message content (string or list of parts) to text."""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return " ".join(
+            part.get("text", "") for part in content if isinstance(part, dict)
+        )
+    return str(content or "")
+
+
+class LLMProvider:
+    """Interface every LLM backend implements.
+
+    ``complete`` takes OpenAI-style messages; ``embeddings`` returns LangChain
+    embeddings for the vector stores. The RAG chains use the gateway's chat
+    model, which calls ``complete``.
+    """
+
+    name = "base"
+
+    def complete(
+        self, model: str, messages: List[Dict], stage: Optional[str] = None, **params
+    ) -> ChatCompletion:
+        raise NotImplementedError
+
+    async def acomplete(
+        self, model: str, messages: List[Dict], stage: Optional[str] = None, **params
+    ) -> ChatCompletion:
+        return await asyncio.to_thread(
+            self.complete, model, messages, stage=stage, **params
+        )
+
+    async def astream(
+        self,
+        model: str,
+        messages: List[Dict],
+        stage: Optional[str] = None,
+        usage: Optional[Dict] = None,
+        **params,
+    ) -> AsyncIterator[str]:
+        """Yield the completion text as it is generated.
+
+        Token counts are written into ``usage`` when the stream ends. The
+        default implementation yields the whole completion at once.
+        """
+        completion = await self.acomplete(model, messages, stage=stage, **params)
+        if usage is not None:
+            usage["prompt_tokens"] = completion.prompt_tokens
+            usage["completion_tokens"] = completion.completion_tokens
+        yield completion.text
+
+    def embeddings(self, model: str):
+        raise NotImplementedError(f"{self.name} does not provide embeddings")
+
+
+def _deadline_timeout() -> Dict:
+    """Per-request HTTP timeout cut to what is left of the request deadline."""
+    if time_left() is None:
+        return {}
+    return {"timeout": bounded_timeout(settings.LLM_HTTP_TIMEOUT)}
+
+
+def _to_completion(response, model: str) -> ChatCompletion:
+    usage = getattr(response, "usage", None)
+    return ChatCompletion(
+        text=response.choices[0].message.content or "",
+        model=model,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+    )
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    """Shared chat.completions implementation for OpenAI and Groq clients.
+
+    SDK clients are owned by utils.llm_gateway and reused across calls.
+    """
+
+    @property
+    def client(self):
+        from utils.llm_gateway import get_client
+
+        return get_client(self.name)
+
+    @property
+    def async_client(self):
+        from utils.llm_gateway import get_async_client
+
+        return get_async_client(self.name)
+
+    def complete(self, model, messages, stage=None, **params) -> ChatCompletion:
+        response = self.client.chat.completions.create(
+            model=model, messages=messages, **_deadline_timeout(), **params
+        )
+        return _to_completion(response, model)
+
+    async def acomplete(self, model, messages, stage=None, **params) -> ChatCompletion:
+        response = await self.async_client.chat.completions.create(
+            model=model, messages=messages, **_deadline_timeout(), **params
+        )
+        return _to_completion(response, model)
+
+    async def astream(
+        self, model, messages, stage=None, usage=None, **params
+    ) -> AsyncIterator[str]:
+        params.pop("stream", None)
+        if self.name == "openai":
+            params["stream_options"] = {"include_usage": True}
+        stream = await self.async_client.chat.completions.create(
+            model=model, messages=messages, stream=True, **params
+        )
+        async for chunk in stream:
+            # OpenAI reports usage on the last chunk, Groq under x_groq
+            chunk_usage = getattr(chunk, "usage", None) or getattr(
+                getattr(chunk, "x_groq", None), "usage", None
+            )
+            if chunk_usage is not None and usage is not None:
+                usage["prompt_tokens"] = chunk_usage.prompt_tokens
+                usage["completion_tokens"] = chunk_usage.completion_tokens
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _pooled_http_clients(self) -> Dict:
+        from utils.llm_gateway import get_async_http_client, get_http_client
+
+        return {
+            "http_client": get_http_client(),
+            "http_async_client": get_async_http_client(),
+        }
+
+
+class OpenAIProvider(OpenAICompatibleProvider):
+    name = "openai"
+
+    def embeddings(self, model):
+        from langchain_openai import OpenAIEmbeddings
+
+        return OpenAIEmbeddings(model=model, **self._pooled_http_clients())
+
+
+class GroqProvider(OpenAICompatibleProvider):
+    name = "groq"
+
+
+class LocalProvider(OpenAICompatibleProvider):
+    """Any OpenAI-compatible server (Ollama, vLLM, llama.cpp) at LOCAL_LLM_BASE_URL.
+
+    Hosted model names are mapped to local ones with LOCAL_LLM_MODELS,
+    falling back to LOCAL_LLM_MODEL.
+    """
+
+    name = "local"
+
+    def __init__(self):
+        self.models = json.loads(settings.LOCAL_LLM_MODELS or "{}")
+
+    def local_model(self, model: str) -> str:
+        return self.models.get(model, settings.LOCAL_LLM_MODEL)
+
+    def complete(self, model, messages, stage=None, **params) -> ChatCompletion:
+        return super().complete(self.local_model(model), messages, stage, **params)
+
+    async def acomplete(self, model, messages, stage=None, **params) -> ChatCompletion:
+        return await super().acomplete(
+            self.local_model(model), messages, stage, **params
+        )
+
+    async def astream(self, model, messages, stage=None, usage=None, **params):
+        async for delta in super().astream(
+            self.local_model(model), messages, stage, usage, **params
+        ):
+            yield delta
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def complete(self, model, messages, stage=None, **params) -> ChatCompletion:
+        response = self.chat_model(model, **params).invoke(
+            [(m["role"], message_text(m["content"])) for m in messages]
+        )
+        usage = response.usage_metadata or {}
+        return ChatCompletion(
+            text=response.content,
+            model=model,
+            prompt_tokens=usage.get("input_tokens", 0),
+            completion_tokens=usage.get("output_tokens", 0),
+        )
+
+    def chat_model(self, model, **params):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        return ChatGoogleGenerativeAI(model=model, **params)
+
+    def embeddings(self, model):
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        return GoogleGenerativeAIEmbeddings(model=model)
+
+
+class _TemplateVars(dict):
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+# Canned responses per stage; strings are str.format templates and dicts/lists
+# are rendered recursively and returned as JSON.
+STUB_TEMPLATES = {
+    "router_agent": {"action": "rag_query", "parameters": {"query": "{query}"}},
+    "database_knowledge_agent": {"department_name": None},
+    "structure_report": {
+        "patient_info": {"age": "Unknown", "gender": "Unknown"},
+        "haematology_results": [],
+    },
+    "default": "[stub {model}] This is a placeholder answer to: {excerpt}",
+}
+
+
+class StubProvider(LLMProvider):
+    """Deterministic offline backend for benchmarks and CI-like environments.
+
+    Responses come from STUB_TEMPLATES (overridable with a JSON file keyed by
+    stage), latency is simulated and failures are injected from a seeded RNG.
+    """
+
+    name = "stub"
+
+    def __init__(
+        self,
+        latency_ms: float = 50.0,
+        jitter_ms: float = 0.0,
+        failure_rate: float = 0.0,
+        seed: int = 42,
+        responses_path: Optional[str] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.templates = dict(STUB_TEMPLATES)
+        if responses_path:
+            with open(responses_path) as f:
+                self.templates.update(json.load(f))
+            logger.info(f"Loaded stub responses from {responses_path}")
+
+    def _next_call(self):
+        """Draw (delay seconds, should fail) for one call."""
+        with self._lock:
+            jitter = self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+            fail = self._rng.random() < self.failure_rate
+        return max(self.latency_ms + jitter, 0.0) / 1000, fail
+
+    def _render(self, template, variables):
+        if isinstance(template, str):
+            return template.format_map(variables)
+        if isinstance(template, dict):
+            return {k: self._render(v, variables) for k, v in template.items()}
+        if isinstance(template, list):
+            return [self._render(v, variables) for v in template]
+        return template
+
+    def respond(self, model: str, messages: List[Dict], stage: Optional[str]) -> str:
+        prompt = message_text(messages[-1]["content"]) if messages else ""
+        query_match = re.search(r"\*\*Query:\*\*\s*(.+)", prompt)
+        variables = _TemplateVars(
+            model=model,
+            stage=stage or "default",
+            query=query_match.group(1).strip() if query_match else prompt.strip(),
+            excerpt=" ".join(prompt.split())[:120],
+        )
+        template = self.templates.get(stage or "default", self.templates["default"])
+        rendered = self._render(template, variables)
+        return rendered if isinstance(rendered, str) else json.dumps(rendered)
+
+    def _result(self, model, messages, stage) -> ChatCompletion:
+        text = self.respond(model, messages, stage)
+        prompt_words = sum(len(message_text(m["content"]).split()) for m in messages)
+        return ChatCompletion(
+            text=text,
+            model=model,
+            prompt_tokens=prompt_words,
+            completion_tokens=len(text.split()),
+        )
+
+    def complete(self, model, messages, stage=None, **params) -> ChatCompletion:
+        delay, fail = self._next_call()
+        time.sleep(delay)
+        if fail:
+            raise StubProviderError(f"Injected failure for {stage or model}")
+        return self._result(model, messages, stage)
+
+    async def acomplete(self, model, messages, stage=None, **params) -> ChatCompletion:
+        delay, fail = self._next_call()
+        await asyncio.sleep(delay)
+        if fail:
+            raise StubProviderError(f"Injected failure for {stage or model}")
+        return self._result(model, messages, stage)
+
+    async def astream(
+        self, model, messages, stage=None, usage=None, **params
+    ) -> AsyncIterator[str]:
+        # A quarter of the latency passes before the first token, the rest
+        # is spread over the words
+        delay, fail = self._next_call()
+        await asyncio.sleep(delay / 4)
+        if fail:
+            raise StubProviderError(f"Injected failure for {stage or model}")
+        result = self._result(model, messages, stage)
+        words = result.text.split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(delay * 3 / 4 / len(words))
+            yield word if i == 0 else " " + word
+        if usage is not None:
+            usage["prompt_tokens"] = result.prompt_tokens
+            usage["completion_tokens"] = result.completion_tokens
+
+    def embeddings(self, model):
+        return DeterministicFakeEmbedding(size=EMBEDDING_DIMENSIONS.get(model, 768))
+
+
+def to_message_dicts(messages: List[BaseMessage]) -> List[Dict]:
+    """LangChain messages as OpenAI-style role/content dicts."""
+    roles = {"human": "user", "ai": "assistant", "system": "system"}
+    return [{"role": roles.get(m.type, "user"), "content": m.content} for m in messages]
+
+
+def to_chat_result(completion: ChatCompletion) -> ChatResult:
+    """A completion as a LangChain ChatResult, usage included."""
+    message = AIMessage(
+        content=completion.text,
+        usage_metadata={
+            "input_tokens": completion.prompt_tokens,
+            "output_tokens": completion.completion_tokens,
+            "total_tokens": completion.prompt_tokens + completion.completion_tokens,
+        },
+    )
+    return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+PROVIDER_CLASSES = {
+    "openai": OpenAIProvider,
+    "groq": GroqProvider,
+    "gemini": GeminiProvider,
+    "local": LocalProvider,
+}
+
+_providers: Dict[str, LLMProvider] = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(name: str, chat: bool = True) -> LLMProvider:
+    """Return the shared provider instance for a name.
+
+    With LLM_BACKEND=stub every name resolves to the offline stub. With
+    LOCAL_LLM=true chat providers (not embeddings) resolve to the local
+    OpenAI-compatible server.
+    """
+    if settings.LLM_BACKEND == "stub":
+        name = "stub"
+    elif settings.LOCAL_LLM and chat:
+        name = "local"
+    provider = _providers.get(name)
+    if provider is None:
+        with _providers_lock:
+            provider = _providers.get(name)
+            if provider is None:
+                if name == "stub":
+                    provider = StubProvider(
+                        latency_ms=settings.LLM_STUB_LATENCY_MS,
+                        jitter_ms=settings.LLM_STUB_JITTER_MS,
+                        failure_rate=settings.LLM_STUB_FAILURE_RATE,
+                        seed=settings.LLM_STUB_SEED,
+                        responses_path=settings.LLM_STUB_RESPONSES_PATH,
+                    )
+                elif name in PROVIDER_CLASSES:
+                    provider = PROVIDER_CLASSES[name]()
+                else:
+                    raise ValueError(f"Unknown LLM provider: {name}")
+                _providers[name] = provider
+    return provider
@@ -0,0 +1,333 @@
+import os
+import json
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+INDEX_META_FILE = "index.json"
+VECTORS_FILE = "vectors.bin"
+SCALES_FILE = "scales.npy"
+CENTROIDS_FILE = "centroids.npy"
+OFFSETS_FILE = "offsets.npy"
+DOCS_FILE = "docs.jsonl"
+
+# Rows scored per matrix product when scanning, bounds temporary memory
+SCAN_BLOCK_ROWS = 65536
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _top_k(
+    scores: np.ndarray, rows: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Best ``k`` (scores, rows), highest score first."""
+    if len(scores) > k:
+        best = np.argpartition(-scores, k - 1)[:k]
+        scores, rows = scores[best], rows[best]
+    order = np.argsort(-scores, kind="stable")
+    return scores[order], rows[order]
+
+
+def _spherical_kmeans(
+    data: np.ndarray, nlist: int, iterations: int = 10, seed: int = 0
+) -> np.ndarray:
+    """Unit-length centroids of ``nlist`` clusters, trained on a sample."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(data), nlist * 64)
+    sample = np.asarray(data[rng.choice(len(data), sample_size, replace=False)])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for cluster in range(nlist):
+            members = sample[assignment == cluster]
+            if len(members):
+                centroids[cluster] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    return centroids.astype(np.float32)
+
+
+class LocalVectorIndex:
+    """In-process cosine-similarity index over a memory-mapped matrix.
+
+    A directory holds unit-length vectors as float32 or int8 (one scale per
+    row), the documents, and optionally an IVF layout: k-means centroids with
+    rows stored grouped by nearest centroid, so a probed list is one
+    contiguous slice of the matrix. Search is exact (full scan) or IVF
+    (scan of the ``nprobe`` lists closest to the query).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, INDEX_META_FILE)) as f:
+            self.meta: Dict[str, Any] = json.load(f)
+        self.dimension: int = self.meta["dimension"]
+        self.count: int = self.meta["count"]
+        self.dtype: str = self.meta["dtype"]
+        self.vectors = np.memmap(
+            os.path.join(path, VECTORS_FILE),
+            dtype=np.int8 if self.dtype == "int8" else np.float32,
+            mode="r",
+            shape=(self.count, self.dimension),
+        )
+        self.scales = (
+            np.load(os.path.join(path, SCALES_FILE)) if self.dtype == "int8" else None
+        )
+        self.centroids = None
+        self.offsets = None
+        if self.meta.get("nlist"):
+            self.centroids = np.load(os.path.join(path, CENTROIDS_FILE))
+            self.offsets = np.load(os.path.join(path, OFFSETS_FILE))
+        with open(os.path.join(path, DOCS_FILE)) as f:
+            self.documents = [json.loads(line) for line in f]
+        logger.info(
+            f"Loaded local index {path}: {self.count} x {self.dimension} "
+            f"{self.dtype}, {self.meta.get('nlist') or 0} IVF lists"
+        )
+
+    @classmethod
+    def build(
+        cls,
+        path: str,
+        vectors: Sequence[Sequence[float]],
+        documents: List[Document],
+        ids: Optional[List[str]] = None,
+        dtype: str = "float32",
+        nlist: int = 0,
+        extra_meta: Optional[Dict] = None,
+    ) -> "LocalVectorIndex":
+        """Write an index for ``vectors`` and their ``documents`` to ``path``.
+
+        ``nlist`` > 0 adds an IVF layout with that many lists.
+        """
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"Unsupported index dtype: {dtype}")
+        data = _normalize(np.asarray(vectors, dtype=np.float32))
+        if data.ndim != 2 or len(data) != len(documents):
+            raise ValueError("Expected one vector per document")
+        nlist = min(nlist, len(data))
+        os.makedirs(path, exist_ok=True)
+
+        order = np.arange(len(data))
+        if nlist:
+            centroids = _spherical_kmeans(data, nlist)
+            assignment = np.concatenate(
+                [
+                    np.argmax(block @ centroids.T, axis=1)
+                    for block in np.split(
+                        data, range(SCAN_BLOCK_ROWS, len(data), SCAN_BLOCK_ROWS)
+                    )
+                ]
+            )
+            order = np.argsort(assignment, kind="stable")
+            offsets = np.concatenate(
+                [[0], np.cumsum(np.bincount(assignment, minlength=nlist))]
+            )
+            np.save(os.path.join(path, CENTROIDS_FILE), centroids)
+            np.save(os.path.join(path, OFFSETS_FILE), offsets.astype(np.int64))
+        data = data[order]
+
+        if dtype == "int8":
+            scales = np.abs(data).max(axis=1) / 127.0
+            scales = np.maximum(scales, 1e-12).astype(np.float32)
+            stored = np.round(data / scales[:, None]).astype(np.int8)
+            np.save(os.path.join(path, SCALES_FILE), scales)
+        else:
+            stored = data
+        matrix = np.memmap(
+            os.path.join(path, VECTORS_FILE),
+            dtype=stored.dtype,
+            mode="w+",
+            shape=stored.shape,
+        )
+        matrix[:] = stored
+        matrix.flush()
+        del matrix
+
+        with open(os.path.join(path, DOCS_FILE), "w") as f:
+            for row in order:
+                doc = documents[row]
+                record = {"page_content": doc.page_content, "metadata": doc.metadata}
+                if ids is not None:
+                    record["id"] = ids[row]
+                f.write(json.dumps(record) + "\n")
+        with open(os.path.join(path, INDEX_META_FILE), "w") as f:
+            json.dump(
+                {
+                    "dimension": int(data.shape[1]),
+                    "count": int(len(data)),
+                    "dtype": dtype,
+                    "nlist": int(nlist),
+                    **(extra_meta or {}),
+                },
+                f,
+                indent=2,
+            )
+        logger.info(f"Built local index {path}: {len(data)} vectors, {nlist} lists")
+        return cls(path)
+
+    def _scan(self, start: int, end: int, query: np.ndarray, k: int):
+        """Top ``k`` (scores, rows) among rows [start, end)."""
+        best_scores = np.empty(0, dtype=np.float32)
+        best_rows = np.empty(0, dtype=np.int64)
+        for block in range(start, end, SCAN_BLOCK_ROWS):
+            block_end = min(block + SCAN_BLOCK_ROWS, end)
+            if self.scales is None:
+                scores = self.vectors[block:block_end] @ query
+            else:
+                scores = (
+                    self.vectors[block:block_end].astype(np.float32) @ query
+                ) * self.scales[block:block_end]
+            best_scores, best_rows = _top_k(
+                np.concatenate([best_scores, scores]),
+                np.concatenate([best_rows, np.arange(block, block_end)]),
+                k,
+            )
+        return best_scores, best_rows
+
+    def search(
+        self,
+        query: Sequence[float],
+        k: int = 4,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+    ) -> List[Tuple[int, float]]:
+        """(row, cosine similarity) of the ``k`` nearest rows, best first."""
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        if query.shape != (self.dimension,):
+            raise ValueError(
+                f"Query has dimension {query.shape[-1]}, index has {self.dimension}"
+            )
+        if exact or self.centroids is None:
+            scores, rows = self._scan(0, self.count, query, k)
+        else:
+            nprobe = min(nprobe or settings.LOCAL_INDEX_NPROBE, len(self.centroids))
+            probed = np.argsort(-(self.centroids @ query))[:nprobe]
+            scores = np.empty(0, dtype=np.float32)
+            rows = np.empty(0, dtype=np.int64)
+            for cluster in probed:
+                list_scores, list_rows = self._scan(
+                    int(self.offsets[cluster]), int(self.offsets[cluster + 1]), query, k
+                )
+                scores, rows = _top_k(
+                    np.concatenate([scores, list_scores]),
+                    np.concatenate([rows, list_rows]),
+                    k,
+                )
+        return [(int(row), float(score)) for row, score in zip(rows, scores)]
+
+    def document(self, row: int) -> Document:
+        record = self.documents[row]
+        return Document(
+            id=record.get("id"),
+            page_content=record["page_content"],
+            metadata=record["metadata"],
+        )
+
+
+class LocalVectorStore(VectorStore):
+    """LangChain vector store over a LocalVectorIndex, so ``as_retriever``
+    and the RAG chains work unchanged with the local backend."""
+
+    def __init__(
+        self,
+        index: LocalVectorIndex,
+        embedding: Embeddings,
+        nprobe: Optional[int] = None,
+        exact: Optional[bool] = None,
+    ):
+        self.index = index
+        self.embedding = embedding
+        self.nprobe = nprobe
+        self.exact = settings.LOCAL_INDEX_EXACT if exact is None else exact
+
+    @classmethod
+    def load(cls, path: str, embedding: Embeddings, **kwargs) -> "LocalVectorStore":
+        return cls(LocalVectorIndex(path), embedding, **kwargs)
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        hits = self.index.search(
+            embedding,
+            k=k,
+            nprobe=kwargs.get("nprobe", self.nprobe),
+            exact=kwargs.get("exact", self.exact),
+        )
+        return [(self.index.document(row), score) for row, score in hits]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self.embedding.embed_query(query), k=k, **kwargs
+        )
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc
+            for doc, _ in self.similarity_search_by_vector_with_score(
+                embedding, k=k, **kwargs
+            )
+        ]
+
+    def similarity_search(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return self.similarity_search_by_vector(
+            self.embedding.embed_query(query), k=k, **kwargs
+        )
+
+    def _select_relevance_score_fn(self):
+        # Scores are already cosine similarities
+        return lambda score: score
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[Dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        path: Optional[str] = None,
+        dtype: str = "float32",
+        nlist: int = 0,
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        """Embed ``texts`` and build an index for them at ``path``."""
+        if path is None:
+            raise ValueError("LocalVectorStore.from_texts needs an index path")
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [
+            Document(page_content=text, metadata=metadata)
+            for text, metadata in zip(texts, metadatas)
+        ]
+        index = LocalVectorIndex.build(
+            path,
+            embedding.embed_documents(list(texts)),
+            documents,
+            ids=ids,
+            dtype=dtype,
+            nlist=nlist,
+        )
+        return cls(index, embedding, **kwargs)
+
+
+def local_index_path(name: str) -> str:
+    """Directory of the local index that stands in for a remote index/collection."""
+    return os.path.join(settings.LOCAL_INDEX_DIR, name)
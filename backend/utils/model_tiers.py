@@ -0,0 +1,217 @@
+import re
+import json
+import time
+import logging
+import threading
+from collections import defaultdict, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from config.settings import settings
+from utils.deadline import DeadlineExceeded
+from utils.llm_gateway import achat_completion, chat_completion
+from utils.llm_providers import ChatCompletion
+
+logger = logging.getLogger(__name__)
+
+# Models tried per task, cheapest first. A reply whose confidence is below
+# MODEL_TIER_MIN_CONFIDENCE is retried on the next tier. Override per task
+# with the MODEL_TIERS JSON setting, e.g. {"router_agent": ["openai/gpt-4o-mini"]}
+DEFAULT_TASK_TIERS = {
+    "router_agent": ["openai/gpt-4.1-nano", "openai/gpt-4o-mini"],
+    "database_knowledge_agent": ["openai/gpt-4.1-nano", "openai/gpt-4o-mini"],
+    "structure_report": ["openai/gpt-4o-mini", "openai/gpt-4o"],
+    "medical_query": ["openai/gpt-4o-mini", "openai/gpt-4o"],
+}
+
+# Scores a reply: (parsed value, confidence between 0 and 1)
+Scorer = Callable[[str], Tuple[Any, float]]
+
+
+def parse_json_reply(text: str) -> Optional[Dict]:
+    """Parse a JSON object reply, tolerating markdown code fences."""
+    cleaned = re.sub(r"```json\s*|\s*```", "", text or "").strip()
+    try:
+        value = json.loads(cleaned)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
+
+
+def task_tiers(task: str, default: Tuple[str, str]) -> List[Tuple[str, str]]:
+    """Tiers for a task; just ``default`` when tiering is off or unconfigured."""
+    if not settings.MODEL_TIERING:
+        return [default]
+    tiers = dict(DEFAULT_TASK_TIERS)
+    if settings.MODEL_TIERS:
+        tiers.update(json.loads(settings.MODEL_TIERS))
+    routes = tiers.get(task)
+    if not routes:
+        return [default]
+    return [tuple(route.split("/", 1)) for route in routes]
+
+
+class TierStats:
+    """Per task and tier: calls, acceptance rate, escalations and latency.
+
+    When a reply is escalated and both tiers produced a parseable value,
+    their agreement is recorded as an accuracy signal for the cheaper tier.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(lambda: defaultdict(int))
+        self._latencies = defaultdict(lambda: deque(maxlen=500))
+
+    def record(self, task: str, route: str, latency_ms: float, outcome: str):
+        with self._lock:
+            counts = self._counts[(task, route)]
+            counts["calls"] += 1
+            counts[outcome] += 1
+            self._latencies[(task, route)].append(latency_ms)
+
+    def record_agreement(self, task: str, route: str, agreed: bool):
+        with self._lock:
+            counts = self._counts[(task, route)]
+            counts["compared"] += 1
+            counts["agreed"] += int(agreed)
+
+    def metrics(self) -> Dict[str, Dict]:
+        with self._lock:
+            keys = list(self._counts)
+            counts = {k: dict(self._counts[k]) for k in keys}
+            latencies = {k: sorted(self._latencies[k]) for k in keys}
+
+        result = defaultdict(dict)
+        for (task, route), c in counts.items():
+            lat = latencies[(task, route)]
+            calls = c.get("calls", 0)
+            result[task][route] = {
+                "calls": calls,
+                "accepted": c.get("accepted", 0),
+                "escalated": c.get("escalated", 0),
+                "rejected": c.get("rejected", 0),
+                "errors": c.get("error", 0),
+                "acceptance_rate": (
+                    round(c.get("accepted", 0) / calls, 3) if calls else 0
+                ),
+                "agreement_rate": (
+                    round(c["agreed"] / c["compared"], 3) if c.get("compared") else None
+                ),
+                "p50_latency_ms": round(lat[len(lat) // 2], 1) if lat else 0,
+                "p95_latency_ms": (
+                    round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 1) if lat else 0
+                ),
+            }
+        return dict(result)
+
+
+tier_stats = TierStats()
+
+
+class _TierRun:
+    """Bookkeeping shared by the sync and async escalation loops."""
+
+    def __init__(self, task: str, tiers: List[Tuple[str, str]], score: Scorer):
+        self.task = task
+        self.tiers = tiers
+        self.score = score
+        self.best: Optional[Tuple[ChatCompletion, Any, float]] = None
+        self.previous: Optional[Tuple[str, Any]] = None
+        self.error: Optional[Exception] = None
+
+    def failed(self, route: str, started: float, error: Exception):
+        tier_stats.record(self.task, route, _elapsed_ms(started), "error")
+        logger.warning(f"{self.task} tier {route} failed: {error}")
+        self.error = error
+
+    def finished(
+        self, route: str, started: float, completion: ChatCompletion, last: bool
+    ) -> bool:
+        """Score a reply; returns True when it is good enough to stop."""
+        value, confidence = self.score(completion.text)
+        accepted = confidence >= settings.MODEL_TIER_MIN_CONFIDENCE
+        outcome = "accepted" if accepted else ("rejected" if last else "escalated")
+        tier_stats.record(self.task, route, _elapsed_ms(started), outcome)
+
+        if self.previous is not None and None not in (self.previous[1], value):
+            previous_route, previous_value = self.previous
+            agreed = value == previous_value
+            tier_stats.record_agreement(self.task, previous_route, agreed)
+        self.previous = (route, value)
+
+        if self.best is None or confidence > self.best[2]:
+            self.best = (completion, value, confidence)
+        if not accepted and not last:
+            logger.info(f"{self.task}: {route} confidence {confidence:.2f}, escalating")
+        return accepted
+
+    def result(self) -> Tuple[ChatCompletion, Any, float]:
+        if self.best is None:
+            raise self.error
+        return self.best
+
+
+def _elapsed_ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+
+def tiered_completion(
+    task: str,
+    default: Tuple[str, str],
+    messages: List[Dict],
+    score: Scorer,
+    **params,
+) -> Tuple[ChatCompletion, Any, float]:
+    """Run a task on its cheapest tier, escalating low-confidence replies.
+
+    Returns (completion, parsed value, confidence) of the accepted reply, or
+    of the most confident one when no tier clears the threshold.
+    """
+    tiers = task_tiers(task, default)
+    run = _TierRun(task, tiers, score)
+    for index, (provider, model) in enumerate(tiers):
+        route = f"{provider}/{model}"
+        started = time.perf_counter()
+        try:
+            completion = chat_completion(
+                provider, model, messages, stage=task, **params
+            )
+        except DeadlineExceeded:
+            # No time left to escalate: settle for the best reply so far
+            if run.best is None:
+                raise
+            break
+        except Exception as e:
+            run.failed(route, started, e)
+            continue
+        if run.finished(route, started, completion, last=index == len(tiers) - 1):
+            break
+    return run.result()
+
+
+async def atiered_completion(
+    task: str,
+    default: Tuple[str, str],
+    messages: List[Dict],
+    score: Scorer,
+    **params,
+) -> Tuple[ChatCompletion, Any, float]:
+    tiers = task_tiers(task, default)
+    run = _TierRun(task, tiers, score)
+    for index, (provider, model) in enumerate(tiers):
+        route = f"{provider}/{model}"
+        started = time.perf_counter()
+        try:
+            completion = await achat_completion(
+                provider, model, messages, stage=task, **params
+            )
+        except DeadlineExceeded:
+            # No time left to escalate: settle for the best reply so far
+            if run.best is None:
+                raise
+            break
+        except Exception as e:
+            run.failed(route, started, e)
+            continue
+        if run.finished(route, started, completion, last=index == len(tiers) - 1):
+            break
+    return run.result()
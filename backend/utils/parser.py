@@ -3,13 +3,13 @@ import json
 import re
 import logging
 from llama_cloud_services import LlamaParse
-from openai import OpenAI
 from dotenv import load_dotenv
 from fastapi import HTTPException
 from datetime import datetime, timedelta
 from collections import defaultdict
 from config.settings import settings
-from groq import Groq
+from utils.llm_gateway import achat_completion
+from utils.model_tiers import atiered_completion, parse_json_reply
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -17,11 +17,10 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-# Initialize LlamaParse and OpenAI
+# Initialize LlamaParse
 LLAMA_PARSER_API_KEY = os.getenv("LLAMA_PARSER_API_KEY")
 
 parser = LlamaParse(api_key=LLAMA_PARSER_API_KEY, result_type="markdown")
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
 
 # In-memory conversation history: {user_id: [{"query": str, "report_json": str, "response": str, "timestamp": datetime}, ...]}
 conversation_history = defaultdict(list)
@@ -81,9 +80,8 @@ async def parse_blood_report(file_path: str):
         raise HTTPException(status_code=500, detail=f"Failed to parse PDF: {str(e)}")
 
 
-async def structure_report(report_text: str):
-    """Structure report into JSON using Groq."""
-    logger.info("Structuring report")
+def build_structure_messages(report_text: str):
+    """Chat messages asking the model to turn a parsed report into JSON."""
     age_match = re.search(r"Age:\s*([\d\sYMWD]+)", report_text)
     gender_match = re.search(r"Gender:\s*(Male|Female)", report_text)
     patient_age = age_match.group(1).strip() if age_match else "Unknown"
@@ -117,19 +115,48 @@ Exclude empty entries and non-test data. Ensure the JSON is well-structured. Her
 """,
         },
     ]
+    return generation_chat_history
+
+
+def score_structured_report(text: str):
+    """Confidence of a structured report: share of complete test entries."""
+    report = parse_json_reply(text)
+    if report is None:
+        return None, 0.0
+    results = report.get("haematology_results")
+    if not isinstance(results, list) or not results:
+        return report, 0.2
+    complete = sum(
+        1
+        for r in results
+        if isinstance(r, dict)
+        and r.get("test")
+        and r.get("patient_value") not in (None, "")
+        and str(r.get("remark", "")).lower() in ("normal", "low", "high")
+    )
+    return report, complete / len(results)
+
+
+async def structure_report(report_text: str):
+    """Structure report into JSON using Groq."""
+    logger.info("Structuring report")
+    generation_chat_history = build_structure_messages(report_text)
 
     logger.info("Sending structure request to OpenAI")
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",  # Using GPT-4 for accurate medical data parsing
-            messages=generation_chat_history,
+        completion, json_output, confidence = await atiered_completion(
+            "structure_report",
+            ("openai", "gpt-4o-mini"),  # Using GPT-4 for accurate medical data parsing
+            generation_chat_history,
+            score_structured_report,
             temperature=0.1,  # Low temperature for consistent structured output
             response_format={"type": "json_object"},  # Ensure JSON output
         )
 
         # Extract JSON from response
-        response_text = response.choices[0].message.content
-        json_output = json.loads(response_text)
+        response_text = completion.text
+        if json_output is None:
+            json_output = json.loads(response_text)
 
         return json_output, response_text
 
@@ -184,16 +211,15 @@ Blood Test Results (JSON):
         f"Interpretation prompt: {json.dumps(interpretation_chat_history, indent=2)}"
     )
 
-    response = (
-        client.chat.completions.create(
-            messages=interpretation_chat_history,
-            model="llama3-70b-8192",
-            temperature=0.5,
-            max_tokens=300,
-        )
-        .choices[0]
-        .message.content
+    completion = await achat_completion(
+        "groq",
+        "llama-3.3-70b-versatile",
+        interpretation_chat_history,
+        stage="interpret_report",
+        temperature=0.5,
+        max_tokens=300,
     )
+    response = completion.text
     logger.info(f"Initial interpretation response: {response[:100]}...")
 
     # Store in chat history
@@ -266,16 +292,15 @@ Blood Test Results (JSON, use only if needed):
     )
     logger.debug(f"Follow-up prompt: {json.dumps(followup_chat_history, indent=2)}")
 
-    response = (
-        client.chat.completions.create(
-            messages=followup_chat_history,
-            model="llama3-70b-8192",
-            temperature=0.5,
-            max_tokens=200,
-        )
-        .choices[0]
-        .message.content
+    completion = await achat_completion(
+        "groq",
+        "llama-3.3-70b-versatile",
+        followup_chat_history,
+        stage="answer_followup_query",
+        temperature=0.5,
+        max_tokens=200,
     )
+    response = completion.text
     logger.info(f"Follow-up response: {response[:100]}...")
 
     # Store in chat history
@@ -289,7 +314,6 @@ async def analyze_acne_image(image_url: str, user_id: str):
     """Analyze an acne-related image using Groq's vision model."""
     try:
         logger.info(f"Analyzing acne image for user {user_id}")
-        client = Groq(api_key=settings.GROQ_API_KEY)
         acne_chat_history = [
             {
                 "role": "system",
@@ -317,17 +341,16 @@ You are a friendly dermatology AI assistant who analyzes images of skin to provi
             },
         ]
 
-        response = (
-            client.chat.completions.create(
-                model="meta-llama/llama-4-scout-17b-16e-instruct",
-                messages=acne_chat_history,
-                temperature=0.7,
-                max_tokens=200,
-                stream=False,
-            )
-            .choices[0]
-            .message.content
+        completion = await achat_completion(
+            "groq",
+            "meta-llama/llama-4-scout-17b-16e-instruct",
+            acne_chat_history,
+            stage="analyze_acne_image",
+            temperature=0.7,
+            max_tokens=200,
+            stream=False,
         )
+        response = completion.text
 
         logger.info(f"Acne analysis response: {response[:100]}...")
 
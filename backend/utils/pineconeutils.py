@@ -2,20 +2,34 @@ import pandas as pd
 import os
 import time
 import gc
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from langchain_core.documents import Document
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.chains import create_retrieval_chain
 from pinecone import Pinecone, ServerlessSpec
 from langchain_pinecone import PineconeVectorStore
+from langchain_core.vectorstores import InMemoryVectorStore
 import logging
 from config.settings import settings
-from typing import List
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 import uuid
 import psycopg2
 from datetime import datetime
+from utils.llm_gateway import embed_documents, get_chat_model, get_embeddings
+from utils.ingestion import (
+    IngestCheckpoint,
+    IngestManifest,
+    content_hash,
+    read_csv_chunks,
+)
+from utils.deadline import bounded_timeout, db_deadline_options, db_write_options
+from utils.local_index import LocalVectorStore, local_index_path
+from utils.bm25_index import HybridRetriever, load_bm25_index
+from utils.context_selection import ContextSelectingRetriever
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,10 +39,18 @@ logger = logging.getLogger(__name__)
 PINECONE_INDEX_NAME = "curewise-medical-rag"
 EMBED_MODEL = "text-embedding-3-small"  # OpenAI embedding model
 EMBEDDING_DIMENSION = 1536  # matches text-embedding-3-small
+# OpenAI per-request embedding limits (inputs, total tokens)
+EMBED_MAX_INPUTS = 2048
+EMBED_MAX_TOKENS = 300000
+
+# Same chunking as the original load in notebooks/RAG.ipynb
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=4000, chunk_overlap=200)
 
 # Set API keys (ensure these are set in your settings/env)
-os.environ["OPENAI_API_KEY"] = settings.OPENAI_API_KEY
-os.environ["PINECONE_API_KEY"] = settings.PINECONE_API_KEY
+if settings.OPENAI_API_KEY:
+    os.environ["OPENAI_API_KEY"] = settings.OPENAI_API_KEY
+if settings.PINECONE_API_KEY:
+    os.environ["PINECONE_API_KEY"] = settings.PINECONE_API_KEY
 
 
 # Function to get vector count
@@ -43,61 +65,121 @@ def get_vector_count(index):
         return 0
 
 
-# Initialize RAG components globally
+# RAG components, built in the background after startup or on first use
 embeddings_model = None
 vector_store = None
+retriever = None
+document_chain = None
 retrieval_chain = None
 
+_rag_lock = threading.Lock()
+_rag_ready = threading.Event()
+_rag_thread: Optional[threading.Thread] = None
+_rag_failed_at: Optional[float] = None
+rag_status = {
+    "state": "not_started",  # not_started | initializing | ready | failed
+    "attempts": 0,
+    "error": None,
+    "init_ms": None,
+}
+
+
+class RAGUnavailableError(Exception):
+    """Raised when the RAG components are not initialized (yet)."""
+
+
+class RAGComponents(NamedTuple):
+    retriever: Any
+    document_chain: Any
+    retrieval_chain: Any
+
+
+def get_pinecone_index():
+    """The Pinecone index, created (and waited for) if it does not exist."""
+    pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
+
+    index_names = pc.list_indexes().names()
+    if PINECONE_INDEX_NAME not in index_names:
+        logger.info(f"Creating Pinecone index '{PINECONE_INDEX_NAME}'...")
+        pc.create_index(
+            name=PINECONE_INDEX_NAME,
+            dimension=EMBEDDING_DIMENSION,
+            metric="cosine",
+            spec=ServerlessSpec(cloud="aws", region="us-east-1"),
+        )
+        logger.info("⏳ Waiting for index to be ready...")
+        while not pc.describe_index(PINECONE_INDEX_NAME).status["ready"]:
+            time.sleep(5)
+        logger.info("✅ Index created.")
+    else:
+        logger.info(f"Using existing index '{PINECONE_INDEX_NAME}'.")
+
+    return pc.Index(PINECONE_INDEX_NAME)
+
+
+def connect_pinecone_vector_store(embeddings_model):
+    """Connect to (and create if missing) the Pinecone index."""
+    index = get_pinecone_index()
+    logger.info("Checking index status...")
+
+    # Get vector count
+    vector_count = get_vector_count(index)
+    logger.info(f"Connected to index. Current vector count: {vector_count}")
+
+    # ✅ LangChain VectorStore Wrapper
+    return PineconeVectorStore(
+        index_name=PINECONE_INDEX_NAME, embedding=embeddings_model
+    )
+
 
 def initialize_rag_system():
-    global embeddings_model, vector_store, retrieval_chain
+    """Connect to the vector store and build the retrieval chains.
+
+    Blocks on Pinecone network calls; the API runs it through
+    start_rag_initialization instead of at import time.
+    """
+    global embeddings_model, vector_store, retriever, document_chain, retrieval_chain
     try:
         logger.info("Initializing RAG system...")
 
         # ✅ Initialize Embedding Model
-        embeddings_model = OpenAIEmbeddings(model=EMBED_MODEL)
+        embeddings = get_embeddings("openai", EMBED_MODEL)
         logger.info("Embedding model initialized.")
 
-        # ✅ Initialize Pinecone
-        pc = Pinecone(api_key=os.environ["PINECONE_API_KEY"])
-
-        index_names = pc.list_indexes().names()
-        if PINECONE_INDEX_NAME not in index_names:
-            logger.info(f"Creating Pinecone index '{PINECONE_INDEX_NAME}'...")
-            pc.create_index(
-                name=PINECONE_INDEX_NAME,
-                dimension=EMBEDDING_DIMENSION,
-                metric="cosine",
-                spec=ServerlessSpec(cloud="aws", region="us-east-1"),
+        if settings.VECTOR_BACKEND == "local":
+            # In-process memory-mapped index built by scripts/build_local_index.py
+            store = LocalVectorStore.load(
+                local_index_path(PINECONE_INDEX_NAME), embeddings
             )
-            logger.info("⏳ Waiting for index to be ready...")
-            while not pc.describe_index(PINECONE_INDEX_NAME).status["ready"]:
-                time.sleep(5)
-            logger.info("✅ Index created.")
+        elif settings.LLM_BACKEND == "stub":
+            # Offline mode: empty in-process store instead of Pinecone
+            store = InMemoryVectorStore(embedding=embeddings)
+            logger.info("Using in-memory vector store (LLM_BACKEND=stub).")
         else:
-            logger.info(f"Using existing index '{PINECONE_INDEX_NAME}'.")
-
-        # Initialize index
-        index = pc.Index(PINECONE_INDEX_NAME)
-        logger.info("Checking index status...")
-
-        # Get vector count
-        # Get vector count
-        vector_count = get_vector_count(index)
-        logger.info(f"Connected to index. Current vector count: {vector_count}")
-
-        # ✅ LangChain VectorStore Wrapper
-        vector_store = PineconeVectorStore(
-            index_name=PINECONE_INDEX_NAME, embedding=embeddings_model
-        )
+            store = connect_pinecone_vector_store(embeddings)
 
         # ✅ Initialize LLM (OpenAI Chat Model)
-        llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.3)
+        llm = get_chat_model(
+            "openai", "gpt-4o-mini", stage="rag_query", temperature=0.3
+        )
         logger.info("LLM initialized.")
 
-        retriever = vector_store.as_retriever(
-            search_type="similarity", search_kwargs={"k": 10}
-        )
+        bm25 = load_bm25_index(PINECONE_INDEX_NAME)
+        if bm25 is not None:
+            # Keyword matches make up for the smaller dense k
+            store_retriever = HybridRetriever(
+                vector_store=store,
+                bm25=bm25,
+                k=settings.HYBRID_TOP_K,
+                fetch_k=settings.HYBRID_FETCH_K,
+                rrf_k=settings.HYBRID_RRF_K,
+            )
+        else:
+            store_retriever = store.as_retriever(
+                search_type="similarity", search_kwargs={"k": 10}
+            )
+        if settings.CONTEXT_SELECTION:
+            store_retriever = ContextSelectingRetriever(retriever=store_retriever)
         prompt_template = ChatPromptTemplate.from_template(
             """
             You are an AI medical assistant. 
@@ -114,34 +196,314 @@ def initialize_rag_system():
             **Answer (based only on context):**
             """
         )
-        document_chain = create_stuff_documents_chain(llm, prompt_template)
-        retrieval_chain = create_retrieval_chain(retriever, document_chain)
+        stuff_chain = create_stuff_documents_chain(llm, prompt_template)
+        chain = create_retrieval_chain(store_retriever, stuff_chain)
         logger.info("RAG chain created.")
 
     except Exception as e:
         logger.error(f"Failed to initialize RAG system: {e}")
         raise Exception(f"RAG initialization failed: {e}")
 
+    # Publish the components together so readers never see a partial set
+    embeddings_model, vector_store = embeddings, store
+    retriever, document_chain, retrieval_chain = store_retriever, stuff_chain, chain
+
+
+def _initialize_in_background():
+    global _rag_failed_at
+    started = time.perf_counter()
+    try:
+        initialize_rag_system()
+    except Exception as e:
+        with _rag_lock:
+            _rag_failed_at = time.monotonic()
+            rag_status.update(state="failed", error=str(e))
+        return
+    with _rag_lock:
+        rag_status.update(
+            state="ready",
+            error=None,
+            init_ms=round((time.perf_counter() - started) * 1000, 1),
+        )
+        _rag_ready.set()
+    logger.info(f"RAG system ready in {rag_status['init_ms']} ms")
+
+
+def start_rag_initialization():
+    """Build the RAG components in a background thread unless already done.
+
+    A failed attempt is retried by the next call after RAG_INIT_RETRY_SECONDS.
+    """
+    global _rag_thread
+    with _rag_lock:
+        if _rag_ready.is_set():
+            return
+        if _rag_thread is not None and _rag_thread.is_alive():
+            return
+        if (
+            _rag_failed_at is not None
+            and time.monotonic() - _rag_failed_at < settings.RAG_INIT_RETRY_SECONDS
+        ):
+            return
+        rag_status["state"] = "initializing"
+        rag_status["attempts"] += 1
+        _rag_thread = threading.Thread(
+            target=_initialize_in_background, name="rag-init", daemon=True
+        )
+        _rag_thread.start()
+
+
+def get_rag_components(wait: Optional[float] = None) -> RAGComponents:
+    """The RAG components, starting initialization on first use.
+
+    Waits up to ``wait`` seconds (RAG_INIT_WAIT_SECONDS by default, cut to the
+    request deadline) for a pending initialization, then raises
+    RAGUnavailableError so callers can answer in degraded mode.
+    """
+    if not _rag_ready.is_set():
+        start_rag_initialization()
+        if wait is None:
+            wait = settings.RAG_INIT_WAIT_SECONDS
+        if not _rag_ready.wait(bounded_timeout(wait)):
+            raise RAGUnavailableError(f"RAG system is {rag_status['state']}")
+    return RAGComponents(retriever, document_chain, retrieval_chain)
+
+
+async def aget_rag_components() -> RAGComponents:
+    """get_rag_components for async callers: a pending initialization is
+    waited for in a worker thread instead of blocking the event loop."""
+    if _rag_ready.is_set():
+        return get_rag_components()
+    return await asyncio.to_thread(get_rag_components)
+
+
+def rag_readiness() -> Dict:
+    with _rag_lock:
+        return dict(rag_status)
 
-# ✅ Initialize RAG system on startup
-initialize_rag_system()
+
+# --- Corpus Ingestion ---
+def _row_records(
+    rows: pd.DataFrame, skip: Optional[Dict[str, int]] = None
+) -> Tuple[List[Dict], Dict[str, int]]:
+    """Vector records for a slice of Q&A rows, one per text chunk.
+
+    Chunks hold "Q: ...\nA: ..." split as in notebooks/RAG.ipynb. IDs are
+    content hashes of the row plus the chunk index, so re-ingesting a row
+    overwrites its vectors; the row hash is kept as answer_group_id, as in
+    zillisutils, so context selection can merge sibling chunks. Rows whose
+    hash is in ``skip`` are left out. Also returns the chunk count per
+    included row.
+    """
+    records, groups = [], {}
+    for qtype, question, answer in zip(rows["qtype"], rows["Question"], rows["Answer"]):
+        row_id = content_hash(str(qtype), str(question), str(answer))
+        if row_id in groups or (skip is not None and row_id in skip):
+            continue
+        chunks = text_splitter.split_text(f"Q: {question}\nA: {answer}")
+        groups[row_id] = len(chunks)
+        for chunk_idx, chunk in enumerate(chunks):
+            records.append(
+                {
+                    "id": content_hash(row_id, str(chunk_idx)),
+                    # PineconeVectorStore reads the page content from "text"
+                    "metadata": {
+                        "qtype": str(qtype),
+                        "text": chunk,
+                        "chunk_index": chunk_idx,
+                        "answer_group_id": row_id,
+                    },
+                }
+            )
+    return records, groups
+
+
+def _embedding_batches(records: List[Dict]) -> List[List[Dict]]:
+    """Split records into embedding requests within the per-request limits."""
+    max_inputs = min(settings.PINECONE_EMBED_BATCH_SIZE, EMBED_MAX_INPUTS)
+    batches, batch, batch_tokens = [], [], 0
+    for record in records:
+        # ~4 characters per token, as the gateway limiter estimates
+        tokens = len(record["metadata"]["text"]) // 4 + 1
+        if batch and (
+            len(batch) >= max_inputs or batch_tokens + tokens > EMBED_MAX_TOKENS
+        ):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(record)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _embed_batch(records: List[Dict]) -> List[Dict]:
+    vectors = embed_documents(
+        "openai", EMBED_MODEL, [record["metadata"]["text"] for record in records]
+    )
+    return [
+        {"id": record["id"], "values": vector, "metadata": record["metadata"]}
+        for record, vector in zip(records, vectors)
+    ]
+
+
+def _delete_rows(index, manifest: IngestManifest, row_ids: List[str]) -> int:
+    """Delete every chunk of ``row_ids`` and drop them from the manifest."""
+    deleted = 0
+    # Pinecone deletes at most 1000 ids per request
+    for start in range(0, len(row_ids), 100):
+        rows = row_ids[start : start + 100]
+        ids = [
+            content_hash(row_id, str(chunk_idx))
+            for row_id in rows
+            for chunk_idx in range(manifest.entries[row_id])
+        ]
+        for id_start in range(0, len(ids), 1000):
+            index.delete(ids=ids[id_start : id_start + 1000])
+        manifest.remove(rows)
+        deleted += len(ids)
+    return deleted
+
+
+def ingest_csv(
+    csv_path: str,
+    read_rows: Optional[int] = None,
+    batch_rows: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    upsert_batch_size: Optional[int] = None,
+    upsert_concurrency: Optional[int] = None,
+    restart: bool = False,
+    sync: bool = False,
+) -> Dict:
+    """Split, embed and upsert a Q&A CSV (qtype, Question, Answer) into the index.
+
+    The file is streamed ``read_rows`` at a time. Embedding requests (sized to
+    the provider's per-request limits) run ``concurrency`` at a time through
+    the gateway limiter, and upserts of ``upsert_batch_size`` vectors run
+    ``upsert_concurrency`` at a time. Progress is checkpointed per batch of
+    ``batch_rows`` rows and rows already in the manifest are skipped, so an
+    interrupted run resumes. ``sync`` reads the whole file and also deletes
+    rows that are no longer in it; ``restart`` re-embeds everything.
+    """
+    batch_rows = batch_rows or settings.INGEST_BATCH_ROWS
+    upsert_batch_size = upsert_batch_size or settings.PINECONE_UPSERT_BATCH_SIZE
+    index = get_pinecone_index()
+    checkpoint = IngestCheckpoint(PINECONE_INDEX_NAME, csv_path)
+    manifest = IngestManifest(PINECONE_INDEX_NAME)
+    if restart:
+        manifest.clear()
+    else:
+        manifest.load()
+        if not sync:
+            checkpoint.load()
+    resumed_from = checkpoint.rows_done
+    seen = set()
+
+    started = time.perf_counter()
+    rows_done = unchanged = vectors_written = 0
+    embed_seconds = upsert_seconds = 0.0
+    embed_pool = ThreadPoolExecutor(
+        max_workers=concurrency or settings.INGEST_CONCURRENCY,
+        thread_name_prefix="pinecone-embed",
+    )
+    upsert_pool = ThreadPoolExecutor(
+        max_workers=upsert_concurrency or settings.PINECONE_UPSERT_CONCURRENCY,
+        thread_name_prefix="pinecone-upsert",
+    )
+    try:
+        for frame in read_csv_chunks(csv_path, read_rows, skip_rows=resumed_from):
+            slices = [
+                frame.iloc[i : i + batch_rows] for i in range(0, len(frame), batch_rows)
+            ]
+            batches = [_row_records(rows, manifest.entries) for rows in slices]
+            seen.update(
+                content_hash(str(qtype), str(question), str(answer))
+                for qtype, question, answer in zip(
+                    frame["qtype"], frame["Question"], frame["Answer"]
+                )
+            )
+            # Queue every embedding request of the frame, consume in order
+            embed_started = time.perf_counter()
+            futures = [
+                [embed_pool.submit(_embed_batch, b) for b in _embedding_batches(r)]
+                for r, _ in batches
+            ]
+            for rows, (records, groups), embeds in zip(slices, batches, futures):
+                vectors = [v for future in embeds for v in future.result()]
+                embed_seconds += time.perf_counter() - embed_started
+                upsert_started = time.perf_counter()
+                for upserted in [
+                    upsert_pool.submit(
+                        index.upsert, vectors=vectors[i : i + upsert_batch_size]
+                    )
+                    for i in range(0, len(vectors), upsert_batch_size)
+                ]:
+                    upserted.result()
+                upsert_seconds += time.perf_counter() - upsert_started
+                embed_started = time.perf_counter()
+
+                rows_done += len(rows)
+                unchanged += len(rows) - len(groups)
+                vectors_written += len(vectors)
+                if groups:
+                    manifest.add(groups)
+                checkpoint.advance(len(rows), len(vectors))
+            elapsed = time.perf_counter() - started
+            logger.info(
+                f"Ingested {rows_done} rows ({unchanged} unchanged), "
+                f"{vectors_written} vectors, {vectors_written / elapsed:.1f} vectors/s"
+            )
+    finally:
+        # Stop embedding batches that will not be upserted after a failure
+        embed_pool.shutdown(wait=True, cancel_futures=True)
+        upsert_pool.shutdown(wait=True, cancel_futures=True)
+        manifest.save()
+
+    deleted_rows = deleted_vectors = 0
+    if sync:
+        removed = [row_id for row_id in manifest.entries if row_id not in seen]
+        deleted_rows = len(removed)
+        deleted_vectors = _delete_rows(index, manifest, removed)
+        manifest.save()
+    # A completed run starts over next time; skipping is up to the manifest
+    checkpoint.clear()
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "rows": rows_done,
+        "unchanged_rows": unchanged,
+        "vectors": vectors_written,
+        "deleted_rows": deleted_rows,
+        "deleted_vectors": deleted_vectors,
+        "resumed_from": resumed_from,
+        "seconds": round(elapsed, 2),
+        "vectors_per_second": round(vectors_written / elapsed, 1) if elapsed else 0.0,
+        # Wall time spent waiting on each stage from the ingesting thread
+        "embed_wait_seconds": round(embed_seconds, 2),
+        "upsert_seconds": round(upsert_seconds, 2),
+    }
+    logger.info(f"Pinecone ingestion of {csv_path} finished: {stats}")
+    return stats
 
 
 # --- DB Connection ---
-def get_db_connection():
+def get_db_connection(write: bool = False):
+    # Inside a request, reads are bounded by its deadline; writes saving its
+    # result get a fixed timeout instead
     return psycopg2.connect(
         dbname=settings.DB_NAME,
         user=settings.DB_USER,
         password=settings.DB_PASSWORD,
         host=settings.DB_HOST,
         port=settings.DB_PORT,
+        **(db_write_options() if write else db_deadline_options()),
     )
 
 
 # --- Chat History Storage ---
 def store_general_chat_history(user_id: str, query: str, response: str):
     """Store general query chat history in PostgreSQL."""
-    conn = get_db_connection()
+    conn = get_db_connection(write=True)
     c = conn.cursor()
     chat_id = str(uuid.uuid4())
     created_at = datetime.utcnow().isoformat()
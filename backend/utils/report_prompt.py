@@ -0,0 +1,202 @@
+import re
+import json
+import logging
+from typing import Dict, List, Optional, Tuple
+from pydantic import BaseModel
+from config.settings import settings
+from utils.prompts import BLOOD_REPORT_PROMPT, BLOOD_REPORT_SYSTEM_PROMPT
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - tiktoken ships with langchain-openai
+    tiktoken = None
+
+# Query words that refer to a test, mapped to words found in report test names
+TEST_ALIASES = {
+    "hemoglobin": ["hemoglobin", "haemoglobin", "hb", "hgb"],
+    "anemia": ["hemoglobin", "haemoglobin", "hb", "rbc", "mcv", "mch", "hematocrit"],
+    "anaemia": ["hemoglobin", "haemoglobin", "hb", "rbc", "mcv", "mch", "hematocrit"],
+    "iron": ["hemoglobin", "haemoglobin", "mcv", "mch", "mchc", "rdw", "ferritin"],
+    "red": ["rbc", "red", "erythrocyte"],
+    "white": ["wbc", "white", "leukocyte", "tlc"],
+    "infection": ["wbc", "tlc", "neutrophil", "lymphocyte", "esr", "crp"],
+    "immune": ["wbc", "tlc", "lymphocyte", "neutrophil"],
+    "platelet": ["platelet", "plt", "thrombocyte"],
+    "platelets": ["platelet", "plt", "thrombocyte"],
+    "clotting": ["platelet", "plt", "mpv"],
+    "bleeding": ["platelet", "plt"],
+    "hematocrit": ["hematocrit", "haematocrit", "hct", "pcv"],
+    "sugar": ["glucose"],
+    "diabetes": ["glucose", "hba1c"],
+    "cholesterol": ["cholesterol", "ldl", "hdl", "triglyceride"],
+}
+
+STOPWORDS = {
+    "what", "does", "my", "is", "are", "the", "a", "an", "of", "in", "and",
+    "or", "mean", "means", "why", "how", "me", "i", "to", "it", "this",
+    "that", "level", "levels", "count", "test", "tests", "result", "results",
+    "value", "values", "blood", "explain", "about", "should", "be", "with",
+}
+
+
+class PromptStats(BaseModel):
+    input_tokens: int
+    full_report_tokens: int
+    saved_tokens: int
+    token_budget: int
+    tests_total: int
+    tests_included: int
+    over_budget: bool = False
+    llm_latency_ms: Optional[float] = None
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    """Token count with tiktoken, or a ~4 characters per token estimate."""
+    if tiktoken is None:
+        return max(1, len(text) // 4)
+    try:
+        encoding = tiktoken.encoding_for_model(model)
+    except KeyError:
+        encoding = tiktoken.get_encoding("cl100k_base")
+    return len(encoding.encode(text))
+
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def query_terms(query: str) -> set:
+    """Words from the query (and their aliases) used to match test names."""
+    terms = set()
+    for word in _words(query):
+        if word in STOPWORDS:
+            continue
+        terms.add(word)
+        terms.update(TEST_ALIASES.get(word, []))
+    return terms
+
+
+def is_abnormal(result: Dict) -> bool:
+    remark = str(result.get("remark") or "").strip().lower()
+    return bool(remark) and remark != "normal"
+
+
+def is_relevant(result: Dict, terms: set) -> bool:
+    name_words = _words(str(result.get("test", "")))
+    return any(
+        word in terms or any(len(t) > 2 and word.startswith(t) for t in terms)
+        for word in name_words
+    )
+
+
+def format_result(result: Dict) -> str:
+    """One compact line per test: name: value unit (ref range) REMARK."""
+    line = f"{result.get('test', '?')}: {result.get('patient_value', '?')}"
+    if result.get("unit"):
+        line += f" {result['unit']}"
+    if result.get("reference_value"):
+        line += f" (ref {result['reference_value']})"
+    if result.get("remark"):
+        line += f" {str(result['remark']).upper()}"
+    return line
+
+
+def select_results(report: Dict, query: str) -> Tuple[List[Dict], List[Dict]]:
+    """Split the report into (tests to send, normal tests left out).
+
+    Abnormal tests come first, then normal tests the query refers to.
+    """
+    results = report.get("haematology_results") or []
+    terms = query_terms(query)
+    abnormal = [r for r in results if is_abnormal(r)]
+    relevant = [r for r in results if not is_abnormal(r) and is_relevant(r, terms)]
+    omitted = [r for r in results if not is_abnormal(r) and r not in relevant]
+    return abnormal + relevant, omitted
+
+
+def _user_prompt(
+    query: str, report: Optional[Dict], included: List[Dict], omitted: List[Dict]
+) -> str:
+    lines = [BLOOD_REPORT_PROMPT, f"Current Query: {query}"]
+    if report is None:
+        lines.append("No blood test results available.")
+        return "\n".join(lines)
+
+    patient = report.get("patient_info") or {}
+    age = patient.get("age", "Unknown")
+    gender = patient.get("gender", "Unknown")
+    lines.append(f"Patient: age {age}, gender {gender}")
+    lines.append("Blood Test Results:")
+    lines.extend(format_result(r) for r in included)
+    if omitted:
+        names = ", ".join(str(r.get("test", "?")) for r in omitted)
+        lines.append(f"Other tests, all within normal range: {names}")
+    return "\n".join(lines)
+
+
+def build_medical_query_messages(
+    query: str, report: Optional[Dict], model: str = "gpt-4o-mini"
+) -> Tuple[List[Dict], PromptStats]:
+    """Assemble the blood-report Q&A prompt within MEDICAL_QUERY_TOKEN_BUDGET.
+
+    Only abnormal tests and tests the query mentions are listed in full.
+    When over budget, relevant normal tests go first, then the list of
+    omitted test names, then trailing abnormal tests.
+    """
+    budget = settings.MEDICAL_QUERY_TOKEN_BUDGET
+    system_tokens = count_tokens(BLOOD_REPORT_SYSTEM_PROMPT, model)
+    included, omitted = select_results(report or {}, query)
+    abnormal_count = sum(1 for r in included if is_abnormal(r))
+
+    def measure() -> Tuple[str, int]:
+        text = _user_prompt(query, report, included, omitted)
+        return text, system_tokens + count_tokens(text, model)
+
+    user_prompt, tokens = measure()
+    while tokens > budget and len(included) > abnormal_count:
+        omitted.insert(0, included.pop())
+        user_prompt, tokens = measure()
+    if tokens > budget and omitted:
+        omitted = []
+        user_prompt, tokens = measure()
+    dropped_abnormal = 0
+    while tokens > budget and len(included) > 1:
+        included.pop()
+        dropped_abnormal += 1
+        user_prompt, tokens = measure()
+    if dropped_abnormal:
+        user_prompt += f"\n(+{dropped_abnormal} more abnormal results not shown)"
+        tokens = system_tokens + count_tokens(user_prompt, model)
+
+    full_report_tokens = tokens
+    if report is not None:
+        full_report_tokens = (
+            system_tokens
+            + count_tokens(
+                f"{BLOOD_REPORT_PROMPT}\nCurrent Query: {query}\n"
+                f"{json.dumps(report, indent=2)}",
+                model,
+            )
+        )
+    stats = PromptStats(
+        input_tokens=tokens,
+        full_report_tokens=full_report_tokens,
+        saved_tokens=max(0, full_report_tokens - tokens),
+        token_budget=budget,
+        tests_total=len((report or {}).get("haematology_results") or []),
+        tests_included=len(included),
+        over_budget=tokens > budget,
+    )
+    messages = [
+        {"role": "system", "content": BLOOD_REPORT_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+    return messages, stats
+
+
+def score_answer(text: str):
+    """Confidence of a blood-report answer; empty or clipped replies escalate."""
+    words = len((text or "").split())
+    return text, min(1.0, words / 40)
@@ -0,0 +1,186 @@
+import re
+import time
+import logging
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Dict, Optional, Tuple
+import numpy as np
+from config.settings import settings
+from utils.llm_gateway import get_embeddings
+
+logger = logging.getLogger(__name__)
+
+SEMANTIC_EMBED_MODEL = "text-embedding-3-small"
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace so trivially
+    different phrasings of the same question share a cache key."""
+    text = re.sub(r"[^\w\s]", " ", message.lower())
+    return " ".join(text.split())
+
+
+class CacheEntry:
+    __slots__ = ("response", "created", "embedding")
+
+    def __init__(self, response: str, embedding: Optional[np.ndarray] = None):
+        self.response = response
+        self.created = time.monotonic()
+        self.embedding = embedding
+
+
+class ResponseCache:
+    """LRU + TTL cache of chat answers keyed on (prompt id, normalized message).
+
+    With semantic matching enabled, a miss falls back to the closest cached
+    message for the same prompt id whose cosine similarity clears the
+    threshold.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 2000,
+        ttl_seconds: float = 86400,
+        semantic: bool = False,
+        similarity_threshold: float = 0.92,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic = semantic
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[Tuple[str, str], CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._embeddings = None
+        self._stats = defaultdict(
+            lambda: {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+        )
+        self._evictions = 0
+        self._expirations = 0
+
+    def _embedder(self):
+        if self._embeddings is None:
+            self._embeddings = get_embeddings("openai", SEMANTIC_EMBED_MODEL)
+        return self._embeddings
+
+    def _expired(self, entry: CacheEntry) -> bool:
+        return time.monotonic() - entry.created > self.ttl_seconds
+
+    def _lookup_exact(self, key: Tuple[str, str]) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if self._expired(entry):
+                del self._entries[key]
+                self._expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry.response
+
+    def _lookup_semantic(self, prompt_id: str, embedding: np.ndarray) -> Optional[str]:
+        with self._lock:
+            candidates = [
+                (key, entry)
+                for key, entry in self._entries.items()
+                if key[0] == prompt_id
+                and entry.embedding is not None
+                and not self._expired(entry)
+            ]
+            if not candidates:
+                return None
+            matrix = np.stack([entry.embedding for _, entry in candidates])
+            scores = matrix @ embedding
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            key, entry = candidates[best]
+            self._entries.move_to_end(key)
+            return entry.response
+
+    async def _embed(self, message: str) -> Optional[np.ndarray]:
+        try:
+            vector = np.asarray(
+                await self._embedder().aembed_query(message), dtype=np.float32
+            )
+        except Exception as e:
+            logger.warning(f"Response cache embedding failed, exact match only: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    async def get(
+        self, prompt_id: str, message: str
+    ) -> Tuple[Optional[str], Optional[np.ndarray]]:
+        """Return (cached response or None, message embedding for a later ``put``)."""
+        key = (prompt_id, normalize_message(message))
+        response = self._lookup_exact(key)
+        if response is not None:
+            self._count(prompt_id, "exact_hits")
+            return response, None
+
+        embedding = None
+        if self.semantic:
+            embedding = await self._embed(key[1])
+            if embedding is not None:
+                response = self._lookup_semantic(prompt_id, embedding)
+                if response is not None:
+                    self._count(prompt_id, "semantic_hits")
+                    return response, embedding
+
+        self._count(prompt_id, "misses")
+        return None, embedding
+
+    def put(
+        self,
+        prompt_id: str,
+        message: str,
+        response: str,
+        embedding: Optional[np.ndarray] = None,
+    ):
+        key = (prompt_id, normalize_message(message))
+        with self._lock:
+            self._entries[key] = CacheEntry(response, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def _count(self, prompt_id: str, outcome: str):
+        with self._lock:
+            self._stats[prompt_id][outcome] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def metrics(self) -> Dict:
+        def with_rate(counts: Dict[str, int]) -> Dict:
+            hits = counts["exact_hits"] + counts["semantic_hits"]
+            total = hits + counts["misses"]
+            return {**counts, "hit_rate": round(hits / total, 3) if total else 0.0}
+
+        with self._lock:
+            per_prompt = {k: dict(v) for k, v in self._stats.items()}
+            size = len(self._entries)
+        totals = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+        for counts in per_prompt.values():
+            for k in totals:
+                totals[k] += counts[k]
+        return {
+            "entries": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "semantic": self.semantic,
+            "evictions": self._evictions,
+            "expirations": self._expirations,
+            "total": with_rate(totals),
+            "by_prompt": {k: with_rate(v) for k, v in per_prompt.items()},
+        }
+
+
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS,
+    semantic=settings.RESPONSE_CACHE_SEMANTIC,
+    similarity_threshold=settings.RESPONSE_CACHE_SIMILARITY,
+)
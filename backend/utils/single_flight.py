@@ -0,0 +1,135 @@
+import json
+import asyncio
+import hashlib
+import logging
+import threading
+import contextvars
+from collections import defaultdict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Dict
+from utils.deadline import (
+    DeadlineExceeded,
+    await_in_budget,
+    current_deadline,
+    deadline_stats,
+    time_left,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(*parts: Any) -> str:
+    """Stable hash of a request (provider, model, messages, params, ...)."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """Coalesce concurrent identical calls into one upstream call.
+
+    The first caller for a key starts the function; callers arriving while
+    it is in flight wait for and share its result (or exception). Nothing is
+    cached once the call completes.
+
+    The shared call runs without any request deadline, so one caller's short
+    budget cannot fail the others; each caller stops waiting at its own
+    deadline instead.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._sync_calls: Dict[str, Future] = {}
+        self._async_calls: Dict[str, asyncio.Task] = {}
+        self.stats = defaultdict(int)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            future = self._sync_calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._sync_calls[key] = future
+                self.stats["upstream_calls"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        if leader:
+            # Own thread, so the leader can stop waiting like everyone else
+            context = contextvars.copy_context()
+            context.run(current_deadline.set, None)
+            threading.Thread(
+                target=context.run,
+                args=(self._run, key, fn, future),
+                name=f"{self.name}-flight",
+                daemon=True,
+            ).start()
+
+        left = time_left()
+        try:
+            return future.result(timeout=None if left is None else max(left, 0.0))
+        except FutureTimeoutError:
+            deadline_stats.count(f"exceeded:{self.name}")
+            raise DeadlineExceeded(self.name) from None
+
+    def _run(self, key: str, fn: Callable[[], Any], future: Future):
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._sync_calls.pop(key, None)
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        with self._lock:
+            task = self._async_calls.get(key)
+            if task is None:
+                # The shared call runs as its own task so a cancelled caller
+                # does not cancel it for everyone else
+                task = asyncio.ensure_future(self._detached(fn))
+                self._async_calls[key] = task
+                task.add_done_callback(lambda _: self._forget(key, task))
+                self.stats["upstream_calls"] += 1
+            else:
+                self.stats["coalesced"] += 1
+        return await await_in_budget(self.name, asyncio.shield(task))
+
+    @staticmethod
+    async def _detached(fn: Callable[[], Awaitable[Any]]) -> Any:
+        # A task runs in a copy of its creator's context: drop the deadline there
+        current_deadline.set(None)
+        return await fn()
+
+    def _forget(self, key: str, task: asyncio.Task):
+        with self._lock:
+            if self._async_calls.get(key) is task:
+                del self._async_calls[key]
+        if not task.cancelled() and task.exception() is not None:
+            # Retrieved here so an exception nobody awaited is not logged as lost
+            logger.debug(f"{self.name} shared call failed: {task.exception()}")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            upstream = self.stats["upstream_calls"]
+            coalesced = self.stats["coalesced"]
+            in_flight = len(self._sync_calls) + len(self._async_calls)
+        total = upstream + coalesced
+        return {
+            "upstream_calls": upstream,
+            "coalesced": coalesced,
+            "in_flight": in_flight,
+            "coalesced_ratio": round(coalesced / total, 3) if total else 0.0,
+        }
+
+
+llm_flights = SingleFlight("llm")
+embedding_flights = SingleFlight("embeddings")
+rag_flights = SingleFlight("rag")
+
+
+def single_flight_metrics() -> Dict[str, Dict]:
+    return {
+        group.name: group.metrics()
+        for group in (llm_flights, embedding_flights, rag_flights)
+    }
@@ -1,8 +1,13 @@
 import os
+import json
+import time
+import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 import numpy as np
 import pandas as pd
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from pymilvus import (
@@ -18,9 +23,23 @@ import uuid
 import psycopg2
 from datetime import datetime
 from config.settings import settings
+from utils.llm_gateway import embed_documents, get_chat_model, get_embeddings
+from utils.ingestion import (
+    IngestCheckpoint,
+    IngestManifest,
+    content_hash,
+    dedupe_texts,
+    read_csv_chunks,
+)
+from utils.local_index import LocalVectorStore, local_index_path
+from utils.bm25_index import load_bm25_index, reciprocal_rank_fusion
+from utils.context_selection import select_context
+from utils.deadline import db_deadline_options, db_write_options
 
 # --- Configuration ---
 EMBEDDING_DIMENSION = 768
+EMBED_PROVIDER = "gemini"
+EMBED_MODEL = "models/embedding-001"
 COLLECTION_NAME = "medical_conversations_rag"
 ZILLIZ_URI = settings.ZILLIZ_URI
 ZILLIZ_TOKEN = settings.ZILLIZ_TOKEN
@@ -29,52 +48,102 @@ ZILLIZ_TOKEN = settings.ZILLIZ_TOKEN
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("zillis_rag")
 
+
 # --- Connect to Zilliz/Milvus ---
-connections.connect(uri=ZILLIZ_URI, token=ZILLIZ_TOKEN)
-logger.info(f"Connected to Zilliz/Milvus at {ZILLIZ_URI}")
-
-# --- Use existing collection or create if not exists ---
-if COLLECTION_NAME in utility.list_collections():
-    collection = Collection(COLLECTION_NAME)
-    logger.info(f"Using existing collection '{COLLECTION_NAME}'.")
-else:
-    fields = [
-        FieldSchema(
-            name="id",
-            dtype=DataType.VARCHAR,
-            max_length=64,
-            is_primary=True,
-            auto_id=False,
-        ),
-        FieldSchema(
-            name="qtype", dtype=DataType.VARCHAR, max_length=32, is_primary=False
-        ),
-        FieldSchema(
-            name="Question", dtype=DataType.VARCHAR, max_length=1024, is_primary=False
-        ),
-        FieldSchema(
-            name="Answer", dtype=DataType.VARCHAR, max_length=65000, is_primary=False
-        ),
-        FieldSchema(
-            name="embedding",
-            dtype=DataType.FLOAT_VECTOR,
-            dim=EMBEDDING_DIMENSION,
-            is_primary=False,
-        ),
-        FieldSchema(name="chunk_index", dtype=DataType.INT64, is_primary=False),
-        FieldSchema(
-            name="answer_group_id",
-            dtype=DataType.VARCHAR,
-            max_length=64,
-            is_primary=False,
-        ),
-    ]
-    schema = CollectionSchema(fields, description="RAG QnA collection with chunking")
-    collection = Collection(COLLECTION_NAME, schema)
-    logger.info(f"Collection '{COLLECTION_NAME}' created.")
+def connect_zilliz_collection() -> Collection:
+    """Connect to Zilliz/Milvus, creating, indexing and loading the collection."""
+    connections.connect(uri=ZILLIZ_URI, token=ZILLIZ_TOKEN)
+    logger.info(f"Connected to Zilliz/Milvus at {ZILLIZ_URI}")
+
+    # --- Use existing collection or create if not exists ---
+    if COLLECTION_NAME in utility.list_collections():
+        collection = Collection(COLLECTION_NAME)
+        logger.info(f"Using existing collection '{COLLECTION_NAME}'.")
+    else:
+        fields = [
+            FieldSchema(
+                name="id",
+                dtype=DataType.VARCHAR,
+                max_length=64,
+                is_primary=True,
+                auto_id=False,
+            ),
+            FieldSchema(
+                name="qtype", dtype=DataType.VARCHAR, max_length=32, is_primary=False
+            ),
+            FieldSchema(
+                name="Question",
+                dtype=DataType.VARCHAR,
+                max_length=1024,
+                is_primary=False,
+            ),
+            FieldSchema(
+                name="Answer",
+                dtype=DataType.VARCHAR,
+                max_length=65000,
+                is_primary=False,
+            ),
+            FieldSchema(
+                name="embedding",
+                dtype=DataType.FLOAT_VECTOR,
+                dim=EMBEDDING_DIMENSION,
+                is_primary=False,
+            ),
+            FieldSchema(name="chunk_index", dtype=DataType.INT64, is_primary=False),
+            FieldSchema(
+                name="answer_group_id",
+                dtype=DataType.VARCHAR,
+                max_length=64,
+                is_primary=False,
+            ),
+        ]
+        schema = CollectionSchema(
+            fields, description="RAG QnA collection with chunking"
+        )
+        collection = Collection(COLLECTION_NAME, schema)
+        logger.info(f"Collection '{COLLECTION_NAME}' created.")
+
+    if not collection.has_index():
+        index_params = {
+            "metric_type": "L2",
+            "index_type": "IVF_FLAT",
+            "params": {"nlist": 1024},
+        }
+        collection.create_index(field_name="embedding", index_params=index_params)
+        logger.info("Index created on embedding field.")
+
+    collection.load()
+    logger.info("Collection loaded for search.")
+    return collection
+
 
 # --- Embedding Model ---
-embedding_model = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+embedding_model = get_embeddings(EMBED_PROVIDER, EMBED_MODEL)
+
+# With VECTOR_BACKEND=local, search runs on an in-process index instead
+local_store = None
+if settings.VECTOR_BACKEND == "local":
+    local_store = LocalVectorStore.load(
+        local_index_path(COLLECTION_NAME), embedding_model
+    )
+
+_collection: Optional[Collection] = None
+_collection_lock = threading.Lock()
+
+
+def get_collection() -> Collection:
+    """The Zilliz collection, connected on first use rather than on import."""
+    global _collection
+    if settings.VECTOR_BACKEND == "local":
+        raise RuntimeError("The Zilliz collection needs VECTOR_BACKEND=remote")
+    with _collection_lock:
+        if _collection is None:
+            _collection = connect_zilliz_collection()
+        return _collection
+
+
+# BM25 index over the same Q&A rows for hybrid retrieval (None when disabled)
+bm25_index = load_bm25_index(COLLECTION_NAME)
 
 
 # --- Chunking utility ---
@@ -82,62 +151,260 @@ def chunk_text(text, chunk_size):
     return [text[i : i + chunk_size] for i in range(0, len(text), chunk_size)]
 
 
-# --- Data Insertion Function ---
-def insert_dataframe(df, chunk_size=65000, batch_size=500):
-    ids = []
-    qtypes = []
-    questions = []
-    answers = []
-    embeds = []
-    chunk_indexes = []
-    group_ids = []
-    for idx, row in df.iterrows():
-        answer = str(row["Answer"])
-        answer_chunks = chunk_text(answer, chunk_size)
-        group_id = str(uuid.uuid4())
-        for chunk_idx, chunk in enumerate(answer_chunks):
-            ids.append(str(uuid.uuid4()))
-            qtypes.append(str(row["qtype"]))
-            questions.append(str(row["Question"]))
-            answers.append(chunk)
-            chunk_indexes.append(chunk_idx)
-            group_ids.append(group_id)
-    # Generate embeddings for all questions (repeat for each chunk)
-    question_embeddings = embedding_model.embed_documents(questions)
-    embeds = np.array(question_embeddings, dtype=np.float32)
-    # Insert in batches
-    for start in range(0, len(ids), batch_size):
-        end = start + batch_size
-        batch = [
-            ids[start:end],
-            qtypes[start:end],
-            questions[start:end],
-            answers[start:end],
-            embeds[start:end].tolist(),
-            chunk_indexes[start:end],
-            group_ids[start:end],
+# --- Data Insertion ---
+def chunk_id(group_id: str, chunk_idx: int) -> str:
+    return content_hash(group_id, str(chunk_idx))
+
+
+def _row_records(
+    rows: pd.DataFrame, chunk_size: int, skip: Optional[Set[str]] = None
+) -> Tuple[List[Dict], Dict[str, int]]:
+    """Upsert records for a slice of Q&A rows, one per answer chunk.
+
+    IDs are content hashes: a row keeps its answer_group_id (hash of qtype,
+    question and answer) and chunk ids across runs, so re-ingesting it
+    overwrites instead of duplicating. Rows whose hash is in ``skip`` are
+    left out. Also returns the chunk count per included group.
+    """
+    records, groups = [], {}
+    for qtype, question, answer in zip(rows["qtype"], rows["Question"], rows["Answer"]):
+        group_id = content_hash(str(qtype), str(question), str(answer))
+        if group_id in groups or (skip is not None and group_id in skip):
+            continue
+        chunks = chunk_text(str(answer), chunk_size)
+        groups[group_id] = len(chunks)
+        for chunk_idx, chunk in enumerate(chunks):
+            records.append(
+                {
+                    "id": chunk_id(group_id, chunk_idx),
+                    "qtype": str(qtype),
+                    "Question": str(question),
+                    "Answer": chunk,
+                    "chunk_index": chunk_idx,
+                    "answer_group_id": group_id,
+                }
+            )
+    return records, groups
+
+
+def _embed_records(records: List[Dict]) -> Tuple[List[List[float]], int, int]:
+    """Question vectors for ``records``, each unique question embedded once.
+
+    Every chunk of an answer is found by its question, so chunks of one
+    answer group (and repeated questions) share a single embedding. Returns
+    the vectors, the embeddings computed and the estimated tokens saved.
+    """
+    if not records:
+        return [], 0, 0
+    questions = [record["Question"] for record in records]
+    unique, mapping = dedupe_texts(questions)
+    vectors = embed_documents(
+        EMBED_PROVIDER, EMBED_MODEL, unique, embeddings=embedding_model
+    )
+    saved_tokens = (sum(map(len, questions)) - sum(map(len, unique))) // 4
+    return [vectors[i] for i in mapping], len(unique), saved_tokens
+
+
+def _upsert_records(records: List[Dict], vectors: List[List[float]]):
+    if not records:
+        return
+    get_collection().upsert(
+        [
+            [record["id"] for record in records],
+            [record["qtype"] for record in records],
+            [record["Question"] for record in records],
+            [record["Answer"] for record in records],
+            np.asarray(vectors, dtype=np.float32).tolist(),
+            [record["chunk_index"] for record in records],
+            [record["answer_group_id"] for record in records],
         ]
-        collection.insert(batch)
-    collection.flush()
-    logger.info(f"Inserted {len(ids)} rows (with chunking) into '{COLLECTION_NAME}'.")
+    )
+
+
+def _delete_groups(
+    manifest: IngestManifest, group_ids: List[str], batch_size: int = 1000
+) -> int:
+    """Delete every chunk of ``group_ids`` and drop them from the manifest."""
+    deleted = 0
+    for start in range(0, len(group_ids), batch_size):
+        groups = group_ids[start : start + batch_size]
+        ids = [
+            chunk_id(group_id, chunk_idx)
+            for group_id in groups
+            for chunk_idx in range(manifest.entries[group_id])
+        ]
+        get_collection().delete(f"id in {json.dumps(ids)}")
+        manifest.remove(groups)
+        deleted += len(ids)
+    return deleted
 
 
-# --- Index Creation (if not exists) ---
-if not collection.has_index():
-    index_params = {
-        "metric_type": "L2",
-        "index_type": "IVF_FLAT",
-        "params": {"nlist": 1024},
+def _ingest_frames(
+    frames: Iterable[pd.DataFrame],
+    chunk_size: int,
+    batch_rows: int,
+    concurrency: int,
+    checkpoint: Optional[IngestCheckpoint] = None,
+    manifest: Optional[IngestManifest] = None,
+    seen: Optional[Set[str]] = None,
+) -> Dict:
+    """Embed and upsert source frames batch by batch.
+
+    Batches of one frame are embedded in parallel and upserted in order; the
+    checkpoint and manifest advance after each upsert, so a crash loses at
+    most the batches in flight. Rows already in the manifest are skipped.
+    Memory is bounded by one frame and its vectors. Content hashes of all
+    rows read are added to ``seen``.
+    """
+    # Connect (or fail on VECTOR_BACKEND=local) before embedding anything
+    get_collection()
+    started = time.perf_counter()
+    rows_done = unchanged = vectors_written = embedded = saved_tokens = 0
+    executor = ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="zilliz-ingest"
+    )
+    skip = manifest.entries if manifest is not None else None
+    try:
+        for frame in frames:
+            slices = [
+                frame.iloc[i : i + batch_rows] for i in range(0, len(frame), batch_rows)
+            ]
+            if seen is not None:
+                seen.update(
+                    content_hash(str(qtype), str(question), str(answer))
+                    for qtype, question, answer in zip(
+                        frame["qtype"], frame["Question"], frame["Answer"]
+                    )
+                )
+            batches = [_row_records(rows, chunk_size, skip) for rows in slices]
+            futures = [
+                executor.submit(_embed_records, records) for records, _ in batches
+            ]
+            for rows, (records, groups), future in zip(slices, batches, futures):
+                vectors, batch_embedded, batch_saved = future.result()
+                _upsert_records(records, vectors)
+                rows_done += len(rows)
+                unchanged += len(rows) - len(groups)
+                vectors_written += len(records)
+                embedded += batch_embedded
+                saved_tokens += batch_saved
+                if manifest is not None and groups:
+                    manifest.add(groups)
+                if checkpoint is not None:
+                    checkpoint.advance(len(rows), len(records))
+            logger.info(
+                f"Ingested {rows_done} rows ({unchanged} unchanged), "
+                f"{vectors_written} vectors from {embedded} embeddings"
+            )
+    finally:
+        # Stop embedding batches that will not be upserted after a failure
+        executor.shutdown(wait=True, cancel_futures=True)
+        if manifest is not None:
+            manifest.save()
+    get_collection().flush()
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Upserted {vectors_written} rows (with chunking) into '{COLLECTION_NAME}' "
+        f"in {elapsed:.1f}s"
+    )
+    return {
+        "rows": rows_done,
+        "unchanged_rows": unchanged,
+        "vectors": vectors_written,
+        "seconds": round(elapsed, 2),
+        "rows_per_second": round(rows_done / elapsed, 1) if elapsed else 0.0,
+        "embeddings": embedded,
+        "embeddings_saved": vectors_written - embedded,
+        "embedding_tokens_saved": saved_tokens,
     }
-    collection.create_index(field_name="embedding", index_params=index_params)
-    logger.info("Index created on embedding field.")
 
-# --- Load Collection for Search ---
-collection.load()
-logger.info("Collection loaded for search.")
+
+def insert_dataframe(df, chunk_size=65000, batch_size=None, concurrency=None):
+    """Embed and upsert an in-memory DataFrame (no checkpoint)."""
+    return _ingest_frames(
+        [df],
+        chunk_size,
+        batch_size or settings.INGEST_BATCH_ROWS,
+        concurrency or settings.INGEST_CONCURRENCY,
+        manifest=IngestManifest(COLLECTION_NAME).load(),
+    )
+
+
+def ingest_csv(
+    csv_path: str,
+    chunk_size: int = 65000,
+    read_rows: Optional[int] = None,
+    batch_rows: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    restart: bool = False,
+) -> Dict:
+    """Stream a Q&A CSV (qtype, Question, Answer) into the collection.
+
+    The file is read ``read_rows`` at a time and progress is checkpointed per
+    batch; running it again after a crash continues after the last upserted
+    batch. Rows already in the manifest are not embedded again. ``restart``
+    ignores the checkpoint and the manifest and re-embeds every row.
+    """
+    checkpoint = IngestCheckpoint(COLLECTION_NAME, csv_path)
+    manifest = IngestManifest(COLLECTION_NAME)
+    if restart:
+        manifest.clear()
+    else:
+        checkpoint.load()
+        manifest.load()
+    resumed_from = checkpoint.rows_done
+    stats = _ingest_frames(
+        read_csv_chunks(csv_path, read_rows, skip_rows=resumed_from),
+        chunk_size,
+        batch_rows or settings.INGEST_BATCH_ROWS,
+        concurrency or settings.INGEST_CONCURRENCY,
+        checkpoint,
+        manifest,
+    )
+    # A completed run starts over next time; skipping is up to the manifest
+    checkpoint.clear()
+    return {**stats, "resumed_from": resumed_from}
+
+
+def reindex_csv(
+    csv_path: str,
+    chunk_size: int = 65000,
+    read_rows: Optional[int] = None,
+    batch_rows: Optional[int] = None,
+    concurrency: Optional[int] = None,
+) -> Dict:
+    """Bring the collection in line with a refreshed Q&A CSV.
+
+    Compares content hashes with the manifest: new or changed rows are
+    embedded and upserted, rows no longer in the source are deleted (only
+    after the whole file was read). Unchanged rows cost nothing.
+    """
+    manifest = IngestManifest(COLLECTION_NAME).load()
+    seen: Set[str] = set()
+    stats = _ingest_frames(
+        read_csv_chunks(csv_path, read_rows),
+        chunk_size,
+        batch_rows or settings.INGEST_BATCH_ROWS,
+        concurrency or settings.INGEST_CONCURRENCY,
+        manifest=manifest,
+        seen=seen,
+    )
+    removed = [group_id for group_id in manifest.entries if group_id not in seen]
+    deleted = _delete_groups(manifest, removed) if removed else 0
+    if removed:
+        get_collection().flush()
+        manifest.save()
+    logger.info(
+        f"Re-index of {csv_path}: {stats['rows'] - stats['unchanged_rows']} rows "
+        f"upserted, {stats['unchanged_rows']} unchanged, {len(removed)} deleted"
+    )
+    return {**stats, "deleted_rows": len(removed), "deleted_vectors": deleted}
+
 
 # --- RAG Chain Setup ---
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash-latest", temperature=0.3)
+llm = get_chat_model(
+    "gemini", "gemini-1.5-flash-latest", stage="rag_qa", temperature=0.3
+)
 prompt_template = ChatPromptTemplate.from_template(
     """
     **Note:** You are an AI assistant using only the provided context from a dataset of patient-doctor conversations. You are not a doctor. Do not provide medical advice beyond the context. If the context lacks information, say so. Use the conversation history to understand references (e.g., pronouns like 'it') if relevant.
@@ -160,9 +427,8 @@ document_chain = create_stuff_documents_chain(llm, prompt_template)
 
 
 # --- Retrieval Function ---
-def retrieve_context(query, top_k=3):
-    query_emb = embedding_model.embed_query(query)
-    results = collection.search(
+def _search_collection(query_emb, top_k):
+    results = get_collection().search(
         data=[query_emb],
         anns_field="embedding",
         param={"metric_type": "L2", "params": {"nprobe": 10}},
@@ -186,9 +452,51 @@ def retrieve_context(query, top_k=3):
     return docs
 
 
+def vector_search(query, top_k=3):
+    if local_store is not None:
+        return local_store.similarity_search(query, k=top_k)
+    return _search_collection(embedding_model.embed_query(query), top_k)
+
+
+async def avector_search(query, top_k=3):
+    if local_store is not None:
+        return await local_store.asimilarity_search(query, k=top_k)
+    query_emb = await embedding_model.aembed_query(query)
+    # The ORM Collection has no async search; keep it off the event loop
+    return await asyncio.to_thread(_search_collection, query_emb, top_k)
+
+
+def _fuse(query, dense, fetch_k, top_k):
+    # Hybrid: fuse dense and keyword candidates, keep the best top_k
+    return reciprocal_rank_fusion(
+        [dense, bm25_index.search_documents(query, fetch_k)],
+        k=settings.HYBRID_RRF_K,
+    )[:top_k]
+
+
+def retrieve_context(query, top_k=3):
+    if bm25_index is None:
+        return vector_search(query, top_k)
+    fetch_k = max(top_k, settings.HYBRID_FETCH_K)
+    return _fuse(query, vector_search(query, fetch_k), fetch_k, top_k)
+
+
+async def aretrieve_context(query, top_k=3):
+    if bm25_index is None:
+        return await avector_search(query, top_k)
+    fetch_k = max(top_k, settings.HYBRID_FETCH_K)
+    return _fuse(query, await avector_search(query, fetch_k), fetch_k, top_k)
+
+
 # --- RAG QA Function ---
 def rag_qa(question, history=""):
-    context = retrieve_context(question)
+    if settings.CONTEXT_SELECTION:
+        # Over-fetch: sibling chunks of one answer collapse into one document
+        context = select_context(
+            retrieve_context(question, top_k=settings.HYBRID_FETCH_K)
+        )
+    else:
+        context = retrieve_context(question)
     input_vars = {
         "history": history,
         "context": context,  # pass as list of Document
@@ -197,20 +505,50 @@ def rag_qa(question, history=""):
     return document_chain.invoke(input_vars)
 
 
-def get_db_connection():
+async def _acontext(question):
+    if settings.CONTEXT_SELECTION:
+        return select_context(
+            await aretrieve_context(question, top_k=settings.HYBRID_FETCH_K)
+        )
+    return await aretrieve_context(question)
+
+
+async def arag_qa(question, history="", user_id=None):
+    """rag_qa on the event loop. With ``user_id`` the user's recent chat
+    history is fetched concurrently with retrieval and used as ``history``."""
+    if user_id is None:
+        context = await _acontext(question)
+    else:
+        context, entries = await asyncio.gather(
+            _acontext(question),
+            asyncio.to_thread(get_general_chat_history, user_id),
+        )
+        history = "".join(
+            f"User: {entry['query']}\nAssistant: {entry['response']}\n\n"
+            for entry in entries
+        )
+    return await document_chain.ainvoke(
+        {"history": history, "context": context, "input": question}
+    )
+
+
+def get_db_connection(write: bool = False):
+    # Inside a request, reads are bounded by its deadline; writes saving its
+    # result get a fixed timeout instead
     return psycopg2.connect(
         dbname=settings.DB_NAME,
         user=settings.DB_USER,
         password=settings.DB_PASSWORD,
         host=settings.DB_HOST,
         port=settings.DB_PORT,
+        **(db_write_options() if write else db_deadline_options()),
     )
 
 
 # --- Chat History Storage for General Queries ---
 def store_general_chat_history(user_id: str, query: str, response: str):
     """Store general query chat history in PostgreSQL."""
-    conn = get_db_connection()
+    conn = get_db_connection(write=True)
     c = conn.cursor()
     chat_id = str(uuid.uuid4())
     created_at = datetime.utcnow().isoformat()